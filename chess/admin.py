@@ -2,7 +2,8 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
 
-from .models import Player, LessonClass, RegisteredUser, Game
+from .models import (Player, LessonClass, RegisteredUser, Game, RatingEvent, Tournament, TournamentRound, TournamentPlayer,
+                     ImportCheckpoint)
 #from .models import Club, Player, LessonClass, RegisteredUser, Game
 
 class RegisteredUserInline(admin.StackedInline):
@@ -18,4 +19,9 @@ admin.site.register(User, UserAdmin)
 admin.site.register(Player)
 admin.site.register(LessonClass)
 #admin.site.register(RegisteredUser)
-admin.site.register(Game)
\ No newline at end of file
+admin.site.register(Game)
+admin.site.register(RatingEvent)
+admin.site.register(Tournament)
+admin.site.register(TournamentRound)
+admin.site.register(TournamentPlayer)
+admin.site.register(ImportCheckpoint)
@@ -0,0 +1,36 @@
+import os
+
+from django.db import transaction
+
+from .ingest import file_digest, chunks
+from .models import ImportCheckpoint
+
+# Rows committed together; memory use is bounded by this rather than by the size of the file
+IMPORT_CHUNK_SIZE = 1000
+
+
+def ingest_file(csv_file_path, kind, rows, handle_chunk, chunk_size=IMPORT_CHUNK_SIZE, restart=False):
+    # Feeds a file to handle_chunk(rows) one chunk at a time. Each chunk commits together with the
+    # checkpoint, so after a crash a rerun on the same file starts at the first uncommitted row.
+    # rows(skip) returns the file's rows after the first `skip`. restart ignores any earlier progress.
+    # Returns (rows handled now, rows skipped because an earlier run already imported them).
+    checkpoint, _ = ImportCheckpoint.objects.get_or_create(
+        kind=kind, file_hash=file_digest(csv_file_path), defaults={'file_name': os.path.basename(csv_file_path)})
+
+    if restart:
+        checkpoint.row_offset = 0
+        checkpoint.completed = False
+
+    if checkpoint.completed:
+        return 0, checkpoint.row_offset
+
+    resumed_from = checkpoint.row_offset
+    for chunk in chunks(rows(resumed_from), chunk_size):
+        with transaction.atomic():
+            handle_chunk(chunk)
+            checkpoint.row_offset += len(chunk)
+            checkpoint.save(update_fields=['row_offset', 'updated_at'])
+
+    checkpoint.completed = True
+    checkpoint.save(update_fields=['completed', 'updated_at'])
+    return checkpoint.row_offset - resumed_from, resumed_from
@@ -1,10 +1,9 @@
-from random import choices
-
 from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import AuthenticationForm
 
 from .models import RegisteredUser, Player, Game  # , Club
+from .roster import get_roster
 
 
 class LoginForm(AuthenticationForm):
@@ -68,16 +67,26 @@ RESULTS = [
     ('Draw', 'Draw'),
 ]
 
+class PlayerNameField(forms.CharField):
+    # A "Last, First" name typed into the player picker, resolved through the roster index rather than
+    # rendered as a select over every player
+    widget = forms.TextInput(attrs={'class': 'player-input', 'autocomplete': 'off'})
+
+    def clean(self, value):
+        name = super().clean(value)
+        if not name or name == 'N/A':
+            return None
+        try:
+            return get_roster().resolve(name)
+        except (Player.DoesNotExist, Player.MultipleObjectsReturned) as e:
+            raise forms.ValidationError(str(e))
+
+
 class GameSaveForm(forms.Form):
     board = forms.CharField(max_length=100)
-    white_player = forms.ModelChoiceField(queryset=Player.objects.filter(is_active=True),
-                                          widget=forms.Select,
-                                          label="White Player")
+    white_player = PlayerNameField(max_length=200, required=False, label="White Player")
     result = forms.ChoiceField(choices=RESULTS, widget=forms.Select)
-    black_player = forms.ModelChoiceField(
-                                          queryset=Player.objects.filter(is_active=True),
-                                          widget=forms.Select,
-                                          label="Black Player")
+    black_player = PlayerNameField(max_length=200, required=False, label="Black Player")
 
 
 class PairingDateForm(forms.Form):
@@ -89,6 +98,28 @@ class PairingDateForm(forms.Form):
         self.fields['date'].choices = [(date, date) for date in game_dates]
 
 
+class PairingRangeForm(forms.Form):
+    start_date = forms.ChoiceField(choices=[], widget=forms.Select(), label="From")
+    end_date = forms.ChoiceField(choices=[], widget=forms.Select(), label="To")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        game_dates = Game.objects.values_list('date_of_match', flat=True).distinct().order_by('date_of_match')
+        choices = [(date, date) for date in game_dates]
+        self.fields['start_date'].choices = choices
+        self.fields['end_date'].choices = choices
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('start_date') and cleaned_data.get('end_date') and cleaned_data['start_date'] > cleaned_data['end_date']:
+            raise forms.ValidationError("The first date must not be after the last date.")
+        return cleaned_data
+
+
+class GeneratePairingsForm(forms.Form):
+    date = forms.DateField(label="Date of Match", widget=forms.DateInput(attrs={'type': 'date'}))
+
+
 SEARCH_CHOICES = [
     ('Player', 'Player'),
     ('Board', 'Board'),
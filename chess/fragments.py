@@ -0,0 +1,25 @@
+from django.core.cache import cache
+
+from .versions import get_version
+
+# Rendered fragments and aggregates shared by the pages. Each entry is keyed by the version counters of the
+# tables it reads, so a change to any of them moves the key on and the stale entry simply ages out; nothing
+# is ever deleted explicitly.
+FRAGMENT_KEY = 'chess:fragment:{}:{}'
+FRAGMENT_TIMEOUT = 24 * 60 * 60
+
+_missing = object()
+
+
+def fragment_version(versions):
+    return '-'.join(str(get_version(name)) for name in versions)
+
+
+def cached_fragment(name, versions, build):
+    # build() runs only when no entry exists for the current versions
+    key = FRAGMENT_KEY.format(name, fragment_version(versions))
+    value = cache.get(key, _missing)
+    if value is _missing:
+        value = build()
+        cache.set(key, value, FRAGMENT_TIMEOUT)
+    return value
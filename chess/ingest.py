@@ -0,0 +1,82 @@
+import csv
+import hashlib
+import os
+import re
+from datetime import date, datetime
+from itertools import islice
+
+# CSV parsing for the import commands. Kept free of Django imports so files can be parsed in worker processes.
+
+BOARD_PATTERN = re.compile(r'([A-Z])-([0-9]+)')
+NULL_RESULTS = ['', 'null', 'none']
+
+FILE_HASH_BLOCK_SIZE = 1024 * 1024
+
+# Dates in file names: 2024-01-05 or 01-05-2024 (the format of the ratings sheets)
+ISO_DATE_PATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+US_DATE_PATTERN = re.compile(r'(\d{2})-(\d{2})-(\d{4})')
+
+
+def parse_date(value):
+    # Returns a date for a YYYY-MM-DD string, or None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def date_from_filename(path):
+    name = os.path.basename(path)
+
+    match = ISO_DATE_PATTERN.search(name)
+    if match:
+        year, month, day = match.groups()
+        return date(int(year), int(month), int(day))
+
+    match = US_DATE_PATTERN.search(name)
+    if match:
+        month, day, year = match.groups()
+        return date(int(year), int(month), int(day))
+
+    return None
+
+
+def file_digest(csv_file_path):
+    digest = hashlib.sha256()
+    with open(csv_file_path, 'rb') as f:
+        for block in iter(lambda: f.read(FILE_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_rows(csv_file_path, skip=0):
+    # Yields the file's rows as dicts after the first `skip`, reading as it goes
+    with open(csv_file_path, newline='', encoding='utf-8-sig') as csvfile:
+        yield from islice(csv.DictReader(csvfile, delimiter=','), skip, None)
+
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_game_row(row):
+    # Returns ((board letter, board number, white name, black name, result), None) or (None, problem)
+    match = BOARD_PATTERN.match(row.get('Board#') or '')
+    if not match:
+        return None, f"unreadable board '{row.get('Board#')}'"
+
+    result = row.get('result')
+    if result is None or result.lower() in NULL_RESULTS:
+        result = ''
+
+    return (match.group(1), int(match.group(2)), (row.get('White') or '').strip(), (row.get('Black') or '').strip(), result), None
+
+
+def parse_game_file(csv_file_path):
+    # The whole file parsed at once: [(game or None, problem or None), ...] in file order
+    return [parse_game_row(row) for row in read_rows(csv_file_path)]
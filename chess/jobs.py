@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .write_to_file import write_ratings, write_pairings, write_pairings_archive
+
+logger = logging.getLogger('chess.exports')
+
+# Exports run on a small thread pool inside the web process, so a request only has to queue the job.
+# Jobs live in memory: their status is only visible to the process that queued them, which is what
+# runserver and single-process deployments give us.
+EXPORT_WORKERS = getattr(settings, 'EXPORT_WORKERS', 2)
+# Queued or running jobs allowed at once; identical requests share one job and do not count twice
+MAX_PENDING_JOBS = getattr(settings, 'MAX_PENDING_EXPORT_JOBS', 8)
+# Finished jobs are forgotten after this many seconds
+JOB_TTL = 60 * 60
+
+EXPORTS = {
+    'ratings': write_ratings,
+    'pairings': write_pairings,
+    'pairings_archive': write_pairings_archive,
+}
+
+
+class JobLimitError(Exception):
+    pass
+
+
+class Job:
+
+    def __init__(self, kind, args):
+        self.id = uuid.uuid4().hex
+        self.key = (kind, *args)
+        self.kind = kind
+        self.args = args
+        self.status = 'queued'
+        self.error = None
+        self.file_path = None
+        self.digest = None
+        self.file_name = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def run(self):
+        self.status = 'running'
+        try:
+            self.file_path, self.digest, self.file_name = EXPORTS[self.kind](*self.args)
+            self.status = 'done'
+        except Exception as e:
+            logger.exception('Export %s %s failed', self.kind, self.args)
+            self.error = str(e)
+            self.status = 'failed'
+        finally:
+            self.finished_at = time.time()
+            # Each worker thread has its own database connection
+            close_old_connections()
+
+    def is_pending(self):
+        return self.status in ('queued', 'running')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'file_name': self.file_name,
+            'error': self.error,
+        }
+
+
+_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='export')
+_jobs = {}
+_pending = {}
+_lock = threading.Lock()
+
+
+def prune_jobs():
+    cutoff = time.time() - JOB_TTL
+    for job_id in [job_id for job_id, job in _jobs.items() if job.finished_at and job.finished_at < cutoff]:
+        del _jobs[job_id]
+
+
+def submit_export(kind, *args):
+    # Returns the job building this export, reusing one that is already queued or running
+    if kind not in EXPORTS:
+        raise ValueError(f"Unknown export: {kind}")
+
+    key = (kind, *args)
+    with _lock:
+        prune_jobs()
+
+        job = _pending.get(key)
+        if job is not None and job.is_pending():
+            return job
+
+        if sum(job.is_pending() for job in _pending.values()) >= MAX_PENDING_JOBS:
+            raise JobLimitError("Too many exports are already running, try again in a moment.")
+
+        job = Job(kind, args)
+        _jobs[job.id] = job
+        _pending[key] = job
+
+    def run():
+        job.run()
+        with _lock:
+            if _pending.get(key) is job:
+                del _pending[key]
+
+    _executor.submit(run)
+    return job
+
+
+def get_job(job_id):
+    return _jobs.get(job_id)
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Live result board. save_games publishes the boards it changed on a channel per match date and every open
+# results page subscribed to that date applies them in place.
+#
+# The broker is chosen by the LIVE_BACKEND setting. LocalBackend fans out to subscribers in this process,
+# which covers a single ASGI worker; several workers need a backend that shares messages between them
+# (for example over Redis pub/sub) with the same publish() and subscribe() methods.
+LIVE_BACKEND = getattr(settings, 'LIVE_BACKEND', 'chess.live.LocalBackend')
+
+# Messages a subscriber may fall behind by before it is told to reload instead
+SUBSCRIBER_QUEUE_SIZE = 100
+
+# Sent in place of a message to a subscriber that fell too far behind
+RESYNC = {'event': 'resync'}
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+class Subscription:
+    def __init__(self, backend, channel):
+        self.backend = backend
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, message):
+        # Runs on the subscriber's own event loop
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            message = RESYNC
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.backend.unsubscribe(self)
+
+
+class LocalBackend:
+    # publish() may be called from any thread: under ASGI save_games runs in a worker thread, while each
+    # subscriber waits on the server's event loop
+
+    def __init__(self):
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscribers.get(subscription.channel, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscribers.pop(subscription.channel, None)
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscriptions = list(self.subscribers.get(channel, ()))
+
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # The subscriber's loop has shut down without closing its subscription
+                self.unsubscribe(subscription)
+
+
+def get_broker():
+    global _broker
+
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(LIVE_BACKEND)()
+    return _broker
+
+
+def games_channel(game_date):
+    return f'games:{game_date}'
+
+
+def publish_games(game_date, previous_version, version, games):
+    # games: the changed boards in the shape games_for_date uses. Subscribers still on previous_version
+    # apply them; anyone on another version reloads the night instead.
+    get_broker().publish(games_channel(game_date), {
+        'event': 'games',
+        'previous': previous_version,
+        'version': version,
+        'games': games,
+    })
@@ -0,0 +1,138 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles.fonts import Font
+
+from chess import workbooks
+from chess.pairing import BOARDS
+
+
+def legacy_ratings(template_path, rows, new_file_path):
+    # The export as it was: template reloaded from disk and every cell addressed by name
+    workbook = load_workbook(template_path)
+    sheet = workbook.active
+
+    for index, (name, grade, rating, lesson_class) in enumerate(rows, start=2):
+        sheet[f'A{index}'] = name
+        sheet[f'B{index}'] = grade
+        sheet[f'C{index}'] = rating
+        sheet[f'D{index}'] = lesson_class
+
+    workbook.save(new_file_path)
+
+
+def legacy_pairings(template_path, rows, new_file_path):
+    # The export as it was: template reloaded from disk and column A rescanned for every game
+    workbook = load_workbook(template_path)
+    sheet = workbook.active
+    bold_font = Font(bold=True)
+
+    for board, white_name, white_is_volunteer, black_name, black_is_volunteer in rows:
+        matching_row = None
+        for row_index, row in enumerate(sheet.iter_rows(min_row=2, max_col=1, values_only=True), start=2):
+            if row[0] == board:
+                matching_row = row_index
+                break
+
+        if matching_row:
+            sheet[f'B{matching_row}'] = white_name
+            if white_is_volunteer:
+                sheet[f'B{matching_row}'].font = bold_font
+            sheet[f'D{matching_row}'] = black_name
+            if black_is_volunteer:
+                sheet[f'D{matching_row}'].font = bold_font
+
+    workbook.save(new_file_path)
+
+
+class Command(BaseCommand):
+    help = 'Time the old and new Excel exports on synthetic templates and rows (no database access)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 5000], help='Rows per export')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per size; the fastest is reported')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic rows')
+        parser.add_argument('--dates', type=int, default=40, help='Pairing sheets in the season archive comparison')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='Worker processes for the archive')
+
+    def best_of(self, repeat, export, *args):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            export(*args)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def handle(self, *args, **kwargs):
+        rng = random.Random(kwargs['seed'])
+        repeat = kwargs['repeat']
+
+        with tempfile.TemporaryDirectory() as directory:
+            self.stdout.write(f"{'export':>9} {'rows':>6} {'old s':>8} {'new s':>8} {'speedup':>8}")
+
+            for size in kwargs['sizes']:
+                boards = BOARDS + [f"J-{number}" for number in range(23, 23 + max(size - len(BOARDS), 0))]
+
+                ratings_template = os.path.join(directory, f'RatingsTemplate{size}.xlsx')
+                workbook = Workbook()
+                workbook.active.append(['Name', 'Grade', 'Rating', 'Class'])
+                workbook.save(ratings_template)
+
+                pairings_template = os.path.join(directory, f'PairingTemplate{size}.xlsx')
+                workbook = Workbook()
+                workbook.active.append(['Board', 'White', 'Result', 'Black'])
+                for board in boards[:size]:
+                    workbook.active.append([board, None, None, None])
+                workbook.save(pairings_template)
+
+                ratings = [(f'Player{index}, Synthetic', rng.randint(1, 12), rng.randint(100, 1600), 'Class')
+                           for index in range(size)]
+                # Games arrive in database order, not board order
+                pairings = [(board, f'White{index}, Synthetic', rng.random() < 0.05, f'Black{index}, Synthetic', rng.random() < 0.05)
+                            for index, board in enumerate(boards[:size])]
+                rng.shuffle(pairings)
+
+                output = os.path.join(directory, 'output.xlsx')
+
+                old = self.best_of(repeat, legacy_ratings, ratings_template, ratings, output)
+                new = self.best_of(repeat, lambda: workbooks.fill_ratings(workbooks.get_template(ratings_template), ratings, output))
+                self.stdout.write(f"{'ratings':>9} {size:>6} {old:>8.3f} {new:>8.3f} {old / new:>7.1f}x")
+
+                old = self.best_of(repeat, legacy_pairings, pairings_template, pairings, output)
+                new = self.best_of(repeat, lambda: workbooks.fill_pairings(workbooks.get_template(pairings_template), pairings, output))
+                self.stdout.write(f"{'pairings':>9} {size:>6} {old:>8.3f} {new:>8.3f} {old / new:>7.1f}x")
+
+            # A season of full club nights, built one after another and then across worker processes
+            pairings_template = os.path.join(directory, 'PairingTemplate.xlsx')
+            workbook = Workbook()
+            workbook.active.append(['Board', 'White', 'Result', 'Black'])
+            for board in BOARDS:
+                workbook.active.append([board, None, None, None])
+            workbook.save(pairings_template)
+
+            season = [[(board, f'White{index}, Synthetic', False, f'Black{index}, Synthetic', False)
+                       for index, board in enumerate(BOARDS)] for _ in range(kwargs['dates'])]
+            outputs = [os.path.join(directory, f'Pairings_{night}.xlsx') for night in range(len(season))]
+
+            start = time.perf_counter()
+            for rows, output in zip(season, outputs):
+                workbooks.build_file(workbooks.fill_pairings, pairings_template, rows, output)
+            sequential = time.perf_counter() - start
+
+            with ProcessPoolExecutor(max_workers=kwargs['processes'], mp_context=multiprocessing.get_context('spawn')) as pool:
+                # Start the workers first; a long-running server keeps its pool warm
+                [future.result() for future in [pool.submit(os.getpid) for _ in range(kwargs['processes'])]]
+                start = time.perf_counter()
+                list(pool.map(workbooks.build_file, [workbooks.fill_pairings] * len(season),
+                              [pairings_template] * len(season), season, outputs))
+                parallel = time.perf_counter() - start
+
+            self.stdout.write(f"{len(season)} pairing sheets: {sequential:.3f}s one at a time, "
+                              f"{parallel:.3f}s on {kwargs['processes']} processes ({sequential / parallel:.1f}x)")
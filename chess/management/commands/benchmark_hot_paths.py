@@ -0,0 +1,280 @@
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.test import Client
+from django.test.utils import override_settings
+from openpyxl import Workbook
+
+from chess import write_to_file
+from chess.models import Game
+from chess.pairing import BOARDS
+from chess.search import search_players
+from chess.synthetic import SyntheticClub, scratch_database
+
+# Times the requests and jobs the club waits on, against generated clubs of several sizes in a throwaway
+# database, and writes the results as JSON. Each result carries a threshold; a later run given that file as
+# --baseline fails when a path got slower than its threshold or started running more queries.
+
+BENCHMARK_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}}
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Time the hot paths against generated clubs of several sizes and write the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', type=int, nargs='+', default=[100, 1000, 5000], help='Students in each generated club')
+        parser.add_argument('--dates', type=int, default=30, help='Match dates of games per club')
+        parser.add_argument('--retired-versions', type=int, default=2, help='Inactive older rows kept per player')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per benchmark; the median is compared')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated clubs')
+        parser.add_argument('--only', type=str, nargs='+', default=None, help='Run only benchmarks whose name starts with one of these')
+        parser.add_argument('--output', type=str, default=None, help='Write the results to this JSON file')
+        parser.add_argument('--baseline', type=str, default=None, help='Results of an earlier run to check against')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Slowdown over the median recorded as the threshold')
+        parser.add_argument('--min-delta-ms', type=float, default=5.0, help='Slowdowns smaller than this never count as regressions')
+
+    def handle(self, *args, **kwargs):
+        baseline = None
+        if kwargs['baseline']:
+            try:
+                with open(kwargs['baseline']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read baseline {kwargs['baseline']}: {e}")
+
+        self.repeat = kwargs['repeat']
+        self.only = kwargs['only']
+        self.tolerance = kwargs['tolerance']
+
+        results = {}
+        with tempfile.TemporaryDirectory() as directory, scratch_database(os.path.join(directory, 'benchmark.sqlite3')), \
+                override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver'], CACHES=BENCHMARK_CACHES), self.quiet_logs():
+            self.directory = directory
+            self.stdout.write(f"{'players':>7}  {'benchmark':<28} {'median ms':>10} {'min ms':>10} {'queries':>8}")
+
+            for players in kwargs['scales']:
+                club = SyntheticClub(players=players, dates=kwargs['dates'], seed=kwargs['seed'])
+                results[str(players)] = self.run_scale(club, players, kwargs['retired_versions'])
+
+        report = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': self.git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'options': {key: kwargs[key] for key in ('dates', 'retired_versions', 'repeat', 'seed', 'tolerance')},
+            'results': results,
+        }
+
+        if kwargs['output']:
+            with open(kwargs['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {kwargs['output']}")
+
+        if baseline is not None:
+            self.compare(baseline, report, kwargs['min_delta_ms'])
+
+    @contextmanager
+    def quiet_logs(self):
+        # Every traced save, slow request and export warning would otherwise be logged
+        level = logging.root.manager.disable
+        logging.disable(logging.WARNING)
+        try:
+            yield
+        finally:
+            logging.disable(level)
+
+    @contextmanager
+    def export_files(self, boards):
+        # write_to_file reads its templates from the private files/ folder; point it at stand-ins here
+        ratings_template = os.path.join(self.directory, 'RatingsTemplate.xlsx')
+        workbook = Workbook()
+        workbook.active.append(['Name', 'Grade', 'Rating', 'Class'])
+        workbook.save(ratings_template)
+
+        pairings_template = os.path.join(self.directory, 'PairingTemplate.xlsx')
+        workbook = Workbook()
+        workbook.active.append(['Board', 'White', 'Result', 'Black'])
+        for board in boards:
+            workbook.active.append([board, None, None, None])
+        workbook.save(pairings_template)
+
+        paths = {
+            'RATINGS_TEMPLATE': ratings_template,
+            'PAIRINGS_TEMPLATE': pairings_template,
+            'RATINGS_DIR': os.path.join(self.directory, 'ratings'),
+            'PAIRINGS_DIR': os.path.join(self.directory, 'pairings'),
+        }
+        saved = {name: getattr(write_to_file, name) for name in paths}
+        for name, path in paths.items():
+            setattr(write_to_file, name, path)
+        os.makedirs(paths['RATINGS_DIR'], exist_ok=True)
+        os.makedirs(paths['PAIRINGS_DIR'], exist_ok=True)
+        try:
+            yield paths
+        finally:
+            for name, value in saved.items():
+                setattr(write_to_file, name, value)
+
+    def git_commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def reset_database(self):
+        call_command('flush', interactive=False, verbosity=0)
+        # flush skips the signals, so start the version counters and in-memory copies over too
+        cache.clear()
+        return User.objects.create_user(username='m', password='benchmark', is_staff=True)
+
+    def measure(self, scale, results, name, run, setup=None):
+        # run() is timed; setup() runs untimed before each run
+        if self.only and not any(name.startswith(prefix) for prefix in self.only):
+            return
+
+        timings = []
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                start = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - start) * 1000)
+
+        median = statistics.median(timings)
+        results[name] = {
+            'median_ms': round(median, 3),
+            'min_ms': round(min(timings), 3),
+            'queries': counter.count,
+            'threshold_ms': round(median * (1 + self.tolerance), 3),
+        }
+        self.stdout.write(f'{scale:>7}  {name:<28} {median:>10.2f} {min(timings):>10.2f} {counter.count:>8}')
+
+    def run_scale(self, club, scale, retired_versions):
+        results = {}
+        user = self.reset_database()
+        club.seed(user, retired_versions=retired_versions)
+
+        client = Client()
+        client.force_login(user)
+        last_date = str(club.dates[-1])
+
+        def get(path, status=200, **extra):
+            response = client.get(path, **extra)
+            if response.status_code != status:
+                raise CommandError(f'{path} returned {response.status_code}')
+            return response
+
+        # Pages: cold is the first request after the tables changed, warm is served from the fragment cache
+        self.measure(scale, results, 'home_view cold', lambda: get('/home/'), setup=cache.clear)
+        self.measure(scale, results, 'home_view warm', lambda: get('/home/'))
+
+        games_url = f'/update_games/?game_date={last_date}'
+        self.measure(scale, results, 'update_games', lambda: get(games_url))
+        etag = get(games_url)['ETag']
+        self.measure(scale, results, 'update_games not modified', lambda: get(games_url, status=304, HTTP_IF_NONE_MATCH=etag))
+
+        # A director correcting one result of the latest night, which re-rates that night
+        game = Game.objects.filter(date_of_match=last_date, is_active=True).select_related('white', 'black').order_by('id').first()
+        board = game.get_board()
+        results_cycle = iter(['White', 'Black'] * self.repeat)
+
+        def save():
+            response = client.post('/save_games/', json.dumps({
+                'game_date': last_date,
+                'version': Game.date_version(last_date),
+                'games': [{'board': board, 'white': game.white.name(), 'black': game.black.name(), 'result': next(results_cycle)}],
+            }), content_type='application/json')
+            if response.status_code != 200:
+                raise CommandError(f'save_games returned {response.status_code}: {response.content[:200]}')
+
+        self.measure(scale, results, 'save_games', save)
+
+        # search_results has no template to render yet, so its lookups are timed on their own
+        last_name = club.players[0]['last_name']
+        class_name = club.classes[0]['name'].split(' & ')[0]
+        self.measure(scale, results, 'search_results player', lambda: list(search_players(last_name, 'Player')))
+        self.measure(scale, results, 'search_results class', lambda: list(search_players(class_name, 'Class')))
+        self.measure(scale, results, 'search_results board', lambda: list(Game.objects.filter(
+            Q(board_letter=board[0]) & Q(board_number=int(board[2:])) & Q(is_active=True)).order_by('-date_of_match')))
+
+        # Exports are built from scratch each time rather than taken from the export cache
+        # The template has the club's boards only; larger nights add rows below them, as in the real one
+        with self.export_files(BOARDS) as paths:
+            def clear_exports():
+                for directory in (paths['RATINGS_DIR'], paths['PAIRINGS_DIR']):
+                    shutil.rmtree(os.path.join(directory, write_to_file.EXPORT_CACHE_DIR), ignore_errors=True)
+
+            self.measure(scale, results, 'write_ratings', write_to_file.write_ratings, setup=clear_exports)
+            self.measure(scale, results, 'write_pairings', lambda: write_to_file.write_pairings(last_date), setup=clear_exports)
+
+        # The imports start from an empty database; import_game needs the club imported first
+        csv_directory = os.path.join(self.directory, f'csv{scale}')
+        os.makedirs(csv_directory, exist_ok=True)
+        volunteers_csv, classes_csv, players_csv, game_files = club.write_csv_files(csv_directory)
+
+        def import_data():
+            call_command('import_data', volunteers_csv, classes_csv, players_csv, '--bulk', '--restart', stdout=io.StringIO())
+
+        def import_game():
+            call_command('import_game', *game_files, '--workers', '1', '--restart', stdout=io.StringIO())
+
+        def empty_club():
+            self.reset_database()
+
+        def imported_club():
+            self.reset_database()
+            import_data()
+
+        self.measure(scale, results, 'import_data', import_data, setup=empty_club)
+        self.measure(scale, results, 'import_game', import_game, setup=imported_club)
+
+        return results
+
+    def compare(self, baseline, report, min_delta_ms):
+        regressions = []
+        for scale, benchmarks in report['results'].items():
+            for name, result in benchmarks.items():
+                previous = baseline.get('results', {}).get(scale, {}).get(name)
+                if previous is None:
+                    continue
+
+                if result['median_ms'] > previous['threshold_ms'] and result['median_ms'] - previous['median_ms'] > min_delta_ms:
+                    regressions.append(f"{name} at {scale} players: {result['median_ms']:.2f} ms, "
+                                       f"threshold {previous['threshold_ms']:.2f} ms (was {previous['median_ms']:.2f} ms)")
+                if result['queries'] > previous['queries']:
+                    regressions.append(f"{name} at {scale} players: {result['queries']} queries (was {previous['queries']})")
+
+        if regressions:
+            raise CommandError(f"{len(regressions)} regression(s) against {baseline.get('commit') or 'the baseline'}:\n"
+                               + '\n'.join(regressions))
+        self.stdout.write(f"No regressions against {baseline.get('commit') or 'the baseline'}")
@@ -0,0 +1,41 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from chess.models import Player
+from chess.pairing import pair_players, assign_boards
+
+
+class Command(BaseCommand):
+    help = 'Time the pairing engine on synthetic rosters of increasing size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 250, 500, 1000, 2000],
+                            help='Roster sizes to pair')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per size; the fastest is reported')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic rosters')
+
+    def handle(self, *args, **kwargs):
+        rng = random.Random(kwargs['seed'])
+
+        self.stdout.write(f"{'players':>8} {'seconds':>9} {'ms/player':>10} {'avg gap':>8}")
+        for size in kwargs['sizes']:
+            size += size % 2
+
+            # Unsaved players are enough, the engine only reads ratings and opponent ids
+            players = [Player(id=index + 1, last_name=f'Player{index}', first_name='Synthetic',
+                              rating=rng.randint(100, 1600), is_volunteer=False) for index in range(size)]
+            for player in players:
+                player.opponent_one_id, player.opponent_two_id, player.opponent_three_id = rng.sample(range(1, size + 1), 3)
+
+            best = None
+            for _ in range(kwargs['repeat']):
+                start = time.perf_counter()
+                pairs = pair_players(players)
+                assign_boards(pairs, {})
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+            gap = sum(abs(first.rating - second.rating) for first, second in pairs) / len(pairs)
+            self.stdout.write(f"{size:>8} {best:>9.4f} {best * 1000 / size:>10.3f} {gap:>8.1f}")
@@ -0,0 +1,107 @@
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q, Count
+
+from chess.models import Player, Game
+from chess.pairing import BOARDS
+
+CHECK_DATE = date(2025, 1, 6)
+
+
+def hot_queries():
+    # (name, queryset, whether the index should also give the ORDER BY)
+    # Mirrors the filters used by the views, exports, pairing and rating code
+    ratings_sheet = Player.objects.filter(active_member=True, is_active=True, is_volunteer=False).order_by(
+        '-rating', '-grade', 'last_name', 'first_name')
+    board_changes = Q(board_letter='J', board_number=1) | Q(board_letter='I', board_number=2)
+
+    return [
+        ('ratings sheet', ratings_sheet, True),
+        ('players list', Player.objects.filter(active_member=True, is_active=True).order_by('last_name', 'first_name'), True),
+        ('player by name', Player.objects.filter(last_name='Smith', first_name='Sam', is_active=True), False),
+        ('night of games', Game.objects.filter(date_of_match=CHECK_DATE, is_active=True, tournament_round__isnull=True).select_related('white', 'black'), False),
+        ('changed boards', Game.objects.filter(board_changes, date_of_match=CHECK_DATE, is_active=True, tournament_round__isnull=True), False),
+        ('board taken', Game.objects.filter(date_of_match=CHECK_DATE, board_letter='J', board_number=1, is_active=True), False),
+        ('board search', Game.objects.filter(board_letter='J', board_number=1, is_active=True).order_by('-date_of_match'), True),
+        ('games by date', Game.objects.filter(is_active=True).values('date_of_match').annotate(game_count=Count('id')).order_by('-date_of_match'), False),
+        ('games since date', Game.objects.filter(date_of_match__gte=CHECK_DATE, is_active=True, tournament_round__isnull=True).order_by('date_of_match', 'id'), False),
+    ]
+
+
+def plan_problems(plan, table, ordered):
+    # Full scans of the table itself, and sorts the index should have made unnecessary
+    problems = []
+    if connection.vendor == 'sqlite':
+        for line in plan:
+            if line.startswith(f'SCAN {table}') and 'INDEX' not in line:
+                problems.append('full table scan')
+            if ordered and 'TEMP B-TREE FOR ORDER BY' in line:
+                problems.append('sort not served by an index')
+    elif connection.vendor == 'postgresql':
+        for line in plan:
+            if f'Seq Scan on {table}' in line:
+                problems.append('full table scan')
+    return problems
+
+
+class Command(BaseCommand):
+    help = "Run EXPLAIN on the hot Player and Game queries and fail if any of them scans a whole table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Players to add (with retired versions and a season of games) before checking; '
+                                 'everything is rolled back afterwards')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan')
+
+    def seed(self, count):
+        modified_by = User.objects.first() or User.objects.create(username='query-plan-check')
+        rng = random.Random(0)
+
+        players = [Player(last_name=f'Seed{index}', first_name='Player', rating=rng.randint(100, 1600), grade=rng.randint(1, 12),
+                          is_volunteer=index % 20 == 0, modified_by=modified_by) for index in range(count)]
+        # Retired versions, as left behind by the old versioning scheme
+        players += [Player(last_name=f'Seed{index}', first_name='Player', rating=rng.randint(100, 1600),
+                           is_active=False, modified_by=modified_by) for index in range(count) for _ in range(3)]
+        Player.objects.bulk_create(players, batch_size=1000)
+
+        active = [player for player in players if player.is_active]
+        games = []
+        for week in range(40):
+            for index, board in enumerate(BOARDS[:len(active) // 2]):
+                games.append(Game(date_of_match=CHECK_DATE + timedelta(weeks=week), board_letter=board[0],
+                                  board_number=int(board[2:]), white=active[2 * index], black=active[2 * index + 1],
+                                  result='White', modified_by=modified_by, is_active=week % 4 != 0))
+        Game.objects.bulk_create(games, batch_size=1000)
+
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def handle(self, *args, **kwargs):
+        failures = []
+
+        with transaction.atomic():
+            if kwargs['seed']:
+                self.seed(kwargs['seed'])
+
+            for name, queryset, ordered in hot_queries():
+                table = queryset.model._meta.db_table
+                plan = queryset.explain().splitlines()
+                problems = plan_problems(plan, table, ordered)
+
+                self.stdout.write(f"{'FAIL' if problems else 'ok':>4}  {name}" + (f": {', '.join(problems)}" if problems else ''))
+                if problems or kwargs['verbose_plans']:
+                    for line in plan:
+                        self.stdout.write(f'      {line}')
+                if problems:
+                    failures.append(name)
+
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError(f"{len(failures)} queries lost their index: {', '.join(failures)}")
+        self.stdout.write('All hot queries use an index.')
@@ -0,0 +1,118 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from chess.models import Player, LessonClass, Game, RatingEvent, TournamentPlayer
+from chess.roster import ROSTER_VERSION
+from chess.search import index_players
+from chess.versions import GAME_VERSION, CLASS_VERSION, bump_version
+
+# Retired ids repointed per UPDATE; each one costs three query parameters
+REPOINT_BATCH_SIZE = 300
+
+# Every foreign key to Player that may still point at a retired version
+PLAYER_REFERENCES = [
+    (Game, 'white'), (Game, 'black'),
+    (Player, 'opponent_one'), (Player, 'opponent_two'), (Player, 'opponent_three'),
+    (LessonClass, 'teacher'), (LessonClass, 'co_teacher'),
+    (RatingEvent, 'player'), (TournamentPlayer, 'player'),
+]
+
+
+def repoint(model, field, identity_ids):
+    # identity_ids: {retired id: identity id}; one UPDATE per batch, whatever the number of people
+    retired = list(identity_ids)
+    for start in range(0, len(retired), REPOINT_BATCH_SIZE):
+        batch = retired[start:start + REPOINT_BATCH_SIZE]
+        model.objects.filter(**{f'{field}_id__in': batch}).update(**{f'{field}_id': Case(
+            *[When(**{f'{field}_id': player_id}, then=Value(identity_ids[player_id])) for player_id in batch],
+            output_field=IntegerField())})
+
+
+class Command(BaseCommand):
+    help = 'Fold the per-rating Player version chains into the RatingEvent ledger, leaving one Player row per person'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be folded without saving')
+
+    def handle(self, *args, **kwargs):
+        dry_run = kwargs['dry_run']
+
+        # Every version of a person, oldest first
+        chains = {}
+        for player in Player.objects.order_by('id'):
+            chains.setdefault((player.last_name, player.first_name), []).append(player)
+        chains = {name: versions for name, versions in chains.items() if len(versions) > 1}
+
+        # A chain has one current row; more than one active row under a name means different people who
+        # share it, and folding them would merge their games and ratings
+        shared = {name: versions for name, versions in chains.items() if sum(version.is_active for version in versions) > 1}
+        for (last_name, first_name), versions in shared.items():
+            self.stdout.write(f'Skipped {last_name}, {first_name}: {sum(version.is_active for version in versions)} active '
+                              f'players share the name (ids {", ".join(str(version.id) for version in versions)}). '
+                              f'Rename or merge them by hand, then run this again.')
+            del chains[(last_name, first_name)]
+
+        if not chains:
+            self.stdout.write('No version chains to fold.')
+            return
+
+        retired_ids = {version.id for versions in chains.values() for version in versions}
+        games_by_player = {}
+        for game in Game.objects.filter(Q(white_id__in=retired_ids) | Q(black_id__in=retired_ids)).order_by('date_of_match', 'id'):
+            for player_id in (game.white_id, game.black_id):
+                games_by_player.setdefault(player_id, []).append(game)
+
+        rating_events = []
+        identity_of = {}
+
+        for versions in chains.values():
+            # The current version becomes the stable identity for the person
+            active_versions = [version for version in versions if version.is_active]
+            identity = active_versions[-1] if active_versions else versions[-1]
+
+            for previous, current in zip(versions, versions[1:]):
+                # The clone was made after a game that the previous version played in
+                played = [game for game in games_by_player.get(previous.id, []) if game.is_active]
+                rating_events.append(RatingEvent(
+                    player=identity,
+                    game=played[-1] if played else None,
+                    rating_before=previous.rating,
+                    rating_after=current.rating,
+                    delta=current.rating - previous.rating,
+                    modified_by_id=current.modified_by_id,
+                    created_at=current.created_at,
+                ))
+
+            for version in versions:
+                identity_of[version.id] = identity
+            identity.created_at = versions[0].created_at
+
+        retired = [player_id for player_id, identity in identity_of.items() if player_id != identity.id]
+        self.stdout.write(f'{len(chains)} players, {len(retired)} retired versions, {len(rating_events)} rating events.')
+
+        if dry_run:
+            self.stdout.write('Dry run, nothing saved.')
+            return
+
+        with transaction.atomic():
+            RatingEvent.objects.bulk_create(rating_events)
+
+            # Point everything that referenced an old version at the person's identity row
+            identity_ids = {player_id: identity_of[player_id].id for player_id in retired}
+            for model, field in PLAYER_REFERENCES:
+                repoint(model, field, identity_ids)
+
+            identities = {identity.id: identity for identity in identity_of.values()}.values()
+            Player.objects.bulk_update(identities, ['created_at'])
+            # Nothing references the retired rows any more. Deleting them through the ORM would send a signal
+            # and reindex each one separately, so they go in one statement and leave the index together.
+            with connection.cursor() as cursor:
+                cursor.executemany(f'DELETE FROM {Player._meta.db_table} WHERE id = %s', [(player_id,) for player_id in retired])
+            transaction.on_commit(lambda: index_players(retired))
+
+            transaction.on_commit(lambda: bump_version(ROSTER_VERSION))
+            transaction.on_commit(lambda: bump_version(GAME_VERSION))
+            transaction.on_commit(lambda: bump_version(CLASS_VERSION))
+
+        self.stdout.write('Rating history folded.')
@@ -1,9 +1,35 @@
-import csv
+import copy
+import os
+import time
+from contextlib import nullcontext
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from chess.checkpoints import IMPORT_CHUNK_SIZE, ingest_file
+from chess.ingest import read_rows
 from chess.models import Player, LessonClass
+from chess.roster import ROSTER_VERSION, RosterIndex
+from chess.search import index_players
+from chess.tracing import span
+from chess.versions import CLASS_VERSION, bump_version
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+NULL_VALUES = ['', 'NULL', 'None']
+
+PLAYER_FIELDS = ['rating', 'beginning_rating', 'grade', 'lesson_class', 'active_member', 'is_volunteer',
+                 'parent_or_guardian', 'email', 'phone', 'additional_info', 'modified_by', 'is_active']
+
+
+def parse_int(value, default=None):
+    if value is None or value.strip() in NULL_VALUES:
+        return default
+    return int(value)
+
+
+def stored_value(player, field):
+    # Foreign keys are compared by id so checking a row never loads the related object
+    return getattr(player, Player._meta.get_field(field).attname)
+
 
 class Command(BaseCommand):
     help = 'Import all data from CSV files: volunteers, classes, and players'
@@ -12,27 +38,73 @@ class Command(BaseCommand):
         parser.add_argument('volunteers_csv', type=str, help='The path to the volunteers CSV file')
         parser.add_argument('classes_csv', type=str, help='The path to the classes CSV file')
         parser.add_argument('players_csv', type=str, help='The path to the players CSV file')
+        parser.add_argument('--bulk', action='store_true', help='Write each chunk with set-based inserts and updates instead of one row at a time')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per bulk insert or update')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='Rows committed together; an interrupted import resumes after the last committed chunk')
+        parser.add_argument('--restart', action='store_true', help='Import files again from the start even if an earlier run finished them')
+        parser.add_argument('--dry-run', action='store_true', help='Run the bulk import and roll it back')
+        parser.add_argument('--username', type=str, default='m', help='User recorded as modifying the rows')
 
+    @span('import_data')
     def handle(self, *args, **kwargs):
         volunteers_csv = kwargs['volunteers_csv']
         classes_csv = kwargs['classes_csv']
         players_csv = kwargs['players_csv']
+        self.modified_by = User.objects.get(username=kwargs['username'])
+
+        if kwargs['bulk'] or kwargs['dry_run']:
+            self.bulk_import(volunteers_csv, classes_csv, players_csv, kwargs['batch_size'], kwargs['chunk_size'],
+                             kwargs['restart'], kwargs['dry_run'])
+            return
 
-        self.volunteer_import(volunteers_csv)
-        self.class_import(classes_csv)
-        self.player_import(players_csv)
+        self.row_import(volunteers_csv, classes_csv, players_csv, kwargs['chunk_size'], kwargs['restart'])
 
-    def volunteer_import(self, csv_file_path):
-        self.stdout.write('Starting volunteer import...')
-        with open(csv_file_path, newline='', encoding='utf-8-sig') as csvfile:
-            reader = csv.DictReader(csvfile, delimiter=',')
+    def row_import(self, volunteers_csv, classes_csv, players_csv, chunk_size, restart):
+        # One row at a time through the ORM, streamed in committed chunks with a checkpoint like bulk mode,
+        # so a crash leaves only whole chunks behind and a rerun resumes after the last one
+        # A private index, so a rolled back chunk leaves the shared roster untouched
+        roster = RosterIndex(Player.objects.filter(is_active=True).order_by('id'))
 
-            for row in reader:
-                beginning_rating = row.get('beginning_rating')
-                if beginning_rating in ['', 'NULL', 'None']:
-                    beginning_rating = None
+        for label, kind, csv_file_path, import_rows in (
+                ('volunteer', 'volunteers', volunteers_csv, self.volunteer_import),
+                ('class', 'classes', classes_csv, self.class_import),
+                ('player', 'players', players_csv, self.player_import)):
+            self.stdout.write(f'Starting {label} import...')
+            with span(kind) as trace:
+                handled, skipped = ingest_file(csv_file_path, kind, lambda skip: read_rows(csv_file_path, skip),
+                                               lambda rows: import_rows(rows, roster), chunk_size, restart)
+                trace.set(rows=handled, skipped=skipped)
 
-                player, created = Player.objects.update_or_create(
+            if skipped:
+                self.stdout.write(f'{skipped} rows were already imported from {os.path.basename(csv_file_path)}.')
+            self.stdout.write(f'{label.capitalize()} import completed.')
+
+    def update_or_create_player(self, roster, last_name, first_name, defaults):
+        # Matches on the current version of the player through the roster index
+        player = roster.get(last_name + ", " + first_name)
+
+        if player is None:
+            player = Player.objects.create(last_name=last_name, first_name=first_name, **defaults)
+            roster.add(player)
+            return player, True
+
+        # The index's instance may be shared with other threads and older than the row, so change a copy
+        # and write only the imported columns
+        player = copy.copy(player)
+        for field, value in defaults.items():
+            setattr(player, field, value)
+        player.save(update_fields=list(defaults))
+        return player, False
+
+    def volunteer_import(self, rows, roster):
+        for row in rows:
+            beginning_rating = row.get('beginning_rating')
+            if beginning_rating in ['', 'NULL', 'None']:
+                beginning_rating = None
+
+            try:
+                player, created = self.update_or_create_player(
+                    roster,
                     last_name=row['last_name'].strip(),
                     first_name=row['first_name'].strip(),
                     defaults={
@@ -45,77 +117,72 @@ class Command(BaseCommand):
                         'email': row.get('email'),
                         'phone': row.get('phone'),
 
-                        'modified_by': User.objects.get(username='m'),
+                        'modified_by': self.modified_by,
                         'is_active': True,
                     }
                 )
+            except Player.MultipleObjectsReturned as e:
+                self.stdout.write(f"Skipped {row['last_name']}, {row['first_name']}: {e}")
+                continue
 
-                if created:
-                    player.created_at = timezone.now()
-                    player.save()
-                    self.stdout.write(f'Created Volunteer: {player}')
+            if created:
+                player.created_at = timezone.now()
+                player.save()
+                self.stdout.write(f'Created Volunteer: {player}')
+            else:
+                self.stdout.write(f'Updated Volunteer: {player}')
+
+    def class_import(self, rows, roster):
+        for row in rows:
+            try:
+                teacher_name = row['teacher']
+                co_teacher_name = row.get('co_teacher')
+
+                teacher = roster.resolve_first_name(teacher_name)
+                co_teacher = roster.resolve_first_name(co_teacher_name) if co_teacher_name else None
+
+                if co_teacher:
+                    name = str(teacher.first_name + ' & ' + co_teacher.first_name)
                 else:
-                    self.stdout.write(f'Updated Volunteer: {player}')
+                    name = teacher.first_name
+
+                lesson_class, created = LessonClass.objects.get_or_create(
+                    name=name,
+                    teacher=teacher,
+                    co_teacher=co_teacher,
+                    defaults={
+                        'modified_by': self.modified_by,
+                        'is_active': True,
+                    }
+                )
 
-        self.stdout.write('Volunteer import completed.')
+                if created:
+                    self.stdout.write(f'Created class: {lesson_class.name}')
+                    lesson_class.created_at = timezone.now()
+                    lesson_class.save()
+                else:
+                    self.stdout.write(f'Class already exists: {lesson_class.name}')
 
-    def class_import(self, csv_file_path):
-        self.stdout.write('Starting class import...')
-        with open(csv_file_path, newline='', encoding='utf-8-sig') as csvfile:
-            reader = csv.DictReader(csvfile, delimiter=',')
+            except Player.DoesNotExist:
+                self.stdout.write(f"Teacher or co-teacher not found for class {row.get('name', 'unknown')} (Teacher: {teacher_name}, Co-teacher: {co_teacher_name})")
+            except Exception as e:
+                self.stdout.write(f"Error importing class {row.get('name', 'unknown')}: {str(e)}")
 
-            for row in reader:
+    def player_import(self, rows, roster):
+        for row in rows:
+            lesson_class = None
+            if row.get('lesson_class'):
+                print(row['lesson_class'])
                 try:
-                    teacher_name = row['teacher']
-                    co_teacher_name = row.get('co_teacher')
+                    lesson_class = LessonClass.objects.get(name=row.get('lesson_class'))
+                except LessonClass.DoesNotExist:
+                    self.stdout.write(
+                        f"LessonClass with identifier {row['lesson_class']} not found, skipping player {row['first_name']} {row['last_name']}.")
+                    lesson_class = None
 
-                    teacher = Player.objects.get(first_name__iexact=teacher_name)
-                    co_teacher = Player.objects.get(first_name__iexact=co_teacher_name) if co_teacher_name else None
-
-                    if co_teacher:
-                        name = str(teacher.first_name + ' & ' + co_teacher.first_name)
-                    else:
-                        name = teacher.first_name
-
-                    lesson_class, created = LessonClass.objects.get_or_create(
-                        name=name,
-                        teacher=teacher,
-                        co_teacher=co_teacher,
-                        defaults={
-                            'modified_by': User.objects.get(username='m'),
-                            'is_active': True,
-                        }
-                    )
-
-                    if created:
-                        self.stdout.write(f'Created class: {lesson_class.name}')
-                        lesson_class.created_at = timezone.now()
-                        lesson_class.save()
-                    else:
-                        self.stdout.write(f'Class already exists: {lesson_class.name}')
-
-                except Player.DoesNotExist:
-                    self.stdout.write(f"Teacher or co-teacher not found for class {row.get('name', 'unknown')} (Teacher: {teacher_name}, Co-teacher: {co_teacher_name})")
-                except Exception as e:
-                    self.stdout.write(f"Error importing class {row.get('name', 'unknown')}: {str(e)}")
-        self.stdout.write('Class import completed.')
-
-    def player_import(self, csv_file_path):
-        self.stdout.write('Starting player import...')
-        with open(csv_file_path, newline='', encoding='utf-8-sig') as csvfile:
-            reader = csv.DictReader(csvfile, delimiter=',')
-
-            for row in reader:
-                if row.get('lesson_class'):
-                    print(row['lesson_class'])
-                    try:
-                        lesson_class = LessonClass.objects.get(name=row.get('lesson_class'))
-                    except LessonClass.DoesNotExist:
-                        self.stdout.write(
-                            f"LessonClass with identifier {row['lesson_class']} not found, skipping player {row['first_name']} {row['last_name']}.")
-                        lesson_class = None
-
-                player, created = Player.objects.update_or_create(
+            try:
+                player, created = self.update_or_create_player(
+                    roster,
                     last_name=row['last_name'],
                     first_name=row['first_name'],
                     defaults={
@@ -131,15 +198,176 @@ class Command(BaseCommand):
                         'phone': row.get('phone'),
                         'additional_info': row.get('additional_info'),
 
-                        'modified_by': User.objects.get(username='m'),
+                        'modified_by': self.modified_by,
                         'is_active': True,
                     }
                 )
+            except Player.MultipleObjectsReturned as e:
+                self.stdout.write(f"Skipped {row['last_name']}, {row['first_name']}: {e}")
+                continue
 
-                if created:
-                    player.created_at = timezone.now()
-                    player.save()
-                    self.stdout.write(f'Created: {player}')
+            if created:
+                player.created_at = timezone.now()
+                player.save()
+                self.stdout.write(f'Created: {player}')
+            else:
+                self.stdout.write(f'Updated: {player}')
+
+    def volunteer_values(self, row):
+        return row['last_name'].strip(), row['first_name'].strip(), {
+            'rating': parse_int(row.get('rating'), 100),
+            'beginning_rating': parse_int(row.get('beginning_rating')),
+            'active_member': row.get('active_member', 'True').lower() == 'true',
+            'is_volunteer': True,
+
+            'parent_or_guardian': row.get('parent_or_guardian'),
+            'email': row.get('email'),
+            'phone': row.get('phone'),
+
+            'modified_by': self.modified_by,
+            'is_active': True,
+        }
+
+    def player_values(self, row, classes_by_name):
+        lesson_class = None
+        if row.get('lesson_class'):
+            lesson_class = classes_by_name.get(row['lesson_class'])
+            if lesson_class is None:
+                self.stdout.write(f"LessonClass {row['lesson_class']} not found for player {row['first_name']} {row['last_name']}.")
+
+        return row['last_name'].strip(), row['first_name'].strip(), {
+            'rating': parse_int(row.get('rating'), 100),
+            'beginning_rating': parse_int(row.get('beginning_rating'), 100),
+            'grade': parse_int(row.get('grade')),
+            'lesson_class': lesson_class,
+            'active_member': row.get('active_member', 'True').lower() == 'true',
+            'is_volunteer': row.get('is_volunteer', 'False').lower() == 'true',
+
+            'parent_or_guardian': row.get('parent_or_guardian'),
+            'email': row.get('email'),
+            'phone': row.get('phone'),
+            'additional_info': row.get('additional_info'),
+
+            'modified_by': self.modified_by,
+            'is_active': True,
+        }
+
+    def bulk_import(self, volunteers_csv, classes_csv, players_csv, batch_size, chunk_size, restart, dry_run):
+        # Streams each file in chunks. Existing players and classes are resolved in a couple of queries up
+        # front, and each chunk is written with bulk_create and executemany updates in its own transaction,
+        # together with a checkpoint so an interrupted import resumes where it stopped.
+        # A dry run does all of it inside one transaction that is rolled back.
+        start = time.perf_counter()
+        counts = {'rows': 0, 'created': 0, 'updated': 0, 'classes': 0}
+
+        with transaction.atomic() if dry_run else nullcontext():
+            # A private index, so a rolled back chunk leaves the shared roster untouched
+            roster = RosterIndex(Player.objects.filter(is_active=True).order_by('id'))
+            classes = {(lesson_class.name, lesson_class.teacher_id, lesson_class.co_teacher_id): lesson_class
+                       for lesson_class in LessonClass.objects.all()}
+            classes_by_name = {lesson_class.name: lesson_class for lesson_class in classes.values()}
+
+            def import_players(rows, values):
+                created, updated = self.bulk_upsert_players(roster, [values(row) for row in rows], batch_size)
+                counts['rows'] += len(rows)
+                counts['created'] += created
+                counts['updated'] += updated
+                transaction.on_commit(lambda: bump_version(ROSTER_VERSION))
+
+            def import_classes(rows):
+                new_classes = []
+                for row in rows:
+                    teacher_name = row['teacher']
+                    co_teacher_name = row.get('co_teacher')
+                    try:
+                        teacher = roster.resolve_first_name(teacher_name)
+                        co_teacher = roster.resolve_first_name(co_teacher_name) if co_teacher_name else None
+                    except (Player.DoesNotExist, Player.MultipleObjectsReturned) as e:
+                        self.stdout.write(f"Skipping class (Teacher: {teacher_name}, Co-teacher: {co_teacher_name}): {e}")
+                        continue
+
+                    name = teacher.first_name + ' & ' + co_teacher.first_name if co_teacher else teacher.first_name
+                    key = (name, teacher.id, co_teacher.id if co_teacher else None)
+                    if key not in classes:
+                        classes[key] = LessonClass(name=name, teacher=teacher, co_teacher=co_teacher,
+                                                   modified_by=self.modified_by, is_active=True)
+                        new_classes.append(classes[key])
+
+                LessonClass.objects.bulk_create(new_classes, batch_size=batch_size)
+                for lesson_class in new_classes:
+                    classes_by_name[lesson_class.name] = lesson_class
+                counts['rows'] += len(rows)
+                counts['classes'] += len(new_classes)
+                transaction.on_commit(lambda: bump_version(CLASS_VERSION))
+
+            for label, kind, csv_file_path, handle_chunk in (
+                    ('Volunteers', 'volunteers', volunteers_csv, lambda rows: import_players(rows, self.volunteer_values)),
+                    ('Classes', 'classes', classes_csv, import_classes),
+                    ('Players', 'players', players_csv,
+                     lambda rows: import_players(rows, lambda row: self.player_values(row, classes_by_name)))):
+                before = dict(counts)
+                with span(kind) as trace:
+                    handled, skipped = ingest_file(csv_file_path, kind, lambda skip: read_rows(csv_file_path, skip),
+                                                   handle_chunk, chunk_size, restart)
+                    trace.set(rows=handled, skipped=skipped)
+
+                if skipped:
+                    self.stdout.write(f'{label}: {skipped} rows were already imported from {os.path.basename(csv_file_path)}.')
+                if kind == 'classes':
+                    self.stdout.write(f"Classes: {counts['classes'] - before['classes']} created from {handled} rows.")
                 else:
-                    self.stdout.write(f'Updated: {player}')
-        self.stdout.write('Player import completed.')
+                    self.stdout.write(f"{label}: {counts['created'] - before['created']} created, "
+                                      f"{counts['updated'] - before['updated']} updated from {handled} rows.")
+
+            if dry_run:
+                transaction.set_rollback(True)
+
+        elapsed = time.perf_counter() - start
+        rate = counts['rows'] / elapsed if elapsed else 0
+        self.stdout.write(f"Imported {counts['rows']} rows in {elapsed:.2f}s, {rate:.0f} rows/s.")
+        if dry_run:
+            self.stdout.write('Dry run, nothing saved.')
+
+    def bulk_upsert_players(self, roster, rows, batch_size):
+        # rows: [(last name, first name, field values), ...]; a name repeated in the file keeps its last row
+        # Players whose row matches what is already stored are left alone
+        to_create = {}
+        to_update = {}
+        for last_name, first_name, defaults in rows:
+            try:
+                player = roster.get(last_name + ", " + first_name)
+            except Player.MultipleObjectsReturned as e:
+                self.stdout.write(f'Skipped {last_name}, {first_name}: {e}')
+                continue
+            if player is None:
+                player = to_create.setdefault((last_name, first_name), Player(last_name=last_name, first_name=first_name, **defaults))
+            elif any(stored_value(player, field) != getattr(value, 'pk', value) for field, value in defaults.items()):
+                to_update[player.id] = player
+            for field, value in defaults.items():
+                setattr(player, field, value)
+
+        created = Player.objects.bulk_create(to_create.values(), batch_size=batch_size)
+        self.update_players(list(to_update.values()), batch_size)
+        for player in created:
+            roster.add(player)
+
+        # Bulk writes skip the signals that keep the search index current
+        player_ids = [player.id for player in created] + list(to_update)
+        transaction.on_commit(lambda: index_players(player_ids))
+
+        return len(created), len(to_update)
+
+    def update_players(self, players, batch_size):
+        # executemany instead of bulk_update: building bulk_update's CASE expressions for every field
+        # costs far more than the updates themselves
+        fields = [Player._meta.get_field(name) for name in PLAYER_FIELDS]
+        table = connection.ops.quote_name(Player._meta.db_table)
+        assignments = ', '.join(f'{connection.ops.quote_name(field.column)} = %s' for field in fields)
+
+        with connection.cursor() as cursor:
+            for index in range(0, len(players), batch_size):
+                cursor.executemany(
+                    f"UPDATE {table} SET {assignments} WHERE id = %s",
+                    [[field.get_db_prep_save(getattr(player, field.attname), connection) for field in fields] + [player.id]
+                     for player in players[index:index + batch_size]]
+                )
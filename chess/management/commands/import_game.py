@@ -1,78 +1,167 @@
-import csv
-import re
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 
-from django.core.management.base import BaseCommand
-from chess.models import Player, Game
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from chess.checkpoints import IMPORT_CHUNK_SIZE, ingest_file
+from chess.ingest import parse_date, date_from_filename, parse_game_file, parse_game_row, read_rows
+from chess.models import Game, Player
+from chess.roster import get_roster
+from chess.tracing import current_span, span
+from chess.versions import GAME_VERSION, bump_version
 from django.contrib.auth.models import User
-from django.utils import timezone
+
+# Files up to this size are parsed whole by the worker processes; larger ones are streamed
+PARALLEL_PARSE_BYTES = 8 * 1024 * 1024
 
 
 class Command(BaseCommand):
-    help = 'Import all data from CSV files: volunteers, classes, and players'
+    help = 'Import games from CSV files, one match date per file'
 
     def add_arguments(self, parser):
-        parser.add_argument('game_csv', type=str, help='The path to the Game CSV file')
-        parser.add_argument('date_of_match', type=str, help='When were the games scheduled')
+        parser.add_argument('inputs', nargs='+', type=str,
+                            help='Game CSV files, each optionally followed by its date of match (YYYY-MM-DD), or '
+                                 'directories of CSV files whose names contain the date')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processes used to parse the files')
+        parser.add_argument('--batch-size', type=int, default=500, help='Games per insert')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='Rows committed together')
+        parser.add_argument('--restart', action='store_true', help='Import files again from the start even if an earlier run finished them')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be imported without saving')
+        parser.add_argument('--username', type=str, default='m', help='User recorded as creating the games')
+
+    def collect_files(self, inputs):
+        # Returns [(path, date of match), ...]; a date argument applies to the file just before it
+        files = []
+        for item in inputs:
+            date_of_match = parse_date(item)
+            if date_of_match is not None and files:
+                files[-1] = (files[-1][0], date_of_match)
+            elif os.path.isdir(item):
+                for name in sorted(os.listdir(item)):
+                    if name.lower().endswith('.csv'):
+                        path = os.path.join(item, name)
+                        files.append((path, date_from_filename(path)))
+            elif os.path.isfile(item):
+                files.append((item, date_from_filename(item)))
+            else:
+                raise CommandError(f"'{item}' is not a file, directory or date.")
+
+        undated = [path for path, date_of_match in files if date_of_match is None]
+        if undated:
+            raise CommandError('No date of match given or found in the name of: ' + ', '.join(undated))
+        return files
 
+    @span('import_game')
     def handle(self, *args, **kwargs):
-        game_csv = kwargs['game_csv']
-        date_of_match = kwargs['date_of_match']
-
-        self.game_import(game_csv, date_of_match)
-
-    def game_import(self, csv_file_path, date):
-        self.stdout.write('Starting game import...')
-        with open(csv_file_path, newline='', encoding='utf-8-sig') as csvfile:
-            reader = csv.DictReader(csvfile, delimiter=',')
-
-            pattern = re.compile(r'([A-Z])-([0-9]+)')
-
-            for row in reader:
-                match = pattern.match(row['Board#'])
-                if match:
-                    board_letter = match.group(1)
-                    board_number = int(match.group(2))
-                #print(board_letter, board_number)
-
-                white = None
-                if row['White']:
-                    try:
-                        last_name_white, first_name_white = row['White'].split(', ')
-                        #print("last name: " + last_name_white, "first name: " + first_name_white)
-                        white = Player.objects.get(last_name=last_name_white, first_name=first_name_white)
-                    except Player.DoesNotExist:
-                        self.stdout.write(f"White player '{row['White']}' not found.")
-
-                black = None
-                if row['Black']:
-                    try:
-                        last_name_black, first_name_black = row['Black'].split(', ')
-                        #print("last name: " + last_name_black, "first name: " + first_name_black)
-                        black = Player.objects.get(last_name=last_name_black, first_name=first_name_black)
-                    except Player.DoesNotExist:
-                        self.stdout.write(f"Black player '{row['Black']}' not found.")
-
-                result = row.get('result')
-                if result is None or result.lower() in ['', 'NULL', 'None']:
-                    result = ''
-
-                game, created = Game.objects.get_or_create(
-                    date_of_match=date,
+        files = self.collect_files(kwargs['inputs'])
+        dry_run = kwargs['dry_run']
+        start = time.perf_counter()
+        current_span().set(files=len(files), dry_run=dry_run)
+
+        # Small files are parsed up front in parallel; large ones are streamed so memory stays bounded
+        small = [path for path, _ in files if os.path.getsize(path) <= PARALLEL_PARSE_BYTES]
+        with span('parse', files=len(small)):
+            if len(small) > 1 and kwargs['workers'] > 1:
+                with ProcessPoolExecutor(max_workers=kwargs['workers'], mp_context=multiprocessing.get_context('spawn')) as pool:
+                    parsed = dict(zip(small, pool.map(parse_game_file, small)))
+            else:
+                parsed = {}
+
+        with span('roster'):
+            roster = get_roster()
+        modified_by = User.objects.get(username=kwargs['username'])
+        counts = {'rows': 0, 'games': 0, 'duplicates': 0}
+        unknown = {}
+        ambiguous = {}
+
+        def find_player(name, path):
+            # Unknown and ambiguous names are both imported as no player and listed at the end
+            try:
+                player = roster.get(name)
+            except Player.MultipleObjectsReturned:
+                ambiguous.setdefault(name, set()).add(os.path.basename(path))
+                return None
+            if name and player is None:
+                unknown.setdefault(name, set()).add(os.path.basename(path))
+            return player
+
+        def import_games(path, date_of_match, rows):
+            # Boards already taken on this date, looked up for just this chunk
+            boards = {(game[0], game[1]) for game, _ in rows if game is not None}
+            taken = set(Game.objects.filter(
+                date_of_match=date_of_match, is_active=True,
+                board_letter__in={letter for letter, _ in boards}, board_number__in={number for _, number in boards}
+            ).values_list('board_letter', 'board_number'))
+
+            games = []
+            for game, problem in rows:
+                counts['rows'] += 1
+                if problem is not None:
+                    self.stdout.write(f'{os.path.basename(path)}: {problem}')
+                    continue
+
+                board_letter, board_number, white_name, black_name, result = game
+                if (board_letter, board_number) in taken:
+                    counts['duplicates'] += 1
+                    continue
+                taken.add((board_letter, board_number))
+
+                white = find_player(white_name, path)
+                black = find_player(black_name, path)
+
+                games.append(Game(
+                    date_of_match=date_of_match,
+                    board_letter=board_letter,
+                    board_number=board_number,
                     white=white,
                     black=black,
-                    board_number=board_number,
-                    board_letter=board_letter,
-                    defaults={
-                        'result': result,
-                        'modified_by': User.objects.get(username='m'),
-                        'is_active': True,
-                    }
-                )
-
-                if created:
-                    self.stdout.write(f'Created game: {game}')
-                    game.created_at = timezone.now()
-                    game.save()
+                    result=result,
+                    modified_by=modified_by,
+                    is_active=True,
+                ))
+
+            Game.objects.bulk_create(games, batch_size=kwargs['batch_size'])
+            counts['games'] += len(games)
+            transaction.on_commit(lambda: bump_version(GAME_VERSION))
+
+        with transaction.atomic() if dry_run else nullcontext():
+            for path, date_of_match in files:
+                if path in parsed:
+                    rows = lambda skip, path=path: parsed.pop(path)[skip:]
                 else:
-                    self.stdout.write(f'Game already exists: {game}')
-        self.stdout.write('Game import completed.')
\ No newline at end of file
+                    rows = lambda skip, path=path: (parse_game_row(row) for row in read_rows(path, skip))
+
+                before = counts['games']
+                with span('file', file=os.path.basename(path), date=date_of_match) as trace:
+                    handled, skipped = ingest_file(path, f'games {date_of_match}', rows,
+                                                   lambda chunk: import_games(path, date_of_match, chunk), kwargs['chunk_size'],
+                                                   kwargs['restart'])
+                    trace.set(rows=handled, skipped=skipped, games=counts['games'] - before)
+
+                message = f'{os.path.basename(path)} ({date_of_match}): {counts["games"] - before} new games from {handled} rows'
+                if skipped:
+                    message += f', {skipped} rows already imported by an earlier run'
+                self.stdout.write(message + '.')
+
+            if dry_run:
+                transaction.set_rollback(True)
+
+        elapsed = time.perf_counter() - start
+        rate = counts['rows'] / elapsed if elapsed else 0
+        self.stdout.write(f"{counts['games']} games imported from {len(files)} files, {counts['duplicates']} already existed "
+                          f"({counts['rows']} rows in {elapsed:.2f}s, {rate:.0f} rows/s).")
+
+        for names, problem in ((unknown, 'were not found'), (ambiguous, 'belong to more than one player')):
+            if not names:
+                continue
+            self.stdout.write(f'{len(names)} names {problem} and were imported as no player:')
+            for name in sorted(names):
+                found_in = sorted(names[name])
+                found_in = ', '.join(found_in) if len(found_in) <= 3 else f'{len(found_in)} files'
+                self.stdout.write(f"  {name} ({found_in})")
+
+        if dry_run:
+            self.stdout.write('Dry run, nothing saved.')
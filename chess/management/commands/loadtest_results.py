@@ -0,0 +1,326 @@
+import json
+import logging
+import math
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.signals import got_request_exception
+from django.db import OperationalError
+from django.db.models import Count
+from django.test.utils import override_settings
+
+from chess.models import Game, Player
+from chess.synthetic import SyntheticClub, scratch_database
+
+# Match night under load: directors entering results for the same date while parents keep reloading the
+# home page. Writers follow input_results.html: load the night, change a few boards, post only those with
+# the version token, and redo their changes on top of the new games after a conflict. Afterwards the
+# database is checked for boards or players that ended up with more than one active row.
+
+RESULTS = ['White', 'Black', 'Draw', 'NONE']
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, percent):
+    # Nearest rank
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)]
+
+
+class Session:
+    # One browser: its own cookies, logged in through the login form like a person would
+    def __init__(self, base_url, timeout, record):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.record = record
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies))
+
+    def csrf_token(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == settings.CSRF_COOKIE_NAME), '')
+
+    def login(self, username, password):
+        self.opener.open(self.base_url + '/', timeout=self.timeout).read()
+        data = urlencode({'username': username, 'password': password, 'csrfmiddlewaretoken': self.csrf_token()})
+        self.opener.open(Request(self.base_url + '/', data=data.encode(), headers={'Referer': self.base_url + '/'}),
+                         timeout=self.timeout).read()
+        if not any(cookie.name == settings.SESSION_COOKIE_NAME for cookie in self.cookies):
+            raise CommandError(f'Could not log in to {self.base_url} as {username}')
+
+    def request(self, operation, path, payload=None):
+        # Returns (status, parsed JSON body or None); every request is recorded, failures included
+        headers = {'Referer': self.base_url + '/'}
+        data = None
+        if payload is not None:
+            data = json.dumps(payload).encode()
+            headers.update({'Content-Type': 'application/json', 'X-CSRFToken': self.csrf_token()})
+
+        start = time.perf_counter()
+        status, body, error = None, b'', None
+        try:
+            with self.opener.open(Request(self.base_url + path, data=data, headers=headers), timeout=self.timeout) as response:
+                status, body = response.status, response.read()
+        except HTTPError as e:
+            status, body = e.code, e.read()
+        except (socket.timeout, TimeoutError):
+            error = 'timeout'
+        except (URLError, ConnectionError) as e:
+            error = f'connection: {getattr(e, "reason", e)}'
+        self.record(operation, time.perf_counter() - start, status, error)
+
+        try:
+            return status, json.loads(body) if body and status is not None and status < 500 else None
+        except ValueError:
+            return status, None
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    # The access log would print every request of the run
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Drive concurrent result entry and home page readers against a server and report latency, errors and duplicates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4, help='Directors saving results at the same time')
+        parser.add_argument('--readers', type=int, default=8, help='Parents reloading the home page at the same time')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run for')
+        parser.add_argument('--boards-per-save', type=int, default=3, help='Boards changed in each save')
+        parser.add_argument('--think-ms', type=float, default=0, help='Pause between one user\'s requests')
+        parser.add_argument('--retries', type=int, default=3, help='Times a writer redoes a save after a conflict')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request counts as timed out')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the club and the changes made')
+        parser.add_argument('--players', type=int, default=300, help='Students in the generated club')
+        parser.add_argument('--dates', type=int, default=8, help='Match dates already played in the generated club')
+        parser.add_argument('--sqlite-timeout', type=float, default=None,
+                            help='Seconds SQLite waits on a locked database (default: the configured value)')
+        parser.add_argument('--url', type=str, default=None,
+                            help='Drive this running server instead of a built-in one on a generated club. It must use '
+                                 'the configured database, which is read for the match date and the duplicate check.')
+        parser.add_argument('--date', type=str, default=None, help='Match date to enter results for (default: the latest)')
+        parser.add_argument('--username', type=str, default='loadtest', help='User to log in as with --url')
+        parser.add_argument('--password', type=str, default=None, help='Password for --username with --url')
+        parser.add_argument('--output', type=str, default=None, help='Also write the report to this JSON file')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['url'] and not kwargs['password']:
+            raise CommandError('--url needs --password for --username.')
+
+        self.records = []
+        # Only the built-in server can see why a request failed on the server side
+        self.server_errors = None if kwargs['url'] else Counter()
+
+        level = logging.root.manager.disable
+        logging.disable(logging.WARNING)
+        try:
+            if kwargs['url']:
+                report = self.run(kwargs['url'], kwargs['username'], kwargs['password'], kwargs)
+            else:
+                with self.built_in_server(kwargs) as (url, username, password):
+                    report = self.run(url, username, password, kwargs)
+        finally:
+            logging.disable(level)
+
+        self.print_report(report)
+        if kwargs['output']:
+            with open(kwargs['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {kwargs['output']}")
+
+        if report['duplicates']['games'] or report['duplicates']['players']:
+            raise CommandError('Duplicate active rows found after the run.')
+
+    @contextmanager
+    def built_in_server(self, kwargs):
+        # A generated club in a scratch database, served by the threaded server runserver uses, one thread
+        # and one database connection per request
+        database = settings.DATABASES['default']
+        options = database.setdefault('OPTIONS', {})
+        sqlite_timeout = options.get('timeout')
+        if kwargs['sqlite_timeout'] is not None:
+            options['timeout'] = kwargs['sqlite_timeout']
+
+        def count_exception(sender, request=None, **extra):
+            # Sent from inside the handler's except block
+            exception = sys.exc_info()[1]
+            if isinstance(exception, OperationalError) and 'locked' in str(exception):
+                self.server_errors['database is locked'] += 1
+            elif exception is not None:
+                self.server_errors[type(exception).__name__] += 1
+
+        with tempfile.TemporaryDirectory() as directory, scratch_database(os.path.join(directory, 'loadtest.sqlite3')), \
+                override_settings(DEBUG=False, ALLOWED_HOSTS=['127.0.0.1', 'localhost'],
+                                  CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'loadtest'}}):
+            password = 'loadtest'
+            user = User.objects.create_user(username='loadtest', password=password)
+            SyntheticClub(players=kwargs['players'], dates=kwargs['dates'], seed=kwargs['seed']).seed(user)
+
+            server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=True)
+            server.set_app(WSGIHandler())
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            got_request_exception.connect(count_exception)
+            try:
+                yield f'http://127.0.0.1:{server.server_port}', user.username, password
+            finally:
+                got_request_exception.disconnect(count_exception)
+                server.shutdown()
+                server.server_close()
+                if sqlite_timeout is None:
+                    options.pop('timeout', None)
+                else:
+                    options['timeout'] = sqlite_timeout
+
+    def record(self, operation, seconds, status, error):
+        # list.append is atomic, so the user threads share one list
+        self.records.append((operation, seconds, status, error))
+
+    def run(self, url, username, password, kwargs):
+        game_date = kwargs['date'] or Game.objects.filter(is_active=True).order_by('-date_of_match').values_list(
+            'date_of_match', flat=True).first()
+        if game_date is None:
+            raise CommandError('No games to enter results for; give --date.')
+        game_date = str(game_date)
+
+        sessions = []
+        for _ in range(kwargs['writers'] + kwargs['readers']):
+            session = Session(url, kwargs['timeout'], self.record)
+            session.login(username, password)
+            sessions.append(session)
+
+        saves = Counter()
+        think = kwargs['think_ms'] / 1000
+        start = time.perf_counter()
+        deadline = start + kwargs['duration']
+
+        def writer(session, rng):
+            games_path = f'/update_games/?{urlencode({"game_date": game_date})}'
+            while time.perf_counter() < deadline:
+                status, data = session.request('update_games', games_path)
+                if status != 200 or data is None:
+                    saves['failed'] += 1
+                    time.sleep(think)
+                    continue
+
+                boards = rng.sample(data['games'], min(kwargs['boards_per_save'], len(data['games'])))
+                for attempt in range(kwargs['retries'] + 1):
+                    changes = []
+                    for game in boards:
+                        white, black = game['white'], game['black']
+                        if rng.random() < 0.1:
+                            white, black = black, white
+                        result = game['result'] or 'NONE'
+                        changes.append({'board': game['board'], 'white': white,
+                                        'result': rng.choice([other for other in RESULTS if other != result]), 'black': black})
+
+                    status, data = session.request('save_games', '/save_games/', {
+                        'game_date': game_date, 'version': data['version'], 'games': changes})
+                    if status == 409 and data is not None:
+                        # Someone else saved first: redo the same boards on top of their games
+                        saves['conflicts'] += 1
+                        current = {game['board']: game for game in data['games']}
+                        boards = [current.get(game['board'], game) for game in boards]
+                        continue
+                    saves['succeeded' if status == 200 else 'failed'] += 1
+                    break
+                else:
+                    saves['gave up'] += 1
+                time.sleep(think)
+
+        def reader(session):
+            while time.perf_counter() < deadline:
+                session.request('home_view', '/home/')
+                time.sleep(think)
+
+        threads = [threading.Thread(target=writer, args=(session, random.Random(kwargs['seed'] + index)))
+                   for index, session in enumerate(sessions[:kwargs['writers']])]
+        threads += [threading.Thread(target=reader, args=(session,)) for session in sessions[kwargs['writers']:]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        return {
+            'url': url,
+            'date': game_date,
+            'writers': kwargs['writers'],
+            'readers': kwargs['readers'],
+            'seconds': round(elapsed, 3),
+            'operations': self.summarize(elapsed),
+            'saves': dict(saves),
+            'server_errors': dict(self.server_errors) if self.server_errors is not None else None,
+            'duplicates': self.find_duplicates(),
+        }
+
+    def summarize(self, elapsed):
+        operations = {}
+        for name in sorted({record[0] for record in self.records}):
+            records = [record for record in self.records if record[0] == name]
+            latencies = sorted(seconds * 1000 for _, seconds, _, _ in records)
+            summary = {
+                'requests': len(records),
+                'per_second': round(len(records) / elapsed, 2),
+                **{f'p{percent}_ms': round(percentile(latencies, percent), 2) for percent in PERCENTILES},
+                'max_ms': round(latencies[-1], 2),
+                'statuses': dict(Counter(str(status) for _, _, status, error in records if error is None)),
+                'errors': dict(Counter(error for _, _, _, error in records if error is not None)),
+            }
+            operations[name] = summary
+        return operations
+
+    def find_duplicates(self):
+        # More than one active row for a board on a date, or for a player name, means two saves interleaved
+        games = Game.objects.filter(is_active=True, tournament_round__isnull=True).values(
+            'date_of_match', 'board_letter', 'board_number').annotate(rows=Count('id')).filter(rows__gt=1)
+        players = Player.objects.filter(is_active=True).values('last_name', 'first_name').annotate(
+            rows=Count('id')).filter(rows__gt=1)
+        return {
+            'games': [f"{game['date_of_match']} {game['board_letter']}-{game['board_number']}: {game['rows']} rows" for game in games],
+            'players': [f"{player['last_name']}, {player['first_name']}: {player['rows']} rows" for player in players],
+        }
+
+    def print_report(self, report):
+        self.stdout.write(f"{report['seconds']:.1f}s against {report['url']} for {report['date']}: "
+                          f"{report['writers']} writers, {report['readers']} readers")
+        self.stdout.write(f"{'operation':<14} {'requests':>9} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}  statuses")
+        for name, summary in report['operations'].items():
+            statuses = ', '.join(f'{status}: {count}' for status, count in sorted(summary['statuses'].items()))
+            errors = ', '.join(f'{error}: {count}' for error, count in sorted(summary['errors'].items()))
+            self.stdout.write(f"{name:<14} {summary['requests']:>9} {summary['per_second']:>8.1f} {summary['p50_ms']:>9.1f} "
+                              f"{summary['p95_ms']:>9.1f} {summary['p99_ms']:>9.1f} {summary['max_ms']:>9.1f}  "
+                              f"{statuses}{'; ' + errors if errors else ''}")
+
+        saves = report['saves']
+        self.stdout.write(f"Saves: {saves.get('succeeded', 0)} succeeded, {saves.get('conflicts', 0)} conflicts redone, "
+                          f"{saves.get('gave up', 0)} given up, {saves.get('failed', 0)} failed")
+
+        if report['server_errors'] is not None:
+            self.stdout.write('Server errors: ' + (', '.join(f'{error}: {count}' for error, count in report['server_errors'].items()) or 'none'))
+
+        duplicates = report['duplicates']
+        if duplicates['games'] or duplicates['players']:
+            for line in duplicates['games'] + duplicates['players']:
+                self.stdout.write(f'Duplicate active rows: {line}')
+        else:
+            self.stdout.write('No duplicate active games or players')
@@ -0,0 +1,137 @@
+import time
+from datetime import datetime
+from itertools import groupby
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from chess.models import Player, Game, RatingEvent
+from chess.ratings import RESULT_SCORES, replay_periods
+from chess.roster import ROSTER_VERSION
+from chess.versions import bump_version
+
+
+class Command(BaseCommand):
+    help = 'Rebuild every rating from the active Game history, one match date at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report rating differences without saving')
+        parser.add_argument('--history', action='store_true', help='Also rebuild the RatingEvent ledger')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per database round trip')
+        parser.add_argument('--username', type=str, default='m', help='User recorded as modifying the ratings')
+
+    def handle(self, *args, **kwargs):
+        dry_run = kwargs['dry_run']
+        history = kwargs['history']
+        chunk_size = kwargs['chunk_size']
+
+        players = {player.id: player for player in Player.objects.filter(is_active=True)}
+
+        # Players start from their beginning rating; anyone without one starts from where the ledger
+        # first saw them, or their current rating if they were never rated
+        first_ratings = {}
+        for player_id, rating_before in RatingEvent.objects.order_by('-created_at', '-id').values_list(
+                'player_id', 'rating_before').iterator(chunk_size=chunk_size):
+            first_ratings[player_id] = rating_before
+
+        ratings = {}
+        for player_id, player in players.items():
+            if player.is_volunteer:
+                continue
+            if player.beginning_rating is not None:
+                ratings[player_id] = player.beginning_rating
+            else:
+                ratings[player_id] = first_ratings.get(player_id, player.rating)
+
+        games = Game.objects.filter(is_active=True, result__in=RESULT_SCORES, tournament_round__isnull=True).order_by('date_of_match', 'id').values_list(
+            'date_of_match', 'id', 'white_id', 'black_id', 'result').iterator(chunk_size=chunk_size)
+
+        counts = {'games': 0, 'skipped': 0}
+        game_dates = {}
+
+        def periods():
+            for date_of_match, day in groupby(games, key=lambda game: game[0]):
+                played_at = timezone.make_aware(datetime.combine(date_of_match, datetime.min.time()))
+                pairings = []
+                for _, game_id, white_id, black_id, result in day:
+                    counts['games'] += 1
+                    if history:
+                        game_dates[game_id] = played_at
+                    # Volunteers and players no longer on the roster do not move ratings
+                    if white_id in ratings and black_id in ratings:
+                        pairings.append((game_id, white_id, black_id, result))
+                    else:
+                        counts['skipped'] += 1
+                yield pairings
+
+        start = time.perf_counter()
+
+        rated_games = {}
+        events = []
+        for player_id, game_id, rating_before, rating_after in replay_periods(periods(), ratings):
+            rated_games.setdefault(player_id, []).append(game_id)
+            if history:
+                events.append((player_id, game_id, rating_before, rating_after))
+
+        elapsed = time.perf_counter() - start
+        rate = counts['games'] / elapsed if elapsed else 0
+        self.stdout.write(f"Replayed {counts['games']} games ({counts['skipped']} skipped) in {elapsed:.2f}s, {rate:.0f} games/s.")
+
+        changed = [player for player_id, player in players.items() if player_id in ratings and player.rating != ratings[player_id]]
+        for player in sorted(changed, key=lambda player: (player.last_name, player.first_name)):
+            self.stdout.write(f'{player.name()}: {player.rating} -> {ratings[player.id]}')
+        self.stdout.write(f'{len(changed)} ratings differ from the current ratings.')
+
+        if dry_run:
+            self.stdout.write('Dry run, nothing saved.')
+            return
+
+        # Last three opponents come from the last three games each player was rated in
+        game_opponents = {}
+        last_game_ids = {game_id for game_ids in rated_games.values() for game_id in game_ids[-3:]}
+        for game_id, white_id, black_id in Game.objects.filter(id__in=last_game_ids).values_list('id', 'white_id', 'black_id').iterator(chunk_size=chunk_size):
+            game_opponents[game_id] = (white_id, black_id)
+
+        modified_by = User.objects.get(username=kwargs['username'])
+        updated = []
+        for player_id, rating in ratings.items():
+            player = players[player_id]
+            game_ids = rated_games.get(player_id, [])
+            if player.rating == rating and not game_ids:
+                continue
+
+            last_opponents = [None, None, None]
+            for game_id in game_ids[-3:]:
+                white_id, black_id = game_opponents[game_id]
+                last_opponents.append(black_id if white_id == player_id else white_id)
+
+            player.rating = rating
+            player.opponent_one_id = last_opponents[-1]
+            player.opponent_two_id = last_opponents[-2]
+            player.opponent_three_id = last_opponents[-3]
+            player.modified_by = modified_by
+            updated.append(player)
+
+        with transaction.atomic():
+            Player.objects.bulk_update(updated, ['rating', 'opponent_one', 'opponent_two', 'opponent_three', 'modified_by'], batch_size=chunk_size)
+
+            if history:
+                RatingEvent.objects.all().delete()
+                RatingEvent.objects.bulk_create((
+                    RatingEvent(
+                        player_id=player_id,
+                        game_id=game_id,
+                        rating_before=rating_before,
+                        rating_after=rating_after,
+                        delta=rating_after - rating_before,
+                        modified_by=modified_by,
+                        created_at=game_dates[game_id],
+                    )
+                    for player_id, game_id, rating_before, rating_after in events
+                ), batch_size=chunk_size)
+
+            transaction.on_commit(lambda: bump_version(ROSTER_VERSION))
+
+        self.stdout.write(f'Saved {len(updated)} ratings.')
@@ -0,0 +1,42 @@
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from chess.models import Player
+from chess.synthetic import SEASON_START, SyntheticClub, clear_club
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with a generated club: volunteers, classes, players and a season of rated games'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=300, help='Students in the club')
+        parser.add_argument('--volunteers', type=int, default=None, help='Volunteers (default: one per 15 students)')
+        parser.add_argument('--classes', type=int, default=None, help='Lesson classes (default: one per two volunteers)')
+        parser.add_argument('--dates', type=int, default=30, help='Weekly match dates with games')
+        parser.add_argument('--retired-versions', type=int, default=2, help='Inactive older rows kept per player')
+        parser.add_argument('--start-date', type=date.fromisoformat, default=SEASON_START, help='First match date (YYYY-MM-DD)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same club')
+        parser.add_argument('--csv', type=str, default=None, help='Also write the club as import CSV files to this directory')
+        parser.add_argument('--clear', action='store_true', help='Delete every player, class, game and tournament first')
+        parser.add_argument('--username', type=str, default='m', help='User recorded as modifying the rows (created if missing)')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['clear']:
+            clear_club()
+        elif Player.objects.exists():
+            raise CommandError('The database already has players. Use --clear to replace them.')
+
+        modified_by, _ = User.objects.get_or_create(username=kwargs['username'])
+
+        club = SyntheticClub(players=kwargs['players'], volunteers=kwargs['volunteers'], classes=kwargs['classes'],
+                             dates=kwargs['dates'], seed=kwargs['seed'], start_date=kwargs['start_date'])
+        counts = club.seed(modified_by, retired_versions=kwargs['retired_versions'])
+
+        for kind, count in counts.items():
+            self.stdout.write(f'{kind}: {count}')
+
+        if kwargs['csv']:
+            files = club.write_csv_files(kwargs['csv'])
+            self.stdout.write(f'Wrote {3 + len(files[3])} CSV files to {kwargs["csv"]}')
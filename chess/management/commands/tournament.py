@@ -0,0 +1,71 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from chess.models import Player, Tournament
+from chess.tournament import create_tournament, pair_next_round, sync_results, get_standings
+
+
+class Command(BaseCommand):
+    help = 'Run a Swiss-system tournament: create it, pair each round, apply results and show standings'
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+
+        create = subparsers.add_parser('create', help='Create a tournament with every active, non-volunteer member')
+        create.add_argument('name', type=str, help='Name of the tournament')
+        create.add_argument('rounds', type=int, help='Number of rounds')
+        create.add_argument('--username', type=str, default='m', help='User recorded as creating the tournament')
+
+        pair = subparsers.add_parser('pair', help='Pair the next round')
+        pair.add_argument('tournament_id', type=int)
+        pair.add_argument('date_of_match', type=str, help='When the round is played')
+        pair.add_argument('--username', type=str, default='m', help='User recorded as creating the games')
+
+        results = subparsers.add_parser('results', help='Apply results entered on the tournament games')
+        results.add_argument('tournament_id', type=int)
+
+        standings = subparsers.add_parser('standings', help='Show the current standings')
+        standings.add_argument('tournament_id', type=int)
+
+    def get_tournament(self, tournament_id):
+        try:
+            return Tournament.objects.get(id=tournament_id, is_active=True)
+        except Tournament.DoesNotExist:
+            raise CommandError(f'Tournament {tournament_id} not found.')
+
+    def handle(self, *args, **kwargs):
+        action = kwargs['action']
+
+        if action == 'create':
+            players = Player.objects.filter(active_member=True, is_active=True, is_volunteer=False)
+            tournament = create_tournament(kwargs['name'], kwargs['rounds'], players, User.objects.get(username=kwargs['username']))
+            self.stdout.write(f'Created tournament {tournament.id}: {tournament.name} with {tournament.entries.count()} players.')
+
+        elif action == 'pair':
+            tournament = self.get_tournament(kwargs['tournament_id'])
+            start = time.perf_counter()
+            try:
+                tournament_round, games, bye = pair_next_round(tournament, kwargs['date_of_match'],
+                                                               User.objects.get(username=kwargs['username']))
+            except ValidationError as e:
+                raise CommandError(e.messages[0])
+            elapsed = time.perf_counter() - start
+
+            for game in games:
+                self.stdout.write(f'{game.get_board()} | {game.get_players()}')
+            if bye is not None:
+                self.stdout.write(f'Bye: {bye.player.name()}')
+            self.stdout.write(f'Paired round {tournament_round.number} in {elapsed * 1000:.1f} ms.')
+
+        elif action == 'results':
+            tournament = self.get_tournament(kwargs['tournament_id'])
+            self.stdout.write(f'Applied {sync_results(tournament)} results.')
+
+        else:
+            tournament = self.get_tournament(kwargs['tournament_id'])
+            for place, entry in enumerate(get_standings(tournament), start=1):
+                self.stdout.write(f'{place:>3}. {entry.player.name()} | {entry.score:g} | '
+                                  f'Buchholz {entry.buchholz:g} | SB {entry.sonneborn_berger:g}')
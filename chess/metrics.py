@@ -0,0 +1,178 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.template.base import Template
+
+# Per-view request metrics, kept in this process and exposed in the Prometheus text format by metrics_view.
+# Each worker process reports its own numbers; Prometheus adds them up across workers.
+
+logger = logging.getLogger('chess.metrics')
+
+# Requests over either limit are logged with the SQL they ran
+SLOW_REQUEST_SECONDS = getattr(settings, 'METRICS_SLOW_REQUEST_SECONDS', 1.0)
+SLOW_REQUEST_QUERIES = getattr(settings, 'METRICS_SLOW_REQUEST_QUERIES', 50)
+
+# SQL fingerprints listed for a slow request, most repeated first
+LOGGED_FINGERPRINTS = 5
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTES_BUCKETS = (1000, 10000, 100000, 1000000, 10000000)
+
+# Literals and IN lists, so the same query with different values gives the same fingerprint
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+VALUE_LIST = re.compile(r'\((?:\s*(?:\?|%s)\s*,)+\s*(?:\?|%s)\s*\)')
+
+
+def fingerprint(sql):
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    sql = VALUE_LIST.sub('(...)', sql)
+    return ' '.join(sql.split())
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # view -> [count per bucket..., sum, count]
+        self.values = {}
+
+    def observe(self, view, value):
+        values = self.values.setdefault(view, [0] * (len(self.buckets) + 2))
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                values[index] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for view, values in sorted(self.values.items()):
+            label = f'view="{escape_label(view)}"'
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {values[-1]}')
+            lines.append(f'{self.name}_sum{{{label}}} {values[-2]:.6g}')
+            lines.append(f'{self.name}_count{{{label}}} {values[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.duration = Histogram('chess_request_duration_seconds', 'Time to produce the response.', SECONDS_BUCKETS)
+        self.queries = Histogram('chess_request_queries', 'SQL queries run per request.', QUERY_BUCKETS)
+        self.db_time = Histogram('chess_request_db_seconds', 'Time spent in SQL per request.', SECONDS_BUCKETS)
+        self.render_time = Histogram('chess_request_render_seconds', 'Time spent rendering templates per request.', SECONDS_BUCKETS)
+        self.response_size = Histogram('chess_response_bytes', 'Size of non-streaming responses.', BYTES_BUCKETS)
+        self.responses = Counter()
+
+    def record(self, view, status, duration, queries, db_time, render_time, response_size):
+        with self.lock:
+            self.duration.observe(view, duration)
+            self.queries.observe(view, queries)
+            self.db_time.observe(view, db_time)
+            self.render_time.observe(view, render_time)
+            if response_size is not None:
+                self.response_size.observe(view, response_size)
+            self.responses[(view, status)] += 1
+
+    def exposition(self):
+        with self.lock:
+            lines = []
+            for histogram in (self.duration, self.queries, self.db_time, self.render_time, self.response_size):
+                lines.extend(histogram.exposition())
+
+            lines.extend(['# HELP chess_responses_total Responses sent, by view and status code.',
+                          '# TYPE chess_responses_total counter'])
+            for (view, status), count in sorted(self.responses.items()):
+                lines.append(f'chess_responses_total{{view="{escape_label(view)}",status="{status}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# The request being measured on this thread, for the template timing below
+_current = threading.local()
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.render_depth = 0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+
+def timed_render(render):
+    # Only the outermost template is timed; included and extended templates render inside it
+    def _render(self, context):
+        stats = getattr(_current, 'stats', None)
+        if stats is None:
+            return render(self, context)
+
+        stats.render_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            stats.render_depth -= 1
+            if stats.render_depth == 0:
+                stats.render_time += time.perf_counter() - start
+    _render.metrics_timed = True
+    return _render
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        # Template rendering has no hook of its own; the test runner instruments Template._render the same way
+        if not getattr(Template._render, 'metrics_timed', False):
+            Template._render = timed_render(Template._render)
+
+    def __call__(self, request):
+        stats = RequestStats()
+        _current.stats = stats
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(stats):
+                response = self.get_response(request)
+        finally:
+            _current.stats = None
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unresolved'
+        response_size = None if response.streaming else len(response.content)
+        registry.record(view, response.status_code, duration, stats.queries, stats.db_time, stats.render_time, response_size)
+
+        if duration > SLOW_REQUEST_SECONDS or stats.queries > SLOW_REQUEST_QUERIES:
+            logger.warning('Slow request %s %s (%s): %.3fs, %d queries in %.3fs, %.3fs rendering\n%s',
+                           request.method, request.path, view, duration, stats.queries, stats.db_time, stats.render_time,
+                           '\n'.join(f'  {count} x {sql}' for sql, count in stats.fingerprints.most_common(LOGGED_FINGERPRINTS)))
+
+        return response
@@ -46,6 +46,17 @@ class Player(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     end_at = models.DateTimeField(default=None, blank=True, null=True)
 
+    class Meta:
+        # Only active rows are ever listed, so the indexes leave out retired ones
+        indexes = [
+            # Ratings sheet order: home page, get_ratings_sheet, write_ratings, pairing
+            models.Index(fields=['-rating', '-grade', 'last_name', 'first_name'], name='player_ratings_idx',
+                         condition=models.Q(is_active=True, active_member=True, is_volunteer=False)),
+            # Name order and name lookups: get_players, the roster index, imports
+            models.Index(fields=['last_name', 'first_name'], name='player_name_idx',
+                         condition=models.Q(is_active=True)),
+        ]
+
     def __str__(self):
         if self.lesson_class:
             return self.name() + " | " + str(self.rating) + " | " + self.lesson_class.name
@@ -76,39 +87,30 @@ class Player(models.Model):
         return self.name() + " | " + str(self.rating) + " | " + str(
             self.grade) + " | " + lesson_class + " | " + parent_or_guardian + " | " + email + " | " + phone
 
-    def update_rating(self, new_rating, opponent, modified_by):
-        # Mark the current player instance as inactive and set the end date
-        self.is_active = False
-        self.end_at = timezone.now()
-        self.save()
-
+    def update_rating(self, new_rating, opponent, modified_by, game=None):
         # Preventing a player from having a rating less than 100
         if new_rating < 100:
             new_rating = 100
 
-        # Create a new player instance with the updated rating and `is_active=True`
-        # Updates player's last 3 opponents
-        new_player = Player.objects.create(
-            last_name=self.last_name,
-            first_name=self.first_name,
-            rating=new_rating,
-            beginning_rating=self.beginning_rating,
-            grade=self.grade,
-            lesson_class=self.lesson_class,
-            active_member=self.active_member,
-            is_volunteer=self.is_volunteer,
-            parent_or_guardian=self.parent_or_guardian,
-            email=self.email,
-            phone=self.phone,
-            additional_info=self.additional_info,
-            opponent_one=opponent,
-            opponent_two=self.opponent_one,
-            opponent_three=self.opponent_two,
+        # The rating change goes to the ledger and the player row keeps only the current rating
+        rating_event = RatingEvent.objects.create(
+            player=self,
+            game=game,
+            rating_before=self.rating,
+            rating_after=new_rating,
+            delta=new_rating - self.rating,
             modified_by=modified_by,
-            is_active=True,
         )
 
-        return new_player
+        # Updates player's last 3 opponents
+        self.rating = new_rating
+        self.opponent_three = self.opponent_two
+        self.opponent_two = self.opponent_one
+        self.opponent_one = opponent
+        self.modified_by = modified_by
+        self.save(update_fields=['rating', 'opponent_one', 'opponent_two', 'opponent_three', 'modified_by'])
+
+        return rating_event
 
 
 class LessonClass(models.Model):
@@ -158,12 +160,24 @@ class Game(models.Model):
         default=Result.UNKNOWN,
         null=True
     )
+    tournament_round = models.ForeignKey('TournamentRound', on_delete=models.RESTRICT, related_name='games', blank=True,
+                                         null=True)
 
     modified_by = models.ForeignKey(User, on_delete=models.RESTRICT)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     end_at = models.DateTimeField(default=None, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # A night's boards: update_games, save_games, add_game, pairing and exports
+            models.Index(fields=['date_of_match', 'board_letter', 'board_number'], name='game_board_idx',
+                         condition=models.Q(is_active=True)),
+            # Board search, newest first
+            models.Index(fields=['board_letter', 'board_number', '-date_of_match'], name='game_board_search_idx',
+                         condition=models.Q(is_active=True)),
+        ]
+
     def __str__(self):
         white_player = f"{self.white.last_name}, {self.white.first_name}" if self.white else "No White Player"
         black_player = f"{self.black.last_name}, {self.black.first_name}" if self.black else "No Black Player"
@@ -178,7 +192,15 @@ class Game(models.Model):
         return f"White- {white_player} | Black- {black_player}"
 
     @classmethod
-    def add_game(cls, date_of_match, board_letter, board_number, white, black, result, modified_by):
+    def date_version(cls, date_of_match):
+        # Token for the state of a night's club games. Every add or update creates a new row (raising the
+        # highest id) and every deactivation lowers the active count, so any change gives a new token.
+        version = cls.objects.filter(date_of_match=date_of_match, tournament_round__isnull=True).aggregate(
+            active=models.Count('id', filter=models.Q(is_active=True)), latest=models.Max('id'))
+        return f"{version['active']}-{version['latest'] or 0}"
+
+    @classmethod
+    def add_game(cls, date_of_match, board_letter, board_number, white, black, result, modified_by, tournament_round=None):
         # Check if there's an active game on the same board
         if cls.objects.filter(date_of_match=date_of_match, board_letter=board_letter, board_number=board_number, is_active=True).exists():
             raise ValidationError(f"A game on board {board_letter}-{board_number} and {date_of_match} already exists.")
@@ -191,6 +213,7 @@ class Game(models.Model):
             white=white,
             black=black,
             result=result,
+            tournament_round=tournament_round,
             modified_by=modified_by,
             is_active=True
         )
@@ -210,7 +233,88 @@ class Game(models.Model):
             white=white,
             black=black,
             result=result,
-            modified_by=modified_by
+            modified_by=modified_by,
+            tournament_round=self.tournament_round
         )
 
         return new_game
+
+
+class RatingEvent(models.Model):
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='rating_events')
+    game = models.ForeignKey(Game, on_delete=models.SET_NULL, related_name='rating_events', blank=True, null=True)
+    rating_before = models.IntegerField()
+    rating_after = models.IntegerField()
+    delta = models.IntegerField()
+
+    modified_by = models.ForeignKey(User, on_delete=models.RESTRICT)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.player.name()} | {self.rating_before} -> {self.rating_after} | {self.created_at:%Y-%m-%d}"
+
+
+class Tournament(models.Model):
+    name = models.CharField(max_length=100)
+    number_of_rounds = models.IntegerField()
+
+    modified_by = models.ForeignKey(User, on_delete=models.RESTRICT)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    end_at = models.DateTimeField(default=None, blank=True, null=True)
+
+    def __str__(self):
+        return self.name
+
+
+class TournamentRound(models.Model):
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE, related_name='rounds')
+    number = models.IntegerField()
+    date_of_match = models.DateField()
+
+    modified_by = models.ForeignKey(User, on_delete=models.RESTRICT)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.tournament.name} | Round {self.number} | {self.date_of_match}"
+
+
+class TournamentPlayer(models.Model):
+    # Running standings, kept up to date as results come in so reads never have to look at the games
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE, related_name='entries')
+    player = models.ForeignKey(Player, on_delete=models.RESTRICT, related_name='tournament_entries')
+    score = models.FloatField(default=0)
+    buchholz = models.FloatField(default=0)
+    sonneborn_berger = models.FloatField(default=0)
+    # One item per round played: {"opponent": entry id or None for a bye, "colour": "W", "B" or "-",
+    # "game": game id, "points": points scored or None while the game is unfinished}
+    history = models.JSONField(default=list, blank=True)
+
+    def __str__(self):
+        return f"{self.player.name()} | {self.score}"
+
+    def colours(self):
+        return ''.join(item['colour'] for item in self.history)
+
+    def opponent_ids(self):
+        return {item['opponent'] for item in self.history if item['opponent'] is not None}
+
+    def had_bye(self):
+        return any(item['opponent'] is None for item in self.history)
+
+
+class ImportCheckpoint(models.Model):
+    # How far an import command got through a CSV file. Files are identified by the hash of their
+    # contents, so a rerun on the same file resumes after the last committed chunk.
+    kind = models.CharField(max_length=20)
+    file_name = models.CharField(max_length=255)
+    file_hash = models.CharField(max_length=64)
+    row_offset = models.IntegerField(default=0)
+    completed = models.BooleanField(default=False)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        status = "done" if self.completed else f"{self.row_offset} rows"
+        return f"{self.kind} | {self.file_name} | {status}"
@@ -0,0 +1,182 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, Q, Max
+
+from .models import Player, Game
+from .versions import GAME_VERSION, bump_version
+
+GAME_SORT_ORDER = ['G', 'H', 'I', 'J']
+BOARDS = [
+        *[f"G-{i + 1}" for i in range(5)],
+        *[f"H-{i + 1}" for i in range(6)],
+        *[f"I-{i + 1}" for i in range(22)],
+        *[f"J-{i + 1}" for i in range(22)]
+    ]
+
+
+def board_for(index):
+    # Past the last board the J section carries on (J-23, J-24, ...)
+    if index < len(BOARDS):
+        return BOARDS[index]
+    return f"{GAME_SORT_ORDER[-1]}-{index - len(BOARDS) + 23}"
+
+
+def night_boards(used_boards):
+    # The club's boards followed by any extra boards a night was paired onto, in board order
+    extra = set(used_boards) - set(BOARDS)
+    return BOARDS + sorted(extra, key=lambda board: (board[0], int(board[2:])))
+
+
+# How far down the rating order a player may be paired; the matching is exact inside this window
+PAIRING_WINDOW = 6
+
+# Extra cost, in rating points, for facing someone again (last game, two games ago, three games ago)
+REPEAT_PENALTIES = (400, 200, 100)
+# Extra cost for pairing two volunteers together
+VOLUNTEER_PENALTY = 1000
+
+
+def pairing_cost(first, second):
+    cost = abs(first.rating - second.rating)
+
+    for penalty, opponent_ids in zip(REPEAT_PENALTIES, (
+            (first.opponent_one_id, second.opponent_one_id),
+            (first.opponent_two_id, second.opponent_two_id),
+            (first.opponent_three_id, second.opponent_three_id))):
+        if second.id == opponent_ids[0] or first.id == opponent_ids[1]:
+            cost += penalty
+
+    if first.is_volunteer and second.is_volunteer:
+        cost += VOLUNTEER_PENALTY
+
+    return cost
+
+
+def pair_players(players, window=PAIRING_WINDOW):
+    # Minimum-cost matching of an even number of players.
+    # Players are sorted by rating and each one may only be paired with someone within `window` places of
+    # them, which keeps the search linear in the roster size: a dynamic program over the position in the
+    # order and a bitmask of which of the next `window` players are already taken.
+    # Returns [(stronger player, weaker player), ...] strongest pair first.
+    if len(players) % 2:
+        raise ValueError("An even number of players is needed to make pairings.")
+
+    players = sorted(players, key=lambda player: (-player.rating, player.last_name, player.first_name))
+    count = len(players)
+    masks = 1 << window
+
+    # best[i][mask]: cheapest way to pair everyone from position i on, when `mask` marks which of
+    # positions i..i+window-1 are already paired
+    infinity = float('inf')
+    best = [[infinity] * masks for _ in range(count + 1)]
+    choice = [[0] * masks for _ in range(count + 1)]
+    best[count][0] = 0
+
+    costs = [[pairing_cost(players[i], players[i + offset]) if 0 < offset and i + offset < count else infinity
+              for offset in range(window)] for i in range(count)]
+
+    for i in range(count - 1, -1, -1):
+        row = best[i]
+        next_row = best[i + 1]
+
+        for mask in range(masks):
+            if mask & 1:
+                row[mask] = next_row[mask >> 1]
+                continue
+
+            for offset in range(1, window):
+                if i + offset >= count:
+                    break
+                if mask & (1 << offset):
+                    continue
+
+                cost = costs[i][offset] + next_row[(mask | (1 << offset)) >> 1]
+                if cost < row[mask]:
+                    row[mask] = cost
+                    choice[i][mask] = offset
+
+    pairs = []
+    mask = 0
+    for i in range(count):
+        if not mask & 1:
+            offset = choice[i][mask]
+            pairs.append((players[i], players[i + offset]))
+            mask |= 1 << offset
+        mask >>= 1
+
+    return pairs
+
+
+def assign_boards(pairs, last_colours):
+    # Strongest pairs take the first boards in BOARDS order.
+    # White goes to whoever had black (or sat out) last time; when that does not decide it, the stronger
+    # player takes white on odd boards.
+    # last_colours: {player_id: 'White' or 'Black'}
+    boards = []
+
+    for index, (stronger, weaker) in enumerate(pairs):
+        board = board_for(index)
+
+        stronger_colour = last_colours.get(stronger.id)
+        weaker_colour = last_colours.get(weaker.id)
+        if stronger_colour == 'White' and weaker_colour != 'White':
+            white, black = weaker, stronger
+        elif weaker_colour == 'White' and stronger_colour != 'White':
+            white, black = stronger, weaker
+        elif int(board[2:]) % 2:
+            white, black = stronger, weaker
+        else:
+            white, black = weaker, stronger
+
+        boards.append((board, white, black))
+
+    return boards
+
+
+def create_pairings(date_of_match, modified_by):
+    # Pairs the active roster for a match date and saves the games.
+    # When the roster is odd, the volunteer who has played the fewest games fills in.
+    players = list(Player.objects.filter(active_member=True, is_active=True, is_volunteer=False))
+
+    if len(players) % 2:
+        volunteer = Player.objects.filter(active_member=True, is_active=True, is_volunteer=True).annotate(
+            games_played=Count('game_as_white', filter=Q(game_as_white__is_active=True), distinct=True) +
+                         Count('game_as_black', filter=Q(game_as_black__is_active=True), distinct=True)
+        ).order_by('games_played', 'last_name', 'first_name').first()
+
+        if volunteer is None:
+            raise ValidationError("There is an odd number of players and no volunteer to fill in.")
+        players.append(volunteer)
+
+    # Pairs past the last board carry on in the J section, see board_for
+    pairs = pair_players(players)
+
+    # Colours from each player's most recent earlier club night; tournament rounds keep their own colours
+    last_colours = {}
+    club_games = Game.objects.filter(is_active=True, tournament_round__isnull=True)
+    last_date = club_games.filter(date_of_match__lt=date_of_match).aggregate(last_date=Max('date_of_match'))['last_date']
+    if last_date:
+        for white_id, black_id in club_games.filter(date_of_match=last_date).values_list('white_id', 'black_id'):
+            last_colours[white_id] = 'White'
+            last_colours[black_id] = 'Black'
+
+    games = [
+        Game(
+            date_of_match=date_of_match,
+            board_letter=board[0],
+            board_number=int(board[2:]),
+            white=white,
+            black=black,
+            modified_by=modified_by,
+            is_active=True,
+        )
+        for board, white, black in assign_boards(pairs, last_colours)
+    ]
+
+    with transaction.atomic():
+        if Game.objects.filter(date_of_match=date_of_match, is_active=True, tournament_round__isnull=True).exists():
+            raise ValidationError(f"Games for {date_of_match} already exist.")
+        Game.objects.bulk_create(games)
+        transaction.on_commit(lambda: bump_version(GAME_VERSION))
+
+    return games
@@ -0,0 +1,302 @@
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import Player, Game, RatingEvent
+from .roster import ROSTER_VERSION
+from .tracing import current_span, span
+from .versions import bump_version
+
+K_FACTOR = 32
+RATING_FLOOR = 100
+
+RATINGS_HELPER = lambda rating, result, expected: round(rating + K_FACTOR * (result - expected))
+CALC_EXPECTED = lambda player_rating, opponent_rating: 1 / (1 + 10 ** ((opponent_rating - player_rating) / 400))
+
+# (white score, black score) for each result that moves ratings
+RESULT_SCORES = {
+    'White': (1, 0),
+    'Black': (0, 1),
+    'Draw': (.5, .5),
+}
+
+
+def period_deltas(pairings, ratings):
+    # Every game in a rating period is scored against the pre-period ratings, so the order the boards
+    # come in (and how many games a player has that night) does not change the outcome.
+    # pairings: [(game_id, white_id, black_id, result), ...]
+    # ratings: {player_id: rating before the period}
+    # returns {player_id: [(game_id, opponent_id, delta), ...]} in board order
+    deltas = {}
+
+    for game_id, white_id, black_id, result in pairings:
+        white_score, black_score = RESULT_SCORES[result]
+        white_rating = ratings[white_id]
+        black_rating = ratings[black_id]
+
+        white_delta = RATINGS_HELPER(white_rating, white_score, CALC_EXPECTED(white_rating, black_rating)) - white_rating
+        black_delta = RATINGS_HELPER(black_rating, black_score, CALC_EXPECTED(black_rating, white_rating)) - black_rating
+
+        deltas.setdefault(white_id, []).append((game_id, black_id, white_delta))
+        deltas.setdefault(black_id, []).append((game_id, white_id, black_delta))
+
+    return deltas
+
+
+def apply_deltas(rating, deltas):
+    # Applies a player's deltas in order, keeping the rating floor after every game like update_rating does.
+    # Yields (game_id, rating_before, rating_after) for each game.
+    for game_id, _, delta in deltas:
+        rating_after = max(rating + delta, RATING_FLOOR)
+        yield game_id, rating, rating_after
+        rating = rating_after
+
+
+def replay_periods(periods, ratings):
+    # Runs rating periods back to back entirely in memory.
+    # periods: iterable of pairing lists (see period_deltas), oldest first
+    # ratings: {player_id: starting rating}, updated in place as each period finishes
+    # Yields (player_id, game_id, rating_before, rating_after) for every rated game.
+    for pairings in periods:
+        deltas = period_deltas(pairings, ratings)
+
+        for player_id, player_deltas in deltas.items():
+            for game_id, rating_before, rating_after in apply_deltas(ratings[player_id], player_deltas):
+                yield player_id, game_id, rating_before, rating_after
+            ratings[player_id] = rating_after
+
+
+@span('rate_period')
+def rate_period(games, modified_by):
+    # Rates one match date as a single rating period.
+    # games: Game rows; games missing a player, without a decisive result or with a volunteer on either
+    # side are skipped.
+    # Costs one read, one update and one insert no matter how many boards were played.
+    player_ids = {player_id for game in games for player_id in (game.white_id, game.black_id) if player_id is not None}
+
+    with transaction.atomic():
+        players = Player.objects.select_for_update().in_bulk(player_ids)
+
+        pairings = []
+        volunteer_games = 0
+        for game in games:
+            white = players.get(game.white_id)
+            black = players.get(game.black_id)
+            if white is None or black is None or game.result not in RESULT_SCORES:
+                continue
+
+            if not white.is_active or not black.is_active:
+                continue
+
+            if white.is_volunteer or black.is_volunteer:
+                volunteer_games += 1
+                continue
+
+            pairings.append((game.id, white.id, black.id, game.result))
+
+        current_span().set(games=len(games), rated_games=len(pairings), volunteer_games=volunteer_games)
+
+        if not pairings:
+            return []
+
+        ratings = {player_id: player.rating for player_id, player in players.items()}
+        deltas = period_deltas(pairings, ratings)
+
+        now = timezone.now()
+        rated_players = []
+        rating_events = []
+
+        for player_id, player_deltas in deltas.items():
+            player = players[player_id]
+
+            for game_id, rating_before, rating_after in apply_deltas(player.rating, player_deltas):
+                rating_events.append(RatingEvent(
+                    player=player,
+                    game_id=game_id,
+                    rating_before=rating_before,
+                    rating_after=rating_after,
+                    delta=rating_after - rating_before,
+                    modified_by=modified_by,
+                    created_at=now,
+                ))
+
+            # The last three opponents shift once per game played in the period
+            opponents = [player.opponent_three_id, player.opponent_two_id, player.opponent_one_id]
+            opponents.extend(opponent_id for _, opponent_id, _ in player_deltas)
+
+            player.rating = rating_events[-1].rating_after
+            player.opponent_one_id = opponents[-1]
+            player.opponent_two_id = opponents[-2]
+            player.opponent_three_id = opponents[-3]
+            player.modified_by = modified_by
+            rated_players.append(player)
+
+        Player.objects.bulk_update(rated_players, ['rating', 'opponent_one', 'opponent_two', 'opponent_three', 'modified_by'])
+        RatingEvent.objects.bulk_create(rating_events)
+
+        # Bulk writes skip the post_save signal that normally invalidates the roster
+        transaction.on_commit(lambda: bump_version(ROSTER_VERSION))
+
+    return [player.name() for player in rated_players]
+
+
+def recent_opponents(player_ids):
+    # {player_id: [last opponent, the one before, the one before that]} from the rated club games, as
+    # rate_period shifts them in; None where a player has played fewer than three. Two queries, each
+    # keeping only the latest three games per player.
+    games = Game.objects.filter(is_active=True, result__in=RESULT_SCORES, tournament_round__isnull=True,
+                                white__is_volunteer=False, black__is_volunteer=False)
+    recent = {}
+    for side, other in (('white_id', 'black_id'), ('black_id', 'white_id')):
+        rows = games.filter(**{f'{side}__in': player_ids}).annotate(recency=Window(
+            RowNumber(), partition_by=F(side), order_by=[F('date_of_match').desc(), F('id').desc()])).filter(
+            recency__lte=3).values_list(side, 'date_of_match', 'id', other)
+        for player_id, date_of_match, game_id, opponent_id in rows:
+            recent.setdefault(player_id, []).append((date_of_match, game_id, opponent_id))
+
+    return {player_id: ([opponent_id for _, _, opponent_id in sorted(entries, reverse=True)[:3]] + [None, None, None])[:3]
+            for player_id, entries in recent.items()}
+
+
+@span('rerate_from')
+def rerate_from(date_of_match, modified_by):
+    # Re-rates every match date from date_of_match on after a past result was corrected.
+    # Walks the nights in order and only recomputes games that involve a player whose rating no longer
+    # matches the ledger (plus their opponents that night), so players untouched by the correction are
+    # never rewritten. Returns (names of re-rated players, number of games re-rated).
+    with transaction.atomic():
+        games = list(Game.objects.filter(date_of_match__gte=date_of_match, is_active=True, result__in=RESULT_SCORES,
+                                         tournament_round__isnull=True).order_by(
+            'date_of_match', 'id').values_list('date_of_match', 'id', 'white_id', 'black_id', 'result'))
+        events = list(RatingEvent.objects.filter(game__date_of_match__gte=date_of_match).order_by(
+            'game__date_of_match', 'game_id', 'id').values_list(
+            'id', 'player_id', 'game_id', 'rating_before', 'rating_after', 'created_at', 'game__date_of_match'))
+
+        player_ids = {player_id for game in games for player_id in game[2:4] if player_id is not None}
+        player_ids.update(event[1] for event in events)
+        players = Player.objects.select_for_update().in_bulk(player_ids)
+
+        def is_rated(player_id):
+            player = players.get(player_id)
+            return player is not None and player.is_active and not player.is_volunteer
+
+        games = [game for game in games if is_rated(game[2]) and is_rated(game[3])]
+        game_ids = {game[1] for game in games}
+
+        games_by_date = {}
+        for game in games:
+            games_by_date.setdefault(game[0], []).append(game)
+
+        # ledger: (player_id, game_id) -> event for games that still count
+        # stale: events left behind by games that were corrected or removed, by match date
+        # ratings: each player's rating going into date_of_match
+        ledger = {}
+        stale = {}
+        ratings = {}
+        for event in events:
+            event_id, player_id, game_id, rating_before, _, _, game_date = event
+            ratings.setdefault(player_id, rating_before)
+            if game_id in game_ids:
+                ledger[(player_id, game_id)] = event
+            else:
+                stale.setdefault(game_date, []).append((event_id, player_id, game_id))
+
+        for game in games:
+            for player_id in game[2:4]:
+                ratings.setdefault(player_id, players[player_id].rating)
+
+        now = timezone.now()
+        dirty = set()
+        deleted_events = []
+        rating_events = []
+        rerated_players = set()
+        rerated_games = set()
+
+        for game_date in sorted(games_by_date.keys() | stale.keys()):
+            day = games_by_date.get(game_date, [])
+            stale_events = stale.get(game_date, [])
+            stale_players = {player_id for _, player_id, _ in stale_events}
+            deleted_events.extend(event_id for event_id, _, _ in stale_events)
+            rerated_games.update(game_id for _, _, game_id in stale_events)
+            dirty |= stale_players
+
+            # Recompute the night's games for dirty players and for games that were never rated, then keep
+            # pulling in opponents until every recomputed player has their whole night recomputed
+            touched = {player_id for game in day for player_id in game[2:4]
+                       if player_id in dirty or (player_id, game[1]) not in ledger}
+            while True:
+                recomputed = [game for game in day if game[2] in touched or game[3] in touched]
+                grown = touched | {player_id for game in recomputed for player_id in game[2:4]}
+                if grown == touched:
+                    break
+                touched = grown
+
+            deltas = period_deltas([game[1:] for game in recomputed], ratings)
+
+            for player_id, player_deltas in deltas.items():
+                chain = list(apply_deltas(ratings[player_id], player_deltas))
+                previous = [ledger.get((player_id, game_id)) for game_id, _, _ in chain]
+
+                changed = any(event is None or (event[3], event[4]) != (rating_before, rating_after)
+                              for event, (_, rating_before, rating_after) in zip(previous, chain))
+                if changed:
+                    deleted_events.extend(event[0] for event in previous if event is not None)
+                    for event, (game_id, rating_before, rating_after) in zip(previous, chain):
+                        rating_events.append(RatingEvent(
+                            player_id=player_id,
+                            game_id=game_id,
+                            rating_before=rating_before,
+                            rating_after=rating_after,
+                            delta=rating_after - rating_before,
+                            modified_by=modified_by,
+                            created_at=event[5] if event is not None else now,
+                        ))
+                        rerated_games.add(game_id)
+                    rerated_players.add(player_id)
+
+                # A player is back in step with the ledger once their whole night matched it
+                if changed or player_id in stale_players:
+                    dirty.add(player_id)
+                else:
+                    dirty.discard(player_id)
+
+                ratings[player_id] = chain[-1][2]
+
+            # Everyone else that night moves along the ledger
+            recomputed_ids = {game[1] for game in recomputed}
+            for game in day:
+                if game[1] not in recomputed_ids:
+                    for player_id in game[2:4]:
+                        ratings[player_id] = ledger[(player_id, game[1])][4]
+
+        # A correction that adds or removes a player's games also changes who they last played, which pairing
+        # uses to avoid repeats
+        opponents_changed = rerated_players | {player_id for events in stale.values() for _, player_id, _ in events}
+        last_opponents = recent_opponents(opponents_changed)
+
+        updated = []
+        for player_id, rating in ratings.items():
+            player = players[player_id]
+            changed = False
+            if player.rating != rating:
+                player.rating = rating
+                rerated_players.add(player_id)
+                changed = True
+            if player_id in opponents_changed:
+                opponents = last_opponents.get(player_id, [None, None, None])
+                if opponents != [player.opponent_one_id, player.opponent_two_id, player.opponent_three_id]:
+                    player.opponent_one_id, player.opponent_two_id, player.opponent_three_id = opponents
+                    changed = True
+            if changed:
+                player.modified_by = modified_by
+                updated.append(player)
+
+        RatingEvent.objects.filter(id__in=deleted_events).delete()
+        RatingEvent.objects.bulk_create(rating_events)
+        Player.objects.bulk_update(updated, ['rating', 'opponent_one', 'opponent_two', 'opponent_three', 'modified_by'])
+
+        # Bulk writes skip the post_save signal that normally invalidates the roster
+        transaction.on_commit(lambda: bump_version(ROSTER_VERSION))
+
+    return sorted(players[player_id].name() for player_id in rerated_players), len(rerated_games)
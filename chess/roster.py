@@ -0,0 +1,138 @@
+import threading
+from bisect import bisect_left
+
+from .models import Player
+from .versions import get_version
+
+ROSTER_VERSION = 'player'
+
+# Most matches the player picker asks for at once
+TYPEAHEAD_LIMIT = 10
+
+_roster = None
+_roster_lock = threading.Lock()
+
+
+def normalize_name(name):
+    return ' '.join(name.split()).casefold()
+
+
+def split_name(name):
+    # "Last, First" -> ("Last", "First")
+    last_name, _, first_name = name.partition(',')
+    return last_name.strip(), first_name.strip()
+
+
+class RosterIndex:
+    # In-memory index of the active players, keyed on their "Last, First" name as results and imports
+    # refer to them. The Player instances are shared by every thread; callers copy one before changing it.
+    # Names held by more than one active player are kept aside in `shared`: looking one up raises
+    # MultipleObjectsReturned, as Player.objects.get did, rather than picking one of them.
+
+    def __init__(self, players, version=None):
+        self.version = version
+        self.by_name = {}
+        self.by_first_name = {}
+        self.shared = {}
+        self.completions = None
+
+        for player in players:
+            self.add(player)
+
+    def add(self, player):
+        key = normalize_name(player.name())
+        previous = self.by_name.get(key)
+
+        if previous is not None and previous.id == player.id:
+            # A newer copy of the same player
+            first_name_matches = self.by_first_name[normalize_name(previous.first_name)]
+            first_name_matches.remove(previous)
+            self.by_name[key] = player
+        elif previous is not None:
+            self.shared.setdefault(key, [previous]).append(player)
+        else:
+            self.by_name[key] = player
+        self.by_first_name.setdefault(normalize_name(player.first_name), []).append(player)
+        self.completions = None
+
+    def build_completions(self):
+        # Sorted (prefix key, name key, player) entries for active members. Each player is entered under
+        # "last, first", "first last" and each word of their name, so typing any of them finds them.
+        entries = []
+        players = [(key, player) for key, player in self.by_name.items() if key not in self.shared]
+        players += [(key, player) for key, shared in self.shared.items() for player in shared]
+        for key, player in players:
+            if not player.active_member:
+                continue
+            first_name = normalize_name(player.first_name)
+            last_name = normalize_name(player.last_name)
+            keys = {key, f'{first_name} {last_name}'.strip()} | set(key.replace(',', ' ').split())
+            entries.extend((prefix_key, key, player) for prefix_key in keys)
+        entries.sort(key=lambda entry: entry[:2])
+        return [entry[0] for entry in entries], entries
+
+    def complete(self, query, limit=TYPEAHEAD_LIMIT):
+        # Up to limit active members whose name starts with query, found by binary search so the cost does
+        # not grow with the roster
+        query = normalize_name(query)
+        if not query or limit <= 0:
+            return []
+
+        # Built on first use; a race only means two threads build the same list
+        if self.completions is None:
+            self.completions = self.build_completions()
+        keys, entries = self.completions
+
+        matches = []
+        seen = set()
+        for index in range(bisect_left(keys, query), len(keys)):
+            if not keys[index].startswith(query):
+                break
+            player = entries[index][2]
+            if player.id not in seen:
+                seen.add(player.id)
+                matches.append(player)
+                if len(matches) == limit:
+                    break
+        return matches
+
+    def get(self, name):
+        # name is "Last, First"; returns None for unknown players
+        if not name:
+            return None
+        last_name, first_name = split_name(name)
+        key = normalize_name(last_name + ", " + first_name)
+        if key in self.shared:
+            raise Player.MultipleObjectsReturned(f"{len(self.shared[key])} players are named '{name}'.")
+        return self.by_name.get(key)
+
+    def resolve(self, name):
+        player = self.get(name)
+        if player is None:
+            raise Player.DoesNotExist(f"Player '{name}' not found.")
+        return player
+
+    def resolve_first_name(self, first_name):
+        # Same contract as Player.objects.get(first_name__iexact=...)
+        matches = self.by_first_name.get(normalize_name(first_name), [])
+        if not matches:
+            raise Player.DoesNotExist(f"Player with first name '{first_name}' not found.")
+        if len(matches) > 1:
+            raise Player.MultipleObjectsReturned(f"More than one player has the first name '{first_name}'.")
+        return matches[0]
+
+
+def get_roster():
+    # Shared roster index, rebuilt with a single query whenever the roster version has moved on
+    global _roster
+
+    version = get_version(ROSTER_VERSION)
+    roster = _roster
+
+    if roster is None or roster.version != version:
+        with _roster_lock:
+            if _roster is None or _roster.version != version:
+                _roster = RosterIndex(Player.objects.filter(is_active=True).order_by('id'), version)
+            roster = _roster
+
+    return roster
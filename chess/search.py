@@ -0,0 +1,142 @@
+import re
+import threading
+
+from django.db import connection, transaction, OperationalError
+from django.db.models import Q
+
+from .models import Player
+
+# Full-text index over active players for search_results, in an SQLite FTS5 table whose rowid is the
+# player id. It is created and filled the first time it is needed and kept up to date by the Player and
+# LessonClass signals. Other databases, or SQLite builds without FTS5, fall back to icontains filters.
+SEARCH_TABLE = 'chess_player_search'
+SEARCH_LIMIT = 200
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+_available = None
+_lock = threading.Lock()
+
+
+def search_available():
+    # Creates and fills the index on first use; False when full-text search cannot be used here.
+    # Creation waits until it can run in its own transaction, so a rollback can never undo it.
+    global _available
+
+    if _available is None:
+        if connection.in_atomic_block:
+            return False
+        with _lock:
+            if _available is None:
+                _available = connection.vendor == 'sqlite' and create_index()
+    return _available
+
+
+def create_index():
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [SEARCH_TABLE])
+            if cursor.fetchone():
+                return True
+
+            # Prefix indexes on 2 and 3 characters keep typed-as-you-go prefix queries fast
+            cursor.execute(f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+                           f"name, guardian, class_names, tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+            write_rows(cursor, Player.objects.filter(is_active=True))
+        return True
+    except OperationalError:
+        return False
+
+
+def write_rows(cursor, players):
+    players = players.select_related('lesson_class__teacher', 'lesson_class__co_teacher')
+    cursor.executemany(
+        f"INSERT INTO {SEARCH_TABLE} (rowid, name, guardian, class_names) VALUES (%s, %s, %s, %s)",
+        [(player.id, f"{player.first_name} {player.last_name}", player.parent_or_guardian or '', class_names(player))
+         for player in players.iterator(chunk_size=2000)]
+    )
+
+
+def class_names(player):
+    lesson_class = player.lesson_class
+    if lesson_class is None:
+        return ''
+    names = [lesson_class.name, lesson_class.teacher.name()]
+    if lesson_class.co_teacher:
+        names.append(lesson_class.co_teacher.name())
+    return ' '.join(names)
+
+
+def rebuild_index():
+    # Refills the whole index, for when rows were written without going through the ORM signals
+    if not search_available():
+        return
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        write_rows(cursor, Player.objects.filter(is_active=True))
+
+
+def index_players(player_ids, with_students=False):
+    # Refreshes the given players' entries; retired or deleted players drop out of the index.
+    # with_students also refreshes the students of classes these players teach, whose entries carry the
+    # teachers' names.
+    if not player_ids or not search_available():
+        return
+
+    if with_students:
+        player_ids = set(player_ids) | set(Player.objects.filter(
+            Q(lesson_class__teacher_id__in=player_ids) | Q(lesson_class__co_teacher_id__in=player_ids)).values_list('id', flat=True))
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(player_id,) for player_id in player_ids])
+        write_rows(cursor, Player.objects.filter(id__in=player_ids, is_active=True))
+
+
+def match_expression(query, columns):
+    # Every word must match the start of a word in one of the columns: {name guardian} : ("sam"* "smi"*).
+    # The brackets matter: without them the column filter applies to the first word only.
+    tokens = TOKEN_PATTERN.findall(query)
+    if not tokens:
+        return None
+    return '{' + ' '.join(columns) + '} : (' + ' '.join(f'"{token}"*' for token in tokens) + ')'
+
+
+def search_players(query, search_type):
+    # search_type is 'Player' (names and guardians of active members) or 'Class' (class and teacher names).
+    # Returns active players, best match first.
+    if search_type == 'Player':
+        columns = ['name', 'guardian']
+        fallback = (Q(first_name__icontains=query) | Q(last_name__icontains=query)) & Q(active_member=True)
+        members_only = True
+    else:
+        columns = ['class_names']
+        fallback = Q(lesson_class__teacher__first_name__icontains=query) | Q(lesson_class__co_teacher__first_name__icontains=query)
+        members_only = False
+
+    if not search_available():
+        return list(Player.objects.filter(fallback, is_active=True).order_by('-rating', '-grade', 'last_name', 'first_name'))
+
+    expression = match_expression(query, columns)
+    if expression is None:
+        return []
+
+    # The player filters run inside the query, before the LIMIT, so rows that would be filtered out
+    # afterwards (former members, say) cannot crowd out real matches
+    player_table = Player._meta.db_table
+    conditions = f"{player_table}.is_active"
+    if members_only:
+        conditions += f" AND {player_table}.active_member"
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {SEARCH_TABLE}.rowid FROM {SEARCH_TABLE} JOIN {player_table} ON {player_table}.id = {SEARCH_TABLE}.rowid "
+                       f"WHERE {SEARCH_TABLE} MATCH %s AND {conditions} ORDER BY {SEARCH_TABLE}.rank LIMIT %s",
+                       [expression, SEARCH_LIMIT])
+        ranked_ids = [row[0] for row in cursor.fetchall()]
+
+    players = Player.objects.filter(id__in=ranked_ids).select_related('lesson_class').in_bulk()
+    results = [players[player_id] for player_id in ranked_ids if player_id in players]
+
+    # Whole-word name matches ahead of prefix-only ones; sorted() keeps the FTS rank within each group
+    words = {token.casefold() for token in TOKEN_PATTERN.findall(query)}
+    return sorted(results, key=lambda player: not words <= {word.casefold() for word in TOKEN_PATTERN.findall(player.name())})
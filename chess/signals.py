@@ -1,7 +1,11 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from .models import RegisteredUser
+from .models import RegisteredUser, Player, LessonClass, Game
+from .roster import ROSTER_VERSION
+from .search import index_players
+from .versions import GAME_VERSION, CLASS_VERSION, bump_version
 
 @receiver(post_save, sender=User)
 def create_registered_user(sender, instance, created, **kwargs):
@@ -10,4 +14,35 @@ def create_registered_user(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=User)
 def save_registered_user(sender, instance, **kwargs):
-    instance.registereduser.save()
\ No newline at end of file
+    instance.registereduser.save()
+
+@receiver(post_save, sender=Player)
+@receiver(post_delete, sender=Player)
+def bump_roster_version(sender, **kwargs):
+    # Wait for the commit so no other process rebuilds its roster from rows it cannot see yet
+    transaction.on_commit(lambda: bump_version(ROSTER_VERSION))
+
+@receiver(post_save, sender=Game)
+@receiver(post_delete, sender=Game)
+def bump_game_version(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(GAME_VERSION))
+
+@receiver(post_save, sender=LessonClass)
+@receiver(post_delete, sender=LessonClass)
+def bump_class_version(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(CLASS_VERSION))
+
+@receiver(post_save, sender=Player)
+@receiver(post_delete, sender=Player)
+def update_player_search(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    player_id = instance.id
+    transaction.on_commit(lambda: index_players([player_id], with_students=True))
+
+@receiver(post_save, sender=LessonClass)
+def update_class_search(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    class_id = instance.id
+    transaction.on_commit(lambda: index_players(list(Player.objects.filter(lesson_class_id=class_id).values_list('id', flat=True))))
@@ -1,2 +1,36 @@
 //JS for multiple pages only
-//if js is only used on one page, append to the end of the html file
\ No newline at end of file
+//if js is only used on one page, append to the end of the html file
+
+// Queues a background export, polls until it is built, then downloads it
+async function runExport(url, formData, statusElement) {
+    const response = await fetch(url, {method: 'POST', body: formData});
+    const data = await response.json();
+    if (!response.ok) {
+        statusElement.textContent = data.message;
+        return;
+    }
+
+    let job = data.job;
+    statusElement.textContent = 'Building export...';
+    while (job.status === 'queued' || job.status === 'running') {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const statusResponse = await fetch(job.status_url);
+        job = (await statusResponse.json()).job;
+    }
+
+    if (job.status === 'done') {
+        statusElement.textContent = '';
+        window.location = job.download_url;
+    } else {
+        statusElement.textContent = `Export failed: ${job.error}`;
+    }
+}
+
+// Follows the results saved for a night. onChange gets each change ({previous, version, games}), or null
+// when the page fell behind and should reload the night. Returns the EventSource so it can be closed.
+function followGames(url, gameDate, onChange) {
+    const source = new EventSource(`${url}?game_date=${encodeURIComponent(gameDate)}`);
+    source.addEventListener('games', event => onChange(JSON.parse(event.data)));
+    source.addEventListener('resync', () => onChange(null));
+    return source;
+}
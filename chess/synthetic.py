@@ -0,0 +1,260 @@
+import csv
+import os
+import random
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Player, LessonClass, Game, RatingEvent, Tournament
+from .pairing import board_for
+from .ratings import RATING_FLOOR, CALC_EXPECTED, replay_periods
+from .roster import ROSTER_VERSION
+from .search import rebuild_index
+from .versions import GAME_VERSION, CLASS_VERSION, bump_version
+
+# A made-up club for seed_synthetic and the benchmarks: volunteers teaching classes, students in them, and a
+# season of weekly club nights with results. Everything comes from one random seed, so the same arguments
+# always give the same club.
+
+FIRST_NAMES = ['Ada', 'Ben', 'Cora', 'Dev', 'Eli', 'Fay', 'Gus', 'Hana', 'Ivan', 'Jade', 'Kai', 'Lena', 'Milo',
+               'Nia', 'Omar', 'Pia', 'Quinn', 'Rosa', 'Sam', 'Tess', 'Umar', 'Vera', 'Wes', 'Xena', 'Yuri', 'Zoe']
+LAST_NAMES = ['Abbott', 'Brooks', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Garcia', 'Huang', 'Ito', 'Jones', 'Khan',
+              'Lopez', 'Meyer', 'Nguyen', 'Okafor', 'Patel', 'Quinn', 'Rossi', 'Singh', 'Tanaka', 'Usman', 'Varga',
+              'Weber', 'Xu', 'Young', 'Zhang']
+
+SEASON_START = date(2024, 9, 26)
+DRAW_CHANCE = 0.1
+ATTENDANCE = 0.85
+
+
+class SyntheticClub:
+    def __init__(self, players=300, volunteers=None, classes=None, dates=30, seed=0, start_date=SEASON_START):
+        rng = random.Random(seed)
+        volunteers = volunteers if volunteers is not None else max(4, players // 15)
+        # Every class needs its own teacher, or two classes would get the same name
+        classes = min(classes if classes is not None else max(1, volunteers // 2), volunteers)
+
+        # Class names are built from teachers' first names, which import_data resolves, so those are unique
+        self.volunteers = []
+        for index in range(volunteers):
+            first_name = FIRST_NAMES[index % len(FIRST_NAMES)] + (str(index // len(FIRST_NAMES)) if index >= len(FIRST_NAMES) else '')
+            self.volunteers.append({
+                'last_name': rng.choice(LAST_NAMES), 'first_name': first_name, 'rating': rng.randint(600, 1800),
+                'email': f'{first_name.lower()}@example.org', 'phone': f'555-{index:04d}',
+            })
+
+        self.classes = []
+        for index in range(classes):
+            teacher = self.volunteers[index % volunteers]
+            co_teacher = self.volunteers[(index + classes) % volunteers] if index + classes < volunteers else None
+            name = teacher['first_name'] + ' & ' + co_teacher['first_name'] if co_teacher else teacher['first_name']
+            self.classes.append({'name': name, 'teacher': teacher, 'co_teacher': co_teacher})
+
+        # Students never share a name with a volunteer, so every name resolves to one player
+        taken = {(volunteer['last_name'], volunteer['first_name']) for volunteer in self.volunteers}
+        names = [(last_name, first_name) for last_name in LAST_NAMES for first_name in FIRST_NAMES if (last_name, first_name) not in taken]
+        rng.shuffle(names)
+        self.players = []
+        for index in range(players):
+            last_name, first_name = names[index % len(names)]
+            if index >= len(names):
+                last_name += f'-{index // len(names)}'
+            grade = rng.randint(1, 12)
+            rating = max(RATING_FLOOR, round(rng.gauss(300 + grade * 60, 150)))
+            self.players.append({
+                'last_name': last_name, 'first_name': first_name, 'rating': rating, 'beginning_rating': rating,
+                'grade': grade, 'lesson_class': rng.choice(self.classes)['name'] if rng.random() < 0.9 else '',
+                'parent_or_guardian': f'{rng.choice(FIRST_NAMES)} {last_name}',
+                'email': f'{first_name.lower()}.{last_name.lower()}@example.org', 'phone': f'555-{index:06d}',
+            })
+
+        # Each night some players stay home; the rest are paired near their rating on the club's boards.
+        # Results follow the rating difference, as the club's would.
+        self.dates = [start_date + timedelta(weeks=week) for week in range(dates)]
+        self.nights = []
+        ratings = [player['rating'] for player in self.players]
+        for _ in self.dates:
+            present = [index for index in range(players) if rng.random() < ATTENDANCE]
+            present.sort(key=lambda index: ratings[index] + rng.randint(-100, 100), reverse=True)
+            games = []
+            for index, (white, black) in enumerate(zip(present[0::2], present[1::2])):
+                board = board_for(index)
+                if rng.random() < 0.5:
+                    white, black = black, white
+                roll = rng.random()
+                if roll < DRAW_CHANCE:
+                    result = 'Draw'
+                elif roll < DRAW_CHANCE + (1 - DRAW_CHANCE) * CALC_EXPECTED(ratings[white], ratings[black]):
+                    result = 'White'
+                else:
+                    result = 'Black'
+                games.append((board, white, black, result))
+            self.nights.append(games)
+
+    def player_name(self, index):
+        player = self.players[index]
+        return f"{player['last_name']}, {player['first_name']}"
+
+    def write_csv_files(self, directory):
+        # The club in the formats import_data and import_game read. Returns
+        # (volunteers, classes, players, [game file per night]).
+        os.makedirs(directory, exist_ok=True)
+        volunteers_csv = os.path.join(directory, 'volunteers.csv')
+        with open(volunteers_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['last_name', 'first_name', 'rating', 'beginning_rating', 'active_member', 'email', 'phone'])
+            for volunteer in self.volunteers:
+                writer.writerow([volunteer['last_name'], volunteer['first_name'], volunteer['rating'], 'NULL', 'True',
+                                 volunteer['email'], volunteer['phone']])
+
+        classes_csv = os.path.join(directory, 'classes.csv')
+        with open(classes_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['teacher', 'co_teacher'])
+            for lesson_class in self.classes:
+                co_teacher = lesson_class['co_teacher']
+                writer.writerow([lesson_class['teacher']['first_name'], co_teacher['first_name'] if co_teacher else ''])
+
+        players_csv = os.path.join(directory, 'players.csv')
+        fields = ['last_name', 'first_name', 'rating', 'beginning_rating', 'grade', 'lesson_class', 'parent_or_guardian', 'email', 'phone']
+        with open(players_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(fields + ['active_member', 'is_volunteer'])
+            for player in self.players:
+                writer.writerow([player[field] for field in fields] + ['True', 'False'])
+
+        game_files = []
+        for date_of_match, games in zip(self.dates, self.nights):
+            game_csv = os.path.join(directory, f'games_{date_of_match}.csv')
+            with open(game_csv, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['Board#', 'White', 'Black', 'result'])
+                for board, white, black, result in games:
+                    writer.writerow([board, self.player_name(white), self.player_name(black), result])
+            game_files.append(game_csv)
+
+        return volunteers_csv, classes_csv, players_csv, game_files
+
+    def seed(self, modified_by, retired_versions=0, batch_size=1000):
+        # Writes the club, its games and their rating history straight to the database and returns the
+        # number of rows of each kind. retired_versions adds that many inactive older rows per player, like
+        # the versioned Player chains update_rating used to leave behind.
+        with transaction.atomic():
+            volunteers = Player.objects.bulk_create([
+                Player(last_name=volunteer['last_name'], first_name=volunteer['first_name'], rating=volunteer['rating'],
+                       is_volunteer=True, email=volunteer['email'], phone=volunteer['phone'], modified_by=modified_by)
+                for volunteer in self.volunteers
+            ], batch_size=batch_size)
+            volunteer_ids = {id(volunteer): player for volunteer, player in zip(self.volunteers, volunteers)}
+
+            classes = LessonClass.objects.bulk_create([
+                LessonClass(name=lesson_class['name'], teacher=volunteer_ids[id(lesson_class['teacher'])],
+                            co_teacher=volunteer_ids[id(lesson_class['co_teacher'])] if lesson_class['co_teacher'] else None,
+                            modified_by=modified_by)
+                for lesson_class in self.classes
+            ], batch_size=batch_size)
+            classes_by_name = {lesson_class.name: lesson_class for lesson_class in classes}
+
+            # Rating history is replayed in memory first, keyed by position, so every row is written once
+            periods = []
+            game_number = 0
+            for games in self.nights:
+                pairings = []
+                for _, white, black, result in games:
+                    pairings.append((game_number, white, black, result))
+                    game_number += 1
+                periods.append(pairings)
+
+            ratings = {index: player['rating'] for index, player in enumerate(self.players)}
+            events = list(replay_periods(periods, ratings))
+
+            opponents = {}
+            for pairings in periods:
+                for _, white, black, _ in pairings:
+                    opponents.setdefault(white, []).append(black)
+                    opponents.setdefault(black, []).append(white)
+
+            season_start = timezone.make_aware(datetime.combine(self.dates[0], time())) if self.dates else timezone.now()
+            retired = []
+            for player in self.players:
+                for version in range(retired_versions):
+                    retired.append(Player(
+                        last_name=player['last_name'], first_name=player['first_name'], rating=player['rating'],
+                        beginning_rating=player['beginning_rating'], grade=player['grade'], is_active=False,
+                        end_at=season_start + timedelta(weeks=version), modified_by=modified_by))
+            Player.objects.bulk_create(retired, batch_size=batch_size)
+
+            players = Player.objects.bulk_create([
+                Player(last_name=player['last_name'], first_name=player['first_name'], rating=ratings[index],
+                       beginning_rating=player['beginning_rating'], grade=player['grade'],
+                       lesson_class=classes_by_name.get(player['lesson_class']),
+                       parent_or_guardian=player['parent_or_guardian'], email=player['email'], phone=player['phone'],
+                       modified_by=modified_by)
+                for index, player in enumerate(self.players)
+            ], batch_size=batch_size)
+
+            # The last three opponents, most recent first
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'UPDATE {Player._meta.db_table} SET opponent_one_id = %s, opponent_two_id = %s, opponent_three_id = %s WHERE id = %s',
+                    [tuple(players[opponent].id if opponent is not None else None
+                           for opponent in (played[::-1] + [None] * 3)[:3]) + (players[index].id,)
+                     for index, played in opponents.items()])
+
+            games = Game.objects.bulk_create([
+                Game(date_of_match=date_of_match, board_letter=board[0], board_number=int(board[2:]),
+                     white=players[white], black=players[black], result=result, modified_by=modified_by)
+                for date_of_match, night in zip(self.dates, self.nights)
+                for board, white, black, result in night
+            ], batch_size=batch_size)
+
+            RatingEvent.objects.bulk_create([
+                RatingEvent(player=players[index], game=games[game_number], rating_before=rating_before,
+                            rating_after=rating_after, delta=rating_after - rating_before, modified_by=modified_by,
+                            created_at=timezone.make_aware(datetime.combine(games[game_number].date_of_match, time())))
+                for index, game_number, rating_before, rating_after in events
+            ], batch_size=batch_size)
+
+            # Bulk writes skip the signals that move the version counters and the search index
+            transaction.on_commit(lambda: [bump_version(name) for name in (ROSTER_VERSION, GAME_VERSION, CLASS_VERSION)])
+
+        rebuild_index()
+
+        return {
+            'volunteers': len(volunteers),
+            'classes': len(classes),
+            'players': len(players),
+            'retired versions': len(retired),
+            'match dates': len(self.dates),
+            'games': len(games),
+            'rating events': len(events),
+        }
+
+
+def clear_club():
+    # Removes every player, class, game and tournament, in an order the RESTRICT foreign keys allow
+    with transaction.atomic():
+        Tournament.objects.all().delete()
+        RatingEvent.objects.all().delete()
+        Game.objects.all().delete()
+        Player.objects.update(lesson_class=None, opponent_one=None, opponent_two=None, opponent_three=None)
+        LessonClass.objects.all().delete()
+        Player.objects.all().delete()
+        transaction.on_commit(lambda: [bump_version(name) for name in (ROSTER_VERSION, GAME_VERSION, CLASS_VERSION)])
+
+
+@contextmanager
+def scratch_database(path):
+    # Points the default database at a new SQLite file for the duration and drops it afterwards. Threads
+    # started inside (a server, say) open their connections to it as well.
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    test_name = test_settings.get('NAME')
+    test_settings['NAME'] = path
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = test_name
@@ -0,0 +1,247 @@
+from itertools import groupby
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from .models import Game, Tournament, TournamentRound, TournamentPlayer
+from .ratings import RESULT_SCORES
+from .versions import GAME_VERSION, bump_version
+
+TOURNAMENT_BOARD_LETTER = 'T'
+BYE_POINTS = 1
+
+
+class Standings:
+    # In-memory copy of a tournament's entries that keeps score, Buchholz and Sonneborn-Berger in step.
+    # Buchholz is the sum of finished opponents' scores and Sonneborn-Berger the sum of points scored
+    # against each finished opponent times that opponent's score, so a score change only has to visit
+    # the player's own opponents.
+
+    def __init__(self, entries):
+        self.entries = {entry.id: entry for entry in entries}
+        self.changed = set()
+
+    def change_score(self, entry, points):
+        entry.score += points
+        self.changed.add(entry.id)
+
+        for item in entry.history:
+            if item['opponent'] is None or item['points'] is None:
+                continue
+            opponent = self.entries[item['opponent']]
+            opponent.buchholz += points
+            opponent.sonneborn_berger += round_item(opponent, item['round'])['points'] * points
+            self.changed.add(opponent.id)
+
+    def record(self, white, black, round_number, white_points, black_points):
+        white_item = round_item(white, round_number)
+        black_item = round_item(black, round_number)
+
+        white.buchholz += black.score
+        white.sonneborn_berger += white_points * black.score
+        black.buchholz += white.score
+        black.sonneborn_berger += black_points * white.score
+        white_item['points'] = white_points
+        black_item['points'] = black_points
+
+        self.change_score(white, white_points)
+        self.change_score(black, black_points)
+
+    def unrecord(self, white, black, round_number):
+        # Exact reverse of record()
+        white_item = round_item(white, round_number)
+        black_item = round_item(black, round_number)
+        white_points = white_item['points']
+        black_points = black_item['points']
+
+        self.change_score(white, -white_points)
+        self.change_score(black, -black_points)
+
+        white.buchholz -= black.score
+        white.sonneborn_berger -= white_points * black.score
+        black.buchholz -= white.score
+        black.sonneborn_berger -= black_points * white.score
+        white_item['points'] = None
+        black_item['points'] = None
+
+    def save(self):
+        # A single executemany; bulk_update's CASE expressions cost far more than the round itself once
+        # every entry's history is in the statement. history goes through the JSONField's own adaptation,
+        # so it is stored exactly as the ORM would store it.
+        table = connection.ops.quote_name(TournamentPlayer._meta.db_table)
+        history = TournamentPlayer._meta.get_field('history')
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"UPDATE {table} SET score = %s, buchholz = %s, sonneborn_berger = %s, history = %s WHERE id = %s",
+                [(entry.score, entry.buchholz, entry.sonneborn_berger, history.get_db_prep_save(entry.history, connection), entry.id)
+                 for entry in (self.entries[entry_id] for entry_id in self.changed)]
+            )
+        self.changed.clear()
+
+
+def round_item(entry, round_number):
+    for item in reversed(entry.history):
+        if item['round'] == round_number:
+            return item
+    return None
+
+
+def rank_key(entry):
+    return -entry.score, -entry.player.rating, entry.player.last_name, entry.player.first_name
+
+
+def colour_preference(entry):
+    # Positive when the player is owed white: more blacks than whites so far, or black last time
+    colours = entry.colours().replace('-', '')
+    balance = colours.count('B') - colours.count('W')
+    last = 1 if colours.endswith('B') else -1 if colours.endswith('W') else 0
+    return balance, last
+
+
+def swiss_pairs(entries):
+    # Pairs the next round from the cached score groups: each group (plus anyone floated down from the
+    # group above) is split in half and the top half meets the bottom half, skipping opponents already
+    # met. Whoever cannot be paired floats down to the next group.
+    # Returns ([(white entry, black entry), ...] best board first, bye entry or None).
+    ranked = sorted(entries, key=rank_key)
+
+    bye = None
+    if len(ranked) % 2:
+        bye = next((entry for entry in reversed(ranked) if not entry.had_bye()), ranked[-1])
+        ranked.remove(bye)
+
+    met = {entry.id: entry.opponent_ids() for entry in ranked}
+    pairs = []
+    floaters = []
+
+    for _, group in groupby(ranked, key=lambda entry: entry.score):
+        pool = floaters + list(group)
+        half = len(pool) // 2
+        top, bottom = pool[:half], pool[half:]
+
+        floaters = []
+        for entry in top:
+            opponent = next((candidate for candidate in bottom if candidate.id not in met[entry.id]), None)
+            if opponent is None:
+                floaters.append(entry)
+            else:
+                bottom.remove(opponent)
+                pairs.append((entry, opponent))
+        floaters.extend(bottom)
+        floaters.sort(key=rank_key)
+
+    # Whoever is left after the last group is paired in order, repeating an opponent only if there is no other way
+    while floaters:
+        entry = floaters.pop(0)
+        opponent = next((candidate for candidate in floaters if candidate.id not in met[entry.id]), floaters[0])
+        floaters.remove(opponent)
+        pairs.append((entry, opponent))
+
+    pairs.sort(key=lambda pair: min(rank_key(pair[0]), rank_key(pair[1])))
+
+    coloured = []
+    for board, (first, second) in enumerate(pairs, start=1):
+        if colour_preference(first) > colour_preference(second):
+            coloured.append((first, second))
+        elif colour_preference(first) < colour_preference(second):
+            coloured.append((second, first))
+        elif board % 2:
+            coloured.append((first, second))
+        else:
+            coloured.append((second, first))
+
+    return coloured, bye
+
+
+def create_tournament(name, number_of_rounds, players, modified_by):
+    with transaction.atomic():
+        tournament = Tournament.objects.create(name=name, number_of_rounds=number_of_rounds, modified_by=modified_by)
+        TournamentPlayer.objects.bulk_create([TournamentPlayer(tournament=tournament, player=player) for player in players])
+    return tournament
+
+
+def pair_next_round(tournament, date_of_match, modified_by):
+    with transaction.atomic():
+        # Results corrected since the round closed change the scores the pairing and tie-breaks use
+        sync_results(tournament)
+
+        round_number = tournament.rounds.count() + 1
+        if round_number > tournament.number_of_rounds:
+            raise ValidationError(f"{tournament.name} has already played all {tournament.number_of_rounds} rounds.")
+
+        if Game.objects.filter(tournament_round__tournament=tournament, is_active=True).exclude(result__in=RESULT_SCORES).exists():
+            raise ValidationError(f"Round {round_number - 1} of {tournament.name} still has unfinished games.")
+
+        standings = Standings(tournament.entries.select_related('player'))
+        pairs, bye = swiss_pairs(standings.entries.values())
+
+        tournament_round = TournamentRound.objects.create(tournament=tournament, number=round_number,
+                                                          date_of_match=date_of_match, modified_by=modified_by)
+        games = Game.objects.bulk_create([
+            Game(
+                date_of_match=date_of_match,
+                board_letter=TOURNAMENT_BOARD_LETTER,
+                board_number=board,
+                white=white.player,
+                black=black.player,
+                tournament_round=tournament_round,
+                modified_by=modified_by,
+                is_active=True,
+            )
+            for board, (white, black) in enumerate(pairs, start=1)
+        ])
+        transaction.on_commit(lambda: bump_version(GAME_VERSION))
+
+        for game, (white, black) in zip(games, pairs):
+            white.history.append({'round': round_number, 'opponent': black.id, 'colour': 'W', 'game': game.id, 'points': None})
+            black.history.append({'round': round_number, 'opponent': white.id, 'colour': 'B', 'game': game.id, 'points': None})
+            standings.changed.update((white.id, black.id))
+
+        if bye is not None:
+            bye.history.append({'round': round_number, 'opponent': None, 'colour': '-', 'game': None, 'points': BYE_POINTS})
+            standings.change_score(bye, BYE_POINTS)
+
+        standings.save()
+
+    return tournament_round, games, bye
+
+
+def sync_results(tournament):
+    # Applies any results entered (or corrected) on the tournament's games since the last sync.
+    # Only games whose result differs from what the standings already hold are touched.
+    with transaction.atomic():
+        standings = Standings(tournament.entries.select_for_update())
+        entry_by_player = {entry.player_id: entry for entry in standings.entries.values()}
+
+        games = Game.objects.filter(tournament_round__tournament=tournament, is_active=True).values_list(
+            'id', 'white_id', 'black_id', 'result', 'tournament_round__number')
+
+        synced = 0
+        for game_id, white_id, black_id, result, round_number in games:
+            white = entry_by_player[white_id]
+            black = entry_by_player[black_id]
+            white_item = round_item(white, round_number)
+            black_item = round_item(black, round_number)
+
+            points = RESULT_SCORES.get(result, (None, None))
+            if white_item['game'] == game_id and (white_item['points'], black_item['points']) == points:
+                continue
+
+            if white_item['points'] is not None:
+                standings.unrecord(white, black, round_number)
+
+            # Corrections through Game.update_game point the round at the replacement game
+            white_item['game'] = black_item['game'] = game_id
+            if result in RESULT_SCORES:
+                standings.record(white, black, round_number, *points)
+            standings.changed.update((white.id, black.id))
+            synced += 1
+
+        standings.save()
+
+    return synced
+
+
+def get_standings(tournament):
+    return tournament.entries.select_related('player').order_by('-score', '-buchholz', '-sonneborn_berger',
+                                                                '-player__rating', 'player__last_name', 'player__first_name')
@@ -0,0 +1,128 @@
+import contextvars
+import functools
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+
+# Lightweight phase tracing. A span times a block and counts the SQL run inside it; spans opened inside
+# another become its children, and each finished top-level span is written to the chess.tracing log as
+# one JSON line:
+#
+#     with span('save_games', date=game_date) as trace:
+#         with span('diff'):
+#             ...
+#         trace.set(added=3)
+#
+# span also works as a decorator, and traced_view adds a Server-Timing header with the phases when DEBUG
+# is on, so they show up in the browser's network panel.
+
+logger = logging.getLogger('chess.tracing')
+
+_current = contextvars.ContextVar('chess_span', default=None)
+
+
+class Span:
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.parent = parent
+        self.root = parent.root if parent is not None else self
+        self.attributes = attributes
+        self.children = []
+        self.duration = None
+        self.queries = None
+        # Only the top-level span counts queries; the others take the difference across their block
+        self.query_count = 0
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def as_dict(self):
+        data = {'span': self.name, 'ms': round(self.duration * 1000, 3), 'queries': self.queries}
+        data.update(self.attributes)
+        if self.children:
+            data['children'] = [child.as_dict() for child in self.children]
+        return data
+
+    def walk(self, depth=0):
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+
+def count_query(root):
+    def wrapper(execute, sql, params, many, context):
+        root.query_count += 1
+        return execute(sql, params, many, context)
+    return wrapper
+
+
+class span:
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        parent = _current.get()
+        self.span = Span(self.name, parent, dict(self.attributes))
+        self.token = _current.set(self.span)
+
+        if parent is None:
+            self.query_wrapper = connection.execute_wrapper(count_query(self.span))
+            self.query_wrapper.__enter__()
+        self.queries_before = self.span.root.query_count
+        self.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        current = self.span
+        current.duration = time.perf_counter() - self.start
+        current.queries = current.root.query_count - self.queries_before
+        if exc_type is not None:
+            current.set(error=exc_type.__name__)
+        _current.reset(self.token)
+
+        if current.parent is not None:
+            current.parent.children.append(current)
+        else:
+            self.query_wrapper.__exit__(exc_type, exc, traceback)
+            logger.info(json.dumps(current.as_dict(), default=str))
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(self.name, **self.attributes):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def current_span():
+    # The innermost open span, or None outside any span
+    return _current.get()
+
+
+def server_timing(root):
+    # Server-Timing header value: one entry per span, named by its path below the root
+    entries = []
+    for depth, current in root.walk():
+        description = current.name if depth == 0 else f'{"-" * depth} {current.name}'
+        entries.append(f'span{len(entries)};dur={current.duration * 1000:.1f};desc="{description} ({current.queries} q)"')
+    return ', '.join(entries)
+
+
+def traced_view(name):
+    # Runs the view inside a top-level span; with DEBUG on the phases are sent back as Server-Timing
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with span(name, method=request.method) as trace:
+                response = view(request, *args, **kwargs)
+                trace.set(status=response.status_code)
+            if settings.DEBUG:
+                response['Server-Timing'] = server_timing(trace)
+            return response
+        return wrapper
+    return decorator
@@ -1,13 +1,15 @@
 from django.urls import path
 from django.contrib.auth import views as auth_views
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 
 from .views import (login_view, signup_view,
-                    home_view, search_results, update_games, get_ratings_sheet,
+                    home_view, search_results, update_games, live_games, get_ratings_sheet,
                     manual_change_view,
-                    input_results_view, get_players, save_games, download_ratings, download_existing_ratings_sheet,
-                    pair_view, download_pairings,
-                    help_view, )
+                    input_results_view, get_players, player_typeahead, save_games, download_ratings, download_existing_ratings_sheet,
+                    pair_view, download_pairings, download_pairings_archive, generate_pairings,
+                    start_export, export_status, export_download,
+                    metrics_view, help_view, )
 
 urlpatterns = [
     path('', login_view, name='login'),
@@ -17,15 +19,23 @@ urlpatterns = [
     path('home/', login_required(home_view), name='home'),
         path('api/get_ratings_sheet', login_required(get_ratings_sheet), name='get_ratings_sheet'),
         path('update_games/', login_required(update_games), name='update_games'),
+        path('live/games/', login_required(live_games), name='live_games'),
     path('manual_change/', login_required(manual_change_view), name='manual_change'),
     path('input_results/', login_required(input_results_view), name='input_results'),
         path('api/players/', login_required(get_players), name='get_players'),
+        path('api/players/typeahead/', login_required(player_typeahead), name='player_typeahead'),
         path('save_games/', login_required(save_games), name='save_games'),
         path('download_ratings/', login_required(download_ratings), name='download_ratings'),
         path('download_existing_ratings_sheet/', login_required(download_existing_ratings_sheet), name='download_existing_ratings_sheet'),
     path('pair/', login_required(pair_view), name='pair'),
         path('download_pairings/', login_required(download_pairings), name='download_pairings'),
+        path('download_pairings_archive/', login_required(download_pairings_archive), name='download_pairings_archive'),
+        path('generate_pairings/', login_required(generate_pairings), name='generate_pairings'),
+    path('exports/', login_required(start_export), name='start_export'),
+        path('exports/<str:job_id>/', login_required(export_status), name='export_status'),
+        path('exports/<str:job_id>/download/', login_required(export_download), name='export_download'),
     path('help/', login_required(help_view), name='help'),
+    path('metrics', staff_member_required(metrics_view), name='metrics'),
 
     path('password_reset/', auth_views.PasswordResetView.as_view(), name='password_reset'),
     path('password_reset/done/', auth_views.PasswordResetDoneView.as_view(), name='password_reset_done'),
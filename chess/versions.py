@@ -0,0 +1,28 @@
+import secrets
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = 'chess:version:{}'
+
+# Counters for tables other modules cache against; the Player counter is roster.ROSTER_VERSION
+GAME_VERSION = 'game'
+CLASS_VERSION = 'lesson_class'
+
+
+def new_version():
+    # Versions are only compared for equality. Each one is new rather than an increment: the file cache
+    # has no atomic incr, and two processes incrementing together could both store the same value, leaving
+    # whatever was cached between them valid forever. The clock keeps them readable and the random part
+    # keeps two bumps in the same nanosecond apart.
+    return f'{time.time_ns()}-{secrets.token_hex(4)}'
+
+
+def get_version(name):
+    return cache.get_or_set(VERSION_KEY.format(name), new_version, None)
+
+
+def bump_version(name):
+    version = new_version()
+    cache.set(VERSION_KEY.format(name), version, None)
+    return version
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import json
 
@@ -6,50 +7,137 @@ from django.contrib import messages
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.core.exceptions import ValidationError
-from django.db import transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.db import OperationalError, connection, transaction
 from django.db.models import Q, Count
-from django.http import HttpResponseRedirect, HttpResponse, Http404, JsonResponse
+from django.http import HttpResponseRedirect, HttpResponse, HttpResponseNotModified, Http404, JsonResponse, FileResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.utils import timezone
-
-from .forms import SignUpForm, SearchForm, PairingDateForm, GameSaveForm
-from .models import RegisteredUser, Player, LessonClass, Game  # , Club
-from .write_to_file import write_ratings, write_pairings
+from django.utils.dateparse import parse_date
+from django.utils.http import parse_etags
+
+from .fragments import cached_fragment, fragment_version
+from .forms import SignUpForm, SearchForm, PairingDateForm, PairingRangeForm, GeneratePairingsForm, GameSaveForm
+from .models import RegisteredUser, Player, LessonClass, Game, RatingEvent  # , Club
+from .metrics import registry
+from .tracing import current_span, span, traced_view
+from .live import games_channel, get_broker, publish_games
+from .jobs import JobLimitError, submit_export, get_job
+from .pairing import create_pairings, night_boards
+from .ratings import rate_period, rerate_from
+from .roster import ROSTER_VERSION, TYPEAHEAD_LIMIT, get_roster
+from .search import search_players
+from .versions import GAME_VERSION, CLASS_VERSION, bump_version, get_version
+from .write_to_file import write_ratings, write_pairings, write_pairings_sheets, stream_zip
 
 
 CREATED_RATING_FILES_DIR = os.path.join(os.path.dirname(__file__), '../files', 'ratings')
-CREATED_PAIRING_FILES_DIR = os.path.join(os.path.dirname(__file__), '../files', 'pairings')
-
-GAME_SORT_ORDER = ['G', 'H', 'I', 'J']
-BOARDS = [
-        *[f"G-{i + 1}" for i in range(5)],
-        *[f"H-{i + 1}" for i in range(6)],
-        *[f"I-{i + 1}" for i in range(22)],
-        *[f"J-{i + 1}" for i in range(22)]
-    ]
 
-RATINGS_HELPER = lambda rating, result, expected: round(rating + 32 * (result - expected))
-CALC_EXPECTED = lambda player_rating, opponent_rating: 1 / (1 + 10 ** ((opponent_rating - player_rating) / 400))
+
+def conditional_response(request, version, build_response):
+    # Answers 304 when the client already holds this version; build_response only runs otherwise.
+    # no-cache makes browsers revalidate on every load instead of trusting their copy.
+    etag = f'"{version}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = build_response()
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def compact_requested(request, body=None):
+    # ?format=compact (or "format": "compact" in a JSON body) sends rows as arrays under a single field list
+    return (body or {}).get('format', request.GET.get('format')) == 'compact'
+
+
+PLAYER_FIELDS = ['id', 'first_name', 'last_name']
 
 
 def get_players(request):
-    players = Player.objects.filter(active_member=True, is_active=True).order_by('last_name', 'first_name')
+    compact = compact_requested(request)
+
+    def build_response():
+        players = Player.objects.filter(active_member=True, is_active=True).order_by('last_name', 'first_name')
+        rows = players.values_list(*PLAYER_FIELDS)
+        if compact:
+            return JsonResponse({'fields': PLAYER_FIELDS, 'players': [list(row) for row in rows]})
+        return JsonResponse({'players': [dict(zip(PLAYER_FIELDS, row)) for row in rows]})
+
+    # The roster version moves with every player change, so checking it needs no query
+    return conditional_response(request, f"players-{get_version(ROSTER_VERSION)}{'-compact' if compact else ''}", build_response)
+
+
+def player_typeahead(request):
+    # Top matches for what has been typed into a player picker, from the in-memory roster index
+    try:
+        limit = min(int(request.GET.get('limit', TYPEAHEAD_LIMIT)), TYPEAHEAD_LIMIT)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a number.'}, status=400)
 
     players_data = [
         {
             "id": player.id,
-            "first_name": player.first_name,
-            "last_name": player.last_name
+            "name": player.name(),
+            "is_volunteer": player.is_volunteer
         }
-        for player in players
+        for player in get_roster().complete(request.GET.get('q', ''), limit)
     ]
 
     return JsonResponse({'players': players_data})
 
 
+RATINGS_SHEET_VERSIONS = [ROSTER_VERSION, CLASS_VERSION]
+
+
+def ratings_sheet_rows():
+    # The ratings table body shown on the home page and by get_ratings_sheet
+    def build():
+        players = Player.objects.filter(active_member=True, is_active=True, is_volunteer=False).select_related(
+            'lesson_class').order_by('-rating', '-grade', 'last_name', 'first_name')
+        return render_to_string('chess/ratings_sheet.html', {'players': players})
+
+    return cached_fragment('ratings-sheet', RATINGS_SHEET_VERSIONS, build)
+
+
+def games_by_date():
+    return cached_fragment('games-by-date', [GAME_VERSION], lambda: list(
+        Game.objects.filter(is_active=True).values('date_of_match').annotate(game_count=Count('id')).order_by('-date_of_match')))
+
+
+def existing_ratings_files():
+    # Saved ratings sheets, newest first. Adding, replacing or removing a file changes the folder's
+    # modification time, so the listing is only rebuilt then.
+    ratings_dir = os.path.join(settings.BASE_DIR, 'files', 'ratings')
+    try:
+        folder_version = os.stat(ratings_dir).st_mtime_ns
+    except FileNotFoundError:
+        return []
+
+    def build():
+        existing_files = os.listdir(ratings_dir)
+
+        if ".DS_Store" in existing_files:
+            existing_files.remove(".DS_Store")
+
+        # Skip the export cache folder
+        existing_files = [f for f in existing_files if os.path.isfile(os.path.join(ratings_dir, f))]
+
+        return sorted(
+            existing_files,
+            key=lambda f: os.path.getmtime(os.path.join(ratings_dir, f)),
+            reverse=True
+        )
+
+    return cached_fragment(f'ratings-files-{folder_version}', [], build)
+
+
 def get_ratings_sheet(request):
-    players = Player.objects.filter(active_member=True, is_active=True, is_volunteer=False).order_by('-rating', '-grade', 'last_name', 'first_name')
-    return render(request, 'chess/ratings_sheet.html', {'players': players})
+    return conditional_response(request, f"ratings-sheet-{fragment_version(RATINGS_SHEET_VERSIONS)}",
+                                lambda: HttpResponse(ratings_sheet_rows()))
 
 
 
@@ -106,207 +194,290 @@ def register(request):
 
 
 def home_view(request):
-    games_by_date = Game.objects.filter(is_active=True).values('date_of_match').annotate(
-        game_count=Count('id')).order_by('-date_of_match')
-
-    players = Player.objects.filter(active_member=True, is_active=True, is_volunteer=False).order_by('-rating', '-grade', 'last_name', 'first_name')
-    class_list = LessonClass.objects.filter(is_active=True)
+    # Every part of the page comes from the fragment cache and is only rebuilt after its tables change
+    class_list = cached_fragment('class-list', [CLASS_VERSION], lambda: list(LessonClass.objects.filter(is_active=True)))
 
     context = {
-        'players': players,
+        'ratings_sheet': ratings_sheet_rows(),
         'class_list': class_list,
-        'games_by_date': games_by_date,
+        'games_by_date': games_by_date(),
     }
 
     return render(request, 'chess/home.html', context)
 
 
-def update_games(request):
-    if request.method == 'POST':
-        try:
-            # Parse the request body for the selected game date
-            body = json.loads(request.body)
-            game_date = body.get('game_date')
+def games_for_date(game_date):
+    games = Game.objects.filter(date_of_match=game_date, is_active=True, tournament_round__isnull=True).select_related('white', 'black')
 
-            # Explicitly fetch the latest games for the selected date, bypassing any queryset caching
-            games = Game.objects.filter(date_of_match=game_date, is_active=True).all()
+    games_data = []
+    for game in games:
+        if game.result == 'NONE' or game.result == 'U':
+            result = ''
+        else:
+            result = game.result
 
-            # Prepare game data for the response
-            games_data = []
-            for game in games:
-                if game.result == 'NONE' or game.result == 'U':
-                    result = ''
-                else:
-                    result = game.result
+        games_data.append({
+            'board': game.get_board(),
+            'white': game.white.name() if game.white else 'N/A',
+            'black': game.black.name() if game.black else 'N/A',
+            'result': result
+        })
 
-                games_data.append({
-                    'board': game.get_board(),
-                    'white': game.white.name() if game.white else 'N/A',
-                    'black': game.black.name() if game.black else 'N/A',
-                    'result': result
-                })
+    return games_data
 
-            # Return the game data as JSON response
-            return JsonResponse({'games': games_data}, status=200)
 
-        except Exception as e:
-            # Return an error response in case of any issues
-            return JsonResponse({'error': str(e)}, status=400)
+GAME_FIELDS = ['board', 'white', 'result', 'black']
 
-            # Return an error response if the request is not a POST request
-        return JsonResponse({'error': 'Invalid request method.'}, status=405)
 
+def update_games(request):
+    # A night's club games: GET ?game_date=YYYY-MM-DD, or POST {"game_date": ...} as the older pages do
+    try:
+        if request.method == 'GET':
+            body = {}
+            game_date = request.GET.get('game_date')
+        elif request.method == 'POST':
+            body = json.loads(request.body)
+            game_date = body.get('game_date')
+        else:
+            return JsonResponse({'error': 'Invalid request method.'}, status=405)
 
-def manual_change_view(request):
-    return render(request, 'chess/manual_change.html', )
+        compact = compact_requested(request, body)
 
+        # The version token lets save_games reject results entered against an out of date copy. Together
+        # with the roster version (player names) it also identifies the response, so an unchanged night is
+        # answered with a 304 after one aggregate query.
+        version = Game.date_version(game_date)
 
-def input_results_view(request):
-    form = GameSaveForm()
+        def build_response():
+            games_data = games_for_date(game_date)
+            # The boards to show: the club's boards plus any extra ones this night was paired onto
+            boards = night_boards(game['board'] for game in games_data)
+            if compact:
+                games_data = [[game[field] for field in GAME_FIELDS] for game in games_data]
+                return JsonResponse({'fields': GAME_FIELDS, 'games': games_data, 'boards': boards, 'version': version}, status=200)
+            return JsonResponse({'games': games_data, 'boards': boards, 'version': version}, status=200)
 
-    games_by_date = Game.objects.filter(is_active=True).values('date_of_match').annotate(
-        game_count=Count('id')).order_by('-date_of_match')
+        return conditional_response(
+            request, f"games-{game_date}-{version}-{get_version(ROSTER_VERSION)}{'-compact' if compact else ''}", build_response)
 
-    ratings_dir = os.path.join(settings.BASE_DIR, 'files', 'ratings')
-    try:
-        existing_files = os.listdir(ratings_dir)
-    except FileNotFoundError:
-        existing_files = []
+    except Exception as e:
+        # Return an error response in case of any issues
+        return JsonResponse({'error': str(e)}, status=400)
 
-    if ".DS_Store" in existing_files:
-        existing_files.remove(".DS_Store")
 
-    existing_files = sorted(
-        existing_files,
-        key=lambda f: os.path.getmtime(os.path.join(ratings_dir, f)),
-        reverse=True
-    )
+LIVE_KEEPALIVE_SECONDS = 15
 
-    context = {
-        'form': form,
-        'games_by_date': games_by_date,
-        'existing_files': existing_files
-    }
-    return render(request, 'chess/input_results.html', context)
 
+async def live_games(request):
+    # Server-sent events carrying the boards saved for ?game_date= as they are saved. This needs an ASGI
+    # server (for example `uvicorn website.asgi:application`): under WSGI the stream would hold a worker
+    # thread for as long as the page is open, so it answers 204 instead, which stops EventSource retrying.
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
 
-def save_games(request):
-    if request.method == 'POST':
+    try:
+        game_date = parse_date(request.GET.get('game_date') or '')
+    except ValueError:
+        game_date = None
+    if game_date is None:
+        return JsonResponse({'error': 'game_date must be a date (YYYY-MM-DD).'}, status=400)
+
+    async def events():
+        subscription = get_broker().subscribe(games_channel(game_date))
         try:
-            data = json.loads(request.body.decode('utf-8'))
-            game_date = data.get('game_date')
-            games = data.get('games')
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.get(), LIVE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"event: {message['event']}\ndata: {json.dumps(message)}\n\n"
+        finally:
+            subscription.close()
 
-            if not games:
-                return JsonResponse({'status': 'error', 'message': 'No games data received'}, status=400)
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
-            games_keyed = {
-                game['board']: {key: value for key, value in game.items() if key != 'board'} for game in games
-                if not (game['white'] == "N/A" and game['black'] == "N/A")
-            }
-            #print(games_keyed)
 
-            games_db = Game.objects.filter(date_of_match=game_date)
-            games_db_keyed = {
-                game.get_board(): game for game in games_db
-            }
-            #print(games_db_keyed)
+def metrics_view(request):
+    # Prometheus text exposition of this process's request metrics
+    return HttpResponse(registry.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-            #games not in the db
-            new_games_to_db = {
-                board: details for board, details in games_keyed.items() if board not in games_db_keyed
-            }
-            print("Games being added:", new_games_to_db)
 
-            #games not in data
-            games_not_in_data = {
-                board: game for board, game in games_db_keyed.items() if board not in games_keyed
-            }
-            print("Games being deactivated:", games_not_in_data)
+def manual_change_view(request):
+    return render(request, 'chess/manual_change.html', )
+
 
-            updated_games = {}
+def input_results_view(request):
+    form = GameSaveForm()
 
-            for board, details in games_keyed.items():
-                if board in games_db_keyed:
-                    db_game = games_db_keyed[board]
+    context = {
+        'form': form,
+        'games_by_date': games_by_date(),
+        'existing_files': existing_ratings_files()
+    }
+    return render(request, 'chess/input_results.html', context)
 
-                    white_db = db_game.white.name() if db_game.white is not None else "N/A"
-                    black_db = db_game.black.name() if db_game.black is not None else "N/A"
-                    result_db = db_game.result or "NONE"
 
-                    '''if details['white'] == "N/A" or details['black'] == "N/A":
-                        print(board, "is not going to be updated with a result")'''
+def games_conflict(game_date, message):
+    # 409 with the night as it is now, so the director can redo their changes on top of it
+    current_games = games_for_date(game_date)
+    return JsonResponse({
+        'status': 'conflict',
+        'message': message,
+        'version': Game.date_version(game_date),
+        'games': current_games,
+        'boards': night_boards(game['board'] for game in current_games),
+    }, status=409)
+
+
+def lock_games(game_date):
+    # Takes the write lock before the night's games are read. SQLite transactions start deferred, and one
+    # that reads first cannot wait for another writer when it comes to write, so it fails at once with
+    # "database is locked"; a first statement that writes (and matches nothing) waits its turn instead.
+    # Other databases lock the night's rows.
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {connection.ops.quote_name(Game._meta.db_table)} SET id = id WHERE 0")
+    else:
+        list(Game.objects.select_for_update().filter(date_of_match=game_date, tournament_round__isnull=True).values_list('id', flat=True))
 
-                    if white_db != details['white'] or black_db != details['black'] or result_db != details['result']:
-                        updated_games[board] = details
-            print("Games being updated:", updated_games)
+
+@traced_view('save_games')
+def save_games(request):
+    # Applies only the boards the director changed. The client must send the version token it loaded the
+    # night with; if anyone else saved in the meantime, or is saving right now, the changes are rejected
+    # with the current games instead of overwriting theirs.
+    if request.method == 'POST':
+        try:
+            with span('parse'):
+                data = json.loads(request.body.decode('utf-8'))
+                game_date = data.get('game_date')
+                version = data.get('version')
+                games = data.get('games')
+
+                if not games:
+                    return JsonResponse({'status': 'error', 'message': 'No games data received'}, status=400)
+                if version is None:
+                    return JsonResponse({'status': 'error', 'message': 'The version the games were loaded with is missing. '
+                                                                      'Load the games again and resubmit.'}, status=400)
+
+                changes = {
+                    game['board']: {key: value for key, value in game.items() if key != 'board'} for game in games
+                }
 
             # Prepare results messages
             added_games_report = []
             deactivated_games_report = []
             updated_games_report = []
 
-            # Dictionary of Boards that will have both players getting a ratings change
+            # Dictionary of Boards (and their saved Game) that will have both players getting a ratings change
             games_with_results = {}
 
+            # The changed boards as games_for_date shows them, for the live board
+            board_updates = []
+
             user = request.user
+            roster = get_roster()
+            now = timezone.now()
+
+            try:
+                with transaction.atomic():
+                    with span('diff'):
+                        lock_games(game_date)
+                        current_version = Game.date_version(game_date)
+                        if version != current_version:
+                            return games_conflict(game_date, 'These games were changed by someone else. '
+                                                             'Review their changes and submit again.')
+
+                        # Active games on the changed boards, in one read
+                        board_filter = Q()
+                        for board in changes:
+                            board_filter |= Q(board_letter=board[0], board_number=int(board[2:]))
+                        games_db_keyed = {
+                            game.get_board(): game for game in Game.objects.filter(
+                                board_filter, date_of_match=game_date, is_active=True, tournament_round__isnull=True)
+                        }
+
+                    retired_games = []
+                    new_games = []
+
+                    with span('resolve', boards=len(changes)):
+                        for board, details in changes.items():
+                            db_game = games_db_keyed.get(board)
+
+                            if details['white'] == "N/A" and details['black'] == "N/A":
+                                if db_game is not None:
+                                    retired_games.append(db_game)
+                                    deactivated_games_report.append(f"Deactivated game for board {board}")
+                                    board_updates.append({'board': board, 'white': 'N/A', 'black': 'N/A', 'result': ''})
+                                continue
+
+                            try:
+                                white_player = roster.resolve(details['white']) if details['white'] != "N/A" else None
+                                black_player = roster.resolve(details['black']) if details['black'] != "N/A" else None
+                            except (Player.DoesNotExist, Player.MultipleObjectsReturned) as e:
+                                return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+                            if db_game is not None:
+                                # Nothing to do if the board already holds exactly this game
+                                db_result = db_game.result if db_game.result not in (None, 'U') else "NONE"
+                                if (db_game.white_id == (white_player.id if white_player else None) and
+                                        db_game.black_id == (black_player.id if black_player else None) and
+                                        db_result == details['result']):
+                                    continue
+                                retired_games.append(db_game)
+                                updated_games_report.append(f"Updated game for board {board}")
+                            else:
+                                added_games_report.append(f"Added game for board {board}")
+
+                            new_game = Game(
+                                date_of_match=game_date,
+                                board_letter=board[0],
+                                board_number=int(board[2:]),
+                                white=white_player,
+                                black=black_player,
+                                result=details['result'],
+                                modified_by=user,
+                                is_active=True
+                            )
+                            new_games.append(new_game)
+                            if details['result'] != "NONE":
+                                games_with_results[board] = new_game
+                            board_updates.append({
+                                'board': board,
+                                'white': white_player.name() if white_player else 'N/A',
+                                'black': black_player.name() if black_player else 'N/A',
+                                'result': details['result'] if details['result'] not in ('NONE', 'U') else ''
+                            })
+
+                    with span('write', retired=len(retired_games), created=len(new_games)):
+                        Game.objects.filter(id__in=[game.id for game in retired_games]).update(is_active=False, end_at=now)
+                        Game.objects.bulk_create(new_games)
+                        transaction.on_commit(lambda: bump_version(GAME_VERSION))
+
+                    # Rated under the same lock and transaction, so games are never committed without their ratings
+                    with span('rate') as trace:
+                        rerated = None
+                        if RatingEvent.objects.filter(game__date_of_match__gte=game_date).exists():
+                            # Ratings from this date onward have already been calculated, so only re-rate what the change touches
+                            players, rerated_games = rerate_from(game_date, user)
+                            rerated = {'players': len(players), 'games': rerated_games}
+                        else:
+                            players = rate_period(list(games_with_results.values()), user)
+                        trace.set(players=len(players))
+            except OperationalError:
+                # The write lock was held past the database's timeout, or the save could not be serialized;
+                # nothing was saved
+                return games_conflict(game_date, 'Someone else was saving these games at the same time. '
+                                                 'Review their changes and submit again.')
 
-            with transaction.atomic():
-                # Add new games
-                for board, details in new_games_to_db.items():
-                    try:
-                        white_player = Player.objects.get(first_name=details['white'].split(', ')[1],
-                                                          last_name=details['white'].split(', ')[0]) if details[
-                                                                                                            'white'] != "N/A" else None
-                        black_player = Player.objects.get(first_name=details['black'].split(', ')[1],
-                                                          last_name=details['black'].split(', ')[0]) if details[
-                                                                                                            'black'] != "N/A" else None
-                        if details['result'] != "NONE":
-                            games_with_results[board] = [white_player, black_player, details['result']]
-                        Game.add_game(
-                            date_of_match=game_date,
-                            board_letter=board[0],
-                            board_number=int(board[2:]),
-                            white=white_player,
-                            black=black_player,
-                            result=details['result'],
-                            modified_by=user
-                        )
-                        added_games_report.append(f"Added game for board {board}")
-                    except ValidationError as e:
-                        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
-
-                # Deactivate games
-                for board, game in games_not_in_data.items():
-                    game.is_active = False
-                    game.end_at = timezone.now()
-                    game.save()
-                    deactivated_games_report.append(f"Deactivated game for board {board}")
-
-                # Update existing games
-                for board, details in updated_games.items():
-                    db_game = games_db_keyed[board]
-                    white_player = Player.objects.filter(first_name=details['white'].split(', ')[1],
-                                                         last_name=details['white'].split(', ')[0],
-                                                         is_active=True).first() if details[
-                                                                                    'white'] != "N/A" else None
-                    black_player = Player.objects.filter(first_name=details['black'].split(', ')[1],
-                                                         last_name=details['black'].split(', ')[0],
-                                                         is_active=True).first() if details[
-                                                                                    'black'] != "N/A" else None
-                    if details['result'] != "NONE":
-                        games_with_results[board] = [white_player, black_player, details['result']]
-
-                    db_game.update_game(
-                        date_of_match=game_date,
-                        board_letter=board[0],
-                        board_number=int(board[2:]),
-                        white=white_player,
-                        black=black_player,
-                        result=details['result'],
-                        modified_by=user
-                    )
-                    updated_games_report.append(f"Updated game for board {board}")
+            current_span().set(added=len(added_games_report), deactivated=len(deactivated_games_report),
+                               updated=len(updated_games_report), with_results=len(games_with_results))
 
             # Prepare the final response
             response_data = {
@@ -316,44 +487,15 @@ def save_games(request):
                 'deactivated_games': deactivated_games_report,
                 'updated_games': updated_games_report
             }
+            if rerated is not None:
+                response_data['rerated'] = rerated
+            response_data['ratings'] = players
 
-            print(games_with_results)
-            players = []
-
-            with transaction.atomic():
-                for game, details in games_with_results.items():
-                    '''white.append(details[0]) # these are player objects
-                    black.append(details[1])
-                    results.append(details[2])'''
-
-                    if details[0] in Player.objects.filter(is_active=True, is_volunteer=True).all() or details[1] in Player.objects.filter(is_active=True, is_volunteer=True).all():
-                        print("Game has a volunteer playing")
-                        continue
-
-                    else:
-                        if details[2] == 'White':
-                            w_rating = RATINGS_HELPER(details[0].rating, 1,
-                                                      CALC_EXPECTED(details[0].rating, details[1].rating))
-                            b_rating = RATINGS_HELPER(details[1].rating, 0,
-                                                      CALC_EXPECTED(details[1].rating, details[0].rating))
-                        elif details[2] == 'Draw':
-                            w_rating = RATINGS_HELPER(details[0].rating, .5,
-                                                      CALC_EXPECTED(details[0].rating, details[1].rating))
-                            b_rating = RATINGS_HELPER(details[1].rating, .5,
-                                                      CALC_EXPECTED(details[1].rating, details[0].rating))
-                        else:
-                            w_rating = RATINGS_HELPER(details[0].rating, 0,
-                                                      CALC_EXPECTED(details[0].rating, details[1].rating))
-                            b_rating = RATINGS_HELPER(details[1].rating, 1,
-                                                      CALC_EXPECTED(details[1].rating, details[0].rating))
-                        # Add player's new rating
-                        Player.update_rating(details[0], w_rating, details[1], user)
-                        Player.update_rating(details[1], b_rating, details[0], user)
-
-                    players.append(f"{details[0].last_name}, {details[0].first_name}")
-                    players.append(f"{details[1].last_name}, {details[1].first_name}")
+            with span('publish', boards=len(board_updates)):
+                response_data['version'] = Game.date_version(game_date)
 
-            response_data['ratings'] = players
+                if board_updates:
+                    publish_games(game_date, current_version, response_data['version'], board_updates)
 
             return JsonResponse(response_data, status=200)
         except json.JSONDecodeError:
@@ -376,19 +518,127 @@ def download_existing_ratings_sheet(request):
     return redirect('input_results')
 
 
+EXPORT_CONTENT_TYPES = {
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.zip': 'application/zip',
+}
+
+
+def export_response(request, file_path, digest, file_name):
+    # The digest names the workbook's contents, so it doubles as the ETag
+    etag = f'"{digest}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        try:
+            file = open(file_path, 'rb')
+        except FileNotFoundError:
+            # The export cache evicted the file after the job finished
+            return JsonResponse({'status': 'error', 'message': 'This export is no longer available. Start it again.'}, status=410)
+        response = FileResponse(file, as_attachment=True, filename=file_name,
+                                content_type=EXPORT_CONTENT_TYPES[os.path.splitext(file_name)[1]])
+    response['ETag'] = etag
+    return response
+
+
 def download_ratings(request):
-    file_path = write_ratings()
+    return export_response(request, *write_ratings())
 
-    with open(file_path, 'rb') as excel_file:
-        response = HttpResponse(excel_file.read(),
-                                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_path)}"'
-        return response
+
+def download_pairings_archive(request):
+    # Streams a zip of every pairing sheet in the range; sheets are sent as soon as each one is built
+    if request.method == 'POST':
+        form = PairingRangeForm(request.POST)
+        if form.is_valid():
+            start_date = form.cleaned_data['start_date']
+            end_date = form.cleaned_data['end_date']
+            sheets = write_pairings_sheets(start_date, end_date)
+
+            response = StreamingHttpResponse(stream_zip((file_path, file_name) for file_path, _, file_name in sheets),
+                                             content_type=EXPORT_CONTENT_TYPES['.zip'])
+            response['Content-Disposition'] = f'attachment; filename="Pairings_{start_date}_to_{end_date}.zip"'
+            return response
+
+    return redirect('pair')
+
+
+def job_payload(job):
+    payload = job.to_dict()
+    payload['status_url'] = reverse('export_status', args=[job.id])
+    payload['download_url'] = reverse('export_download', args=[job.id])
+    return payload
+
+
+def start_export(request):
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+
+    kind = request.POST.get('kind')
+    if kind == 'ratings':
+        args = ()
+    elif kind == 'pairings':
+        form = PairingDateForm(request.POST)
+        if not form.is_valid():
+            return JsonResponse({'status': 'error', 'message': 'Choose a date of match.'}, status=400)
+        args = (form.cleaned_data['date'],)
+    elif kind == 'pairings_archive':
+        form = PairingRangeForm(request.POST)
+        if not form.is_valid():
+            return JsonResponse({'status': 'error', 'message': ' '.join(form.non_field_errors()) or 'Choose both dates.'}, status=400)
+        args = (form.cleaned_data['start_date'], form.cleaned_data['end_date'])
+    else:
+        return JsonResponse({'status': 'error', 'message': 'Unknown export'}, status=400)
+
+    try:
+        job = submit_export(kind, *args)
+    except JobLimitError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=429)
+
+    return JsonResponse({'status': 'success', 'job': job_payload(job)}, status=202)
+
+
+def export_status(request, job_id):
+    job = get_job(job_id)
+    if job is None:
+        return JsonResponse({'status': 'error', 'message': 'Export not found'}, status=404)
+    return JsonResponse({'status': 'success', 'job': job_payload(job)})
+
+
+def export_download(request, job_id):
+    job = get_job(job_id)
+    if job is None:
+        raise Http404("Export not found")
+    if job.status != 'done':
+        return JsonResponse({'status': 'error', 'message': f'Export is {job.status}', 'job': job_payload(job)}, status=409)
+    return export_response(request, job.file_path, job.digest, job.file_name)
 
 
 def pair_view(request):
     form = PairingDateForm()  # Create an instance of the form
-    return render(request, 'chess/pair.html', {'form': form})
+    range_form = PairingRangeForm()
+    generate_form = GeneratePairingsForm()
+    return render(request, 'chess/pair.html', {'form': form, 'range_form': range_form, 'generate_form': generate_form})
+
+
+def generate_pairings(request):
+    report = None
+
+    if request.method == 'POST':
+        generate_form = GeneratePairingsForm(request.POST)
+        if generate_form.is_valid():
+            date_of_match = generate_form.cleaned_data['date']
+            try:
+                games = create_pairings(date_of_match, request.user)
+                report = f"Created {len(games)} games for {date_of_match}."
+                generate_form = GeneratePairingsForm()
+            except ValidationError as e:
+                generate_form.add_error('date', e)
+    else:
+        generate_form = GeneratePairingsForm()
+
+    form = PairingDateForm()
+    range_form = PairingRangeForm()
+    return render(request, 'chess/pair.html', {'form': form, 'range_form': range_form, 'generate_form': generate_form, 'report': report})
 
 
 def download_pairings(request):
@@ -397,23 +647,7 @@ def download_pairings(request):
         if form.is_valid():
             date_of_match = form.cleaned_data['date']
 
-            file_name = f'Pairings_{date_of_match}.xlsx'
-            file_path = os.path.join(CREATED_PAIRING_FILES_DIR, file_name)
-
-            # if file_name in os.listdir(CREATED_PAIRING_FILES_DIR):
-            #     with open(file_path, 'rb') as f:
-            #         response = HttpResponse(f.read(),
-            #                                 content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            #         response['Content-Disposition'] = f'attachment; filename={file_name}'
-            #         return response
-            # else:
-            file_path = write_pairings(date_of_match)
-
-            with open(file_path, 'rb') as f:
-                response = HttpResponse(f.read(),
-                                        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-                response['Content-Disposition'] = f'attachment; filename=Pairings_{date_of_match}.xlsx'
-                return response
+            return export_response(request, *write_pairings(date_of_match))
     else:
         form = PairingDateForm()
 
@@ -452,21 +686,9 @@ def search_results(request):
             ).order_by('-date_of_match')
             results.extend(game_results)
 
-        # searching a player
-        elif search_type == 'Player':
-            player_results = Player.objects.filter(
-                Q(first_name__icontains=query) & Q(is_active=True) & Q(active_member=True) |
-                Q(last_name__icontains=query) & Q(is_active=True) & Q(active_member=True)
-            ).order_by('-rating', '-grade', 'last_name', 'first_name')
-            results.extend(player_results)
-
-        # search in a class
+        # searching a player or a class
         else:
-            players = Player.objects.filter(
-                Q(lesson_class__teacher__first_name__icontains=query) & Q(is_active=True) |
-                Q(lesson_class__co_teacher__first_name__icontains=query) & Q(is_active=True)
-            ).order_by('-rating', '-grade', 'last_name', 'first_name')
-            results.extend(players)
+            results.extend(search_players(query, search_type))
 
     if not results:
         return render(request, 'chess/search.html', {
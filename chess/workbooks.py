@@ -0,0 +1,184 @@
+import os
+import tempfile
+import threading
+from copy import copy
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles.fonts import Font
+
+# Kept free of Django imports so worker processes can build workbooks without setting Django up
+
+# Ratings sheets longer than this are written with openpyxl's write-only (streaming) workbook
+STREAMING_ROWS = 1000
+
+BOLD_FONT = Font(bold=True)
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def cell_style(cell):
+    return copy(cell.font), copy(cell.fill), copy(cell.border), copy(cell.alignment), cell.number_format
+
+
+def apply_style(cell, style):
+    cell.font, cell.fill, cell.border, cell.alignment, cell.number_format = style
+
+
+class Template:
+    # A template parsed once per process: its cells with their styles, the sheet layout, which row holds
+    # each board (column A) and the fonts needed for volunteers. new_workbook() rebuilds the sheet from
+    # these, so an export never parses the file again.
+
+    def __init__(self, path):
+        sheet = load_workbook(path).active
+
+        self.title = sheet.title
+        self.cells = [(cell.row, cell.column, cell.value, cell_style(cell) if cell.has_style else None)
+                      for row in sheet.iter_rows() for cell in row if cell.value is not None or cell.has_style]
+        self.column_widths = {letter: dimension.width for letter, dimension in sheet.column_dimensions.items()}
+        self.row_heights = {index: dimension.height for index, dimension in sheet.row_dimensions.items() if dimension.height}
+        self.merged_cells = [str(cell_range) for cell_range in sheet.merged_cells.ranges]
+        self.freeze_panes = sheet.freeze_panes
+
+        self.board_rows = {}
+        for row_index, row in enumerate(sheet.iter_rows(min_row=2, max_col=1, values_only=True), start=2):
+            if row[0] is not None and row[0] not in self.board_rows:
+                self.board_rows[row[0]] = row_index
+
+        self.header = [(cell.value, cell_style(cell)) for cell in sheet[1]]
+
+        # Cell styles of the last board row, for boards a large night was paired onto past the template
+        last_row = max(self.board_rows.values(), default=None)
+        self.extra_row_styles = [cell_style(cell) for cell in sheet[last_row]] if last_row is not None else []
+
+        # Fonts of the first data row in bold, for volunteers
+        self.bold_fonts = {}
+        if sheet.max_row >= 2:
+            for cell in sheet[2]:
+                font = copy(cell.font)
+                font.bold = True
+                self.bold_fonts[cell.column_letter] = font
+
+    def new_workbook(self):
+        # A fresh copy of the template, built in memory from the parsed cells
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.title = self.title
+
+        for letter, width in self.column_widths.items():
+            sheet.column_dimensions[letter].width = width
+        for index, height in self.row_heights.items():
+            sheet.row_dimensions[index].height = height
+
+        for row, column, value, style in self.cells:
+            cell = sheet.cell(row=row, column=column, value=value)
+            if style is not None:
+                apply_style(cell, style)
+
+        for cell_range in self.merged_cells:
+            sheet.merge_cells(cell_range)
+        sheet.freeze_panes = self.freeze_panes
+        return workbook
+
+
+def get_template(path):
+    # Parsed templates are reused until the file on disk changes
+    mtime = os.path.getmtime(path)
+    template = _templates.get(path)
+
+    if template is None or template[0] != mtime:
+        with _templates_lock:
+            template = _templates.get(path)
+            if template is None or template[0] != mtime:
+                template = (mtime, Template(path))
+                _templates[path] = template
+
+    return template[1]
+
+
+def fill_ratings(template, rows, new_file_path):
+    # rows: [(name, grade, rating, class name), ...] in sheet order
+    rows = list(rows)
+
+    if len(rows) > STREAMING_ROWS:
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        for letter, width in template.column_widths.items():
+            sheet.column_dimensions[letter].width = width
+
+        header = []
+        for value, style in template.header:
+            cell = WriteOnlyCell(sheet, value=value)
+            apply_style(cell, style)
+            header.append(cell)
+        sheet.append(header)
+
+        for row in rows:
+            sheet.append(row)
+    else:
+        workbook = template.new_workbook()
+        sheet = workbook.active
+        for index, (name, grade, rating, lesson_class) in enumerate(rows, start=2):
+            sheet.cell(row=index, column=1, value=name)
+            sheet.cell(row=index, column=2, value=grade)
+            sheet.cell(row=index, column=3, value=rating)
+            sheet.cell(row=index, column=4, value=lesson_class)
+
+    os.makedirs(os.path.dirname(new_file_path), exist_ok=True)
+    workbook.save(new_file_path)
+    return new_file_path
+
+
+def board_key(board):
+    # G-1 ... J-22, then the extra J boards, in number order
+    letter, _, number = board.partition('-')
+    return letter, int(number) if number.isdigit() else 0
+
+
+def fill_pairings(template, rows, new_file_path):
+    # rows: [(board, white name, white is volunteer, black name, black is volunteer), ...]
+    # Boards that are not on the template (the extra J boards of a night with more pairs than boards) get
+    # rows of their own below the last board, styled like it. Returns those boards.
+    workbook = template.new_workbook()
+    sheet = workbook.active
+
+    extra = sorted({row[0] for row in rows} - template.board_rows.keys(), key=board_key)
+    board_rows = dict(template.board_rows)
+    next_row = max(board_rows.values(), default=1) + 1
+    for board in extra:
+        for column, style in enumerate(template.extra_row_styles, start=1):
+            apply_style(sheet.cell(row=next_row, column=column), style)
+        sheet.cell(row=next_row, column=1, value=board)
+        board_rows[board] = next_row
+        next_row += 1
+
+    for board, white_name, white_is_volunteer, black_name, black_is_volunteer in rows:
+        matching_row = board_rows[board]
+
+        white_cell = sheet.cell(row=matching_row, column=2, value=white_name)
+        if white_is_volunteer:
+            white_cell.font = template.bold_fonts.get('B', BOLD_FONT)
+
+        black_cell = sheet.cell(row=matching_row, column=4, value=black_name)
+        if black_is_volunteer:
+            black_cell.font = template.bold_fonts.get('D', BOLD_FONT)
+
+    os.makedirs(os.path.dirname(new_file_path), exist_ok=True)
+    workbook.save(new_file_path)
+    return extra
+
+
+def build_file(fill, template_path, rows, file_path):
+    # Runs fill_ratings or fill_pairings into file_path under a temporary name first, so a concurrent
+    # reader never sees a half-written file. Returns what fill returns. Worker processes call this directly.
+    handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(file_path))
+    os.close(handle)
+    try:
+        result = fill(get_template(template_path), rows, temp_path)
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return result
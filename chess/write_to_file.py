@@ -1,75 +1,283 @@
-from openpyxl import load_workbook
-from openpyxl.styles.fonts import Font
-
 from .models import Player, Game
+from .tracing import current_span, span
+from .workbooks import fill_ratings, fill_pairings, build_file
+import hashlib
+import logging
+import multiprocessing
 import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from django.conf import settings
 from datetime import datetime
 
-def write_ratings():
-    file_path = os.path.join(settings.BASE_DIR, 'files', 'RatingsTemplate.xlsx')
-    workbook = load_workbook(file_path)
-    sheet = workbook.active
+RATINGS_TEMPLATE = os.path.join(settings.BASE_DIR, 'files', 'RatingsTemplate.xlsx')
+PAIRINGS_TEMPLATE = os.path.join(settings.BASE_DIR, 'files', 'PairingTemplate.xlsx')
+RATINGS_DIR = os.path.join(settings.BASE_DIR, 'files', 'ratings')
+PAIRINGS_DIR = os.path.join(settings.BASE_DIR, 'files', 'pairings')
 
-    students = Player.objects.filter(active_member=True, is_volunteer=False, is_active=True).order_by('-rating', '-grade', 'last_name', 'first_name')
+# Generated workbooks are stored under these folders named by the hash of their contents, so a download
+# whose data has not changed is served from disk. The least recently served are removed once a folder
+# grows past EXPORT_CACHE_MAX_BYTES.
+EXPORT_CACHE_DIR = 'cache'
+EXPORT_CACHE_MAX_BYTES = getattr(settings, 'EXPORT_CACHE_MAX_BYTES', 64 * 1024 * 1024)
 
-    start_row = 2
+# Worker processes for building several pairing sheets at once. They are spawned (not forked) and only
+# import chess.workbooks, so they never touch Django or the database.
+EXPORT_PROCESSES = getattr(settings, 'EXPORT_PROCESSES', os.cpu_count() or 1)
 
-    for index, student in enumerate(students, start=start_row):
-        sheet[f'A{index}'] = student.name()  # Name
-        sheet[f'B{index}'] = student.grade  # Grade
-        sheet[f'C{index}'] = student.rating  # Rating
-        sheet[f'D{index}'] = student.lesson_class.name if student.lesson_class else ''
+ZIP_CHUNK_SIZE = 64 * 1024
 
-    date = datetime.now().strftime('%m-%d-%Y')
+logger = logging.getLogger('chess.exports')
 
-    # Save the file in a location accessible for downloads (e.g., media/ratings)
-    new_file_path = os.path.join(settings.BASE_DIR, 'files','ratings', f'Ratings_{date}.xlsx')
-    os.makedirs(os.path.dirname(new_file_path), exist_ok=True)
-    workbook.save(new_file_path)
+_pool = None
+_pool_lock = threading.Lock()
 
-    return new_file_path
 
+def ratings_rows():
+    # One query: name, grade, rating and class for every active student, in sheet order
+    students = Player.objects.filter(active_member=True, is_volunteer=False, is_active=True).order_by(
+        '-rating', '-grade', 'last_name', 'first_name').values_list(
+        'first_name', 'last_name', 'grade', 'rating', 'lesson_class__name')
 
-def write_pairings(submitted_date):
-    file_path = os.path.join(settings.BASE_DIR, 'files', 'PairingTemplate.xlsx')
-    workbook = load_workbook(file_path)
-    sheet = workbook.active
+    return [(f"{last_name}, {first_name}", grade, rating, lesson_class or '')
+            for first_name, last_name, grade, rating, lesson_class in students]
+
+
+def pairings_games(**filters):
+    return Game.objects.filter(is_active=True, tournament_round__isnull=True, **filters).values_list(
+        'date_of_match', 'board_letter', 'board_number',
+        'white__first_name', 'white__last_name', 'white__is_volunteer',
+        'black__first_name', 'black__last_name', 'black__is_volunteer').order_by('date_of_match', 'board_letter', 'board_number')
+
+
+def pairing_row(board_letter, board_number, white_first, white_last, white_is_volunteer, black_first, black_last, black_is_volunteer):
+    return (f"{board_letter}-{board_number}",
+            f"{white_last}, {white_first}" if white_first is not None else "", bool(white_is_volunteer),
+            f"{black_last}, {black_first}" if black_first is not None else "", bool(black_is_volunteer))
+
+
+def pairings_rows(submitted_date):
+    # One query: board and both players for every club game on the date
+    return [pairing_row(*game) for _, *game in pairings_games(date_of_match=submitted_date)]
+
+
+def pairings_rows_by_date(start_date, end_date):
+    # One query for every club night in the range: {date: rows}
+    rows = {}
+    for date_of_match, *game in pairings_games(date_of_match__range=(start_date, end_date)):
+        rows.setdefault(date_of_match, []).append(pairing_row(*game))
+    return rows
+
+
+def export_digest(template_path, rows):
+    digest = hashlib.sha256(f"{os.path.basename(template_path)}:{os.path.getmtime(template_path)}".encode())
+    for row in rows:
+        digest.update(repr(row).encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def evict_exports(cache_dir):
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.name.endswith(('.xlsx', '.zip')):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= EXPORT_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def cache_path(directory, digest, extension):
+    # Returns (path, whether it is already cached)
+    cache_dir = os.path.join(directory, EXPORT_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    file_path = os.path.join(cache_dir, f'{digest}{extension}')
+
+    if os.path.exists(file_path):
+        # Mark as recently used
+        os.utime(file_path)
+        return file_path, True
+    return file_path, False
+
+
+def cached_export(directory, template_path, rows, fill):
+    # Returns (path, digest, result of fill or None if cached) of the workbook for these rows,
+    # building it only if it is not cached yet
+    with span('cache lookup') as trace:
+        digest = export_digest(template_path, rows)
+        file_path, cached = cache_path(directory, digest, '.xlsx')
+        trace.set(cached=cached)
+    if cached:
+        return file_path, digest, None
+
+    with span('build', rows=len(rows)):
+        result = build_file(fill, template_path, rows, file_path)
+    with span('evict'):
+        evict_exports(os.path.dirname(file_path))
+    return file_path, digest, result
 
-    # Define bold font
-    bold_font = Font(bold=True)
 
-    games = Game.objects.filter(date_of_match=submitted_date, is_active=True)
+def link_file(source, destination):
+    # Makes destination a copy of source, sharing the file on disk where possible
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        return
+    temp_path = destination + '.tmp'
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        shutil.copyfile(source, temp_path)
+    os.replace(temp_path, destination)
 
-    for game in games:
-        white_player = game.white.name() if game.white else ""
-        black_player = game.black.name() if game.black else ""
-        board = game.get_board()
 
-        matching_row = None
-        for row_index, row in enumerate(sheet.iter_rows(min_row=2, max_col=1, values_only=True), start=2):
-            if row[0] == board:
-                matching_row = row_index
-                break
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=EXPORT_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
 
-        if matching_row:
-            white_cell = sheet[f'B{matching_row}']
-            white_cell.value = white_player
 
-            if game.white and game.white.is_volunteer:
-                white_cell.font = bold_font
+def report_extra_boards(submitted_date, boards):
+    if boards:
+        logger.info('Pairings for %s add rows below the template for %s', submitted_date, ', '.join(boards))
 
-            black_cell = sheet[f'D{matching_row}']
-            black_cell.value = black_player
 
-            if game.black and game.black.is_volunteer:
-                black_cell.font = bold_font
+@span('write_ratings')
+def write_ratings():
+    # Returns (path, digest, download name). Today's sheet is also kept as Ratings_<date>.xlsx for the
+    # pre-existing sheets list.
+    with span('rows'):
+        rows = ratings_rows()
+    file_path, digest, _ = cached_export(RATINGS_DIR, RATINGS_TEMPLATE, rows, fill_ratings)
+
+    date = datetime.now().strftime('%m-%d-%Y')
+    file_name = f'Ratings_{date}.xlsx'
+    link_file(file_path, os.path.join(RATINGS_DIR, file_name))
+
+    return file_path, digest, file_name
+
+
+@span('write_pairings')
+def write_pairings(submitted_date):
+    # Returns (path, digest, download name)
+    current_span().set(date=submitted_date)
+    with span('rows'):
+        rows = pairings_rows(submitted_date)
+    file_path, digest, extra = cached_export(PAIRINGS_DIR, PAIRINGS_TEMPLATE, rows, fill_pairings)
+    report_extra_boards(submitted_date, extra)
+    return file_path, digest, f'Pairings_{submitted_date}.xlsx'
+
 
+def write_pairings_sheets(start_date, end_date):
+    # Yields (path, digest, download name) for every club night in the range, as each sheet is ready.
+    # Cached sheets come first; the rest are built in parallel by the worker processes from rows
+    # fetched here, so the workers never query the database.
+    to_build = []
+    for date_of_match, rows in pairings_rows_by_date(start_date, end_date).items():
+        digest = export_digest(PAIRINGS_TEMPLATE, rows)
+        file_path, cached = cache_path(PAIRINGS_DIR, digest, '.xlsx')
+        if cached:
+            yield file_path, digest, f'Pairings_{date_of_match}.xlsx'
         else:
-            print(f"No matching board found for game: {game}")
+            to_build.append((date_of_match, rows, digest, file_path))
+
+    if len(to_build) == 1:
+        date_of_match, rows, digest, file_path = to_build[0]
+        report_extra_boards(date_of_match, build_file(fill_pairings, PAIRINGS_TEMPLATE, rows, file_path))
+        yield file_path, digest, f'Pairings_{date_of_match}.xlsx'
+
+    elif to_build:
+        pool = get_pool()
+        try:
+            futures = {pool.submit(build_file, fill_pairings, PAIRINGS_TEMPLATE, rows, file_path): (date_of_match, digest, file_path)
+                       for date_of_match, rows, digest, file_path in to_build}
+            for future in as_completed(futures):
+                date_of_match, digest, file_path = futures[future]
+                report_extra_boards(date_of_match, future.result())
+                yield file_path, digest, f'Pairings_{date_of_match}.xlsx'
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool next time
+            global _pool
+            with _pool_lock:
+                if _pool is pool:
+                    _pool = None
+            raise
+
+    if to_build:
+        evict_exports(os.path.join(PAIRINGS_DIR, EXPORT_CACHE_DIR))
+
+
+class ZipBuffer:
+    # Write-only file object for zipfile; stream_zip hands out whatever has been written so far.
+    # It has no seek(), so zipfile writes sizes after each entry instead of going back to fill them in.
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(files):
+    # Yields a zip of [(path, name in the archive), ...] a chunk at a time, holding at most one chunk in memory.
+    # The sheets are already compressed, so they are stored as they are.
+    buffer = ZipBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for file_path, name in files:
+            with open(file_path, 'rb') as source, archive.open(name, 'w') as target:
+                for chunk in iter(lambda: source.read(ZIP_CHUNK_SIZE), b''):
+                    target.write(chunk)
+                    yield buffer.take()
+            yield buffer.take()
+    yield buffer.take()
+
+
+def write_pairings_archive(start_date, end_date):
+    # Every club night's pairing sheet between the two dates, zipped into the cache.
+    # Returns (path, digest, download name).
+    sheets = sorted(write_pairings_sheets(start_date, end_date), key=lambda sheet: sheet[2])
+
+    digest = hashlib.sha256(''.join(sheet_digest for _, sheet_digest, _ in sheets).encode()).hexdigest()
+    file_path, cached = cache_path(PAIRINGS_DIR, digest, '.zip')
+    file_name = f'Pairings_{start_date}_to_{end_date}.zip'
+    if cached:
+        return file_path, digest, file_name
 
-    new_file_path = os.path.join(settings.BASE_DIR, 'files', 'pairings', f'Pairings_{submitted_date}.xlsx')
-    os.makedirs(os.path.dirname(new_file_path), exist_ok=True)
-    workbook.save(new_file_path)
+    handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(file_path))
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            for chunk in stream_zip((sheet_path, sheet_name) for sheet_path, _, sheet_name in sheets):
+                f.write(chunk)
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
-    return new_file_path
\ No newline at end of file
+    evict_exports(os.path.dirname(file_path))
+    return file_path, digest, file_name
@@ -6,4 +6,6 @@ python3 manage.py createsuperuser
 
 python3 manage.py import_data files/volunteers2024.csv files/classes2024.csv files/players2024.csv
 
-python3 manage.py import_game files/pairings2024.csv 2024-09-26
\ No newline at end of file
+python3 manage.py import_game files/pairings2024.csv 2024-09-26
+# Without the club's files, a generated club instead:
+# python3 manage.py seed_synthetic --players 300
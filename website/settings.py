@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'chess.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,6 +85,31 @@ DATABASES = {
 }
 
 
+# Page fragments and the version counters they are keyed by (chess/versions.py). A file cache is shared
+# by every worker process on the machine, so a change saved through one worker invalidates the others.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'files' / 'django_cache',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    }
+}
+
+# chess.tracing writes one JSON line per traced operation; chess.metrics logs slow requests
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(asctime)s %(name)s %(levelname)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'message'},
+    },
+    'loggers': {
+        'chess': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 